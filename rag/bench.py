@@ -0,0 +1,489 @@
+# bench.py — offline benchmarks for SheBots RAG
+# - cleaner throughput over saved pages (fixtures/pages)
+# - retrieval latency / QPS / recall over synthetic corpora (hash embedder)
+# - ingest throughput over saved fixtures served by a local HTTP stand-in
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import resource
+import shutil
+import tempfile
+import threading
+import tracemalloc
+from pathlib import Path
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import numpy as np
+import faiss
+
+from .clean import clean_html_strict
+
+FIXTURE_DIR = Path(__file__).resolve().parent / "fixtures"
+DEFAULT_PAGES_DIR = FIXTURE_DIR / "pages"
+MANUAL_DATA_DIR = Path(__file__).resolve().parent.parent / "manual_data"
+DEFAULT_INGEST_FIXTURES = (FIXTURE_DIR, MANUAL_DATA_DIR)
+
+
+def load_pages(pages_dir=DEFAULT_PAGES_DIR):
+    """Read every saved *.html page under pages_dir."""
+    pages = []
+    for path in sorted(Path(pages_dir).glob("**/*.html")):
+        pages.append((path.name, path.read_text(encoding="utf-8", errors="replace")))
+    return pages
+
+
+def bench_clean(pages_dir=DEFAULT_PAGES_DIR, repeat=20, site="cse.knu.ac.kr"):
+    """Measure clean_html_strict throughput (pages/sec) over a fixture corpus."""
+    pages = load_pages(pages_dir)
+    if not pages:
+        raise SystemExit(f"No *.html fixtures found in {pages_dir}")
+
+    total_bytes = sum(len(html.encode("utf-8")) for _, html in pages)
+    out_chars = sum(len(clean_html_strict(html, site)) for _, html in pages)  # warm-up
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _, html in pages:
+            clean_html_strict(html, site)
+    elapsed = time.perf_counter() - start
+
+    n = len(pages) * repeat
+    return {
+        "pages": len(pages),
+        "repeat": repeat,
+        "seconds": round(elapsed, 4),
+        "pages_per_sec": round(n / elapsed, 1) if elapsed else None,
+        "mb_per_sec": round(total_bytes * repeat / elapsed / 1e6, 3) if elapsed else None,
+        "input_bytes": total_bytes,
+        "output_chars": out_chars,
+    }
+
+
+# ---------------------------------------------------------
+# RETRIEVAL BENCHMARK
+# ---------------------------------------------------------
+DOMAIN_TERMS = [
+    "졸업", "요건", "학점", "전공", "필수", "교양", "현장실습", "인턴십", "글솝", "심컴",
+    "credits", "graduation", "requirements", "major", "internship", "abeek", "toeic",
+    "data", "science", "platform", "software", "computing", "capstone", "semester",
+]
+
+
+class SyntheticCorpus:
+    """Deterministic topic-structured chunks, so keyword and semantic paths both have signal."""
+
+    def __init__(self, seed=13, topics=200, words_per_topic=40, vocab_size=20000, chunk_words=60):
+        rng = random.Random(seed)
+        self.seed = seed
+        self.chunk_words = chunk_words
+        self.vocab = DOMAIN_TERMS + [f"w{i}" for i in range(vocab_size)]
+        self.topics = [rng.sample(self.vocab, words_per_topic) for _ in range(topics)]
+
+    def chunks(self, n, start=0):
+        for i in range(start, start + n):
+            rng = random.Random(self.seed * 1_000_003 + i)
+            topic = i % len(self.topics)
+            words = [
+                rng.choice(self.topics[topic]) if rng.random() < 0.7 else rng.choice(self.vocab)
+                for _ in range(self.chunk_words)
+            ]
+            meta = {
+                "url": f"synthetic://doc/{i // 8}",
+                "title": f"topic {topic}",
+                "chunk_id": f"syn_{i}",
+                "source_type": "synthetic",
+                "fetched_at": 1_700_000_000 + i,
+            }
+            yield " ".join(words), meta
+
+    def queries(self, n, seed=None):
+        rng = random.Random(self.seed + 1 if seed is None else seed)
+        out = []
+        for _ in range(n):
+            topic = rng.choice(self.topics)
+            out.append(" ".join(rng.sample(topic, rng.randint(2, 5))))
+        return out
+
+
+def build_synthetic_store(out_dir, n, embedder, index_factory="Flat", corpus=None, batch=10000):
+    """Write faiss_index + docstore.jsonl + keyword index for n synthetic chunks.
+
+    Returns (build_seconds, normalized vectors) — the vectors are kept for
+    exact-search recall.
+    """
+    from .store import FaissStore, Doc
+    from .keyword_index import KeywordIndex, keyword_index_path
+
+    corpus = corpus or SyntheticCorpus()
+    os.makedirs(out_dir, exist_ok=True)
+    index_path = os.path.join(out_dir, "faiss_index")
+    docstore_path = os.path.join(out_dir, "docstore.jsonl")
+    dim = embedder.get_sentence_embedding_dimension()
+
+    vectors = np.zeros((n, dim), dtype="float32")
+    build_start = time.perf_counter()
+    store = FaissStore(dim, index_path, docstore_path, index_factory=index_factory)
+    store.load_or_create(with_docstore=False)
+
+    texts, metas = [], []
+    for text, meta in corpus.chunks(n):
+        texts.append(text)
+        metas.append(meta)
+    t0 = time.perf_counter()
+    for start in range(0, n, batch):
+        vectors[start:start + batch] = embedder.encode(texts[start:start + batch])
+    embed_seconds = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    store.upsert(vectors, [Doc(t, m) for t, m in zip(texts, metas)])
+    store.persist()
+    keywords = KeywordIndex(keyword_index_path(docstore_path))
+    keywords.sync(store.docstore)
+    keywords.persist()
+    index_seconds = time.perf_counter() - t0
+
+    faiss.normalize_L2(vectors)
+    return {
+        "total_seconds": round(time.perf_counter() - build_start, 3),
+        "embed_seconds": round(embed_seconds, 3),
+        "index_seconds": round(index_seconds, 3),
+    }, vectors
+
+
+def _percentiles(values_ms):
+    arr = np.asarray(values_ms, dtype=np.float64)
+    return {
+        "p50": round(float(np.percentile(arr, 50)), 3),
+        "p95": round(float(np.percentile(arr, 95)), 3),
+        "p99": round(float(np.percentile(arr, 99)), 3),
+        "mean": round(float(arr.mean()), 3),
+    }
+
+
+def rss_mb():
+    """Current resident set size (Linux /proc), falling back to peak RSS."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / 1e6, 1)
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return round(peak / 1e6 if sys.platform == "darwin" else peak * 1024 / 1e6, 1)
+
+
+def _search_module(dim):
+    """Import rag_main wired to the hash embedder (must happen before any other import of it)."""
+    model = f"hash:{dim}"
+    if "rag.rag_main" in sys.modules:
+        rag_main = sys.modules["rag.rag_main"]
+        if getattr(rag_main.embedder, "dim", None) != dim:
+            raise SystemExit("rag_main already loaded with a different embedder; run the benchmark in a fresh process")
+        return rag_main
+    os.environ["EMBEDDING_MODEL"] = model
+    from . import rag_main
+    return rag_main
+
+
+def _point_search_at(rag_main, data_dir):
+    rag_main.INDEX_PATH = os.path.join(data_dir, "faiss_index")
+    rag_main.DOCSTORE_PATH = os.path.join(data_dir, "docstore.jsonl")
+    rag_main._corpus = None
+
+
+def _recall_at_k(store, embedder, vectors, queries, k):
+    hits = 0
+    for q in queries:
+        qv = embedder.encode([q])[0]
+        _, approx = store.search_ids(qv, k=k)
+        exact = np.argpartition(-(vectors @ qv), k - 1)[:k]
+        hits += len(set(approx.tolist()) & set(exact.tolist()))
+    return round(hits / (len(queries) * k), 4)
+
+
+def bench_search(
+    sizes=(10000,),
+    n_queries=200,
+    k=5,
+    threads=(1, 4),
+    dim=384,
+    index_factory="Flat",
+    seed=13,
+    queries=None,
+    work_dir=None,
+    semantic_cache=False,
+):
+    """Build synthetic corpora, replay queries through rag_search and report
+    p50/p95/p99 latency, QPS per thread count, RSS, build time and recall@k
+    of the semantic index versus exact search.
+
+    The semantic answer cache is bypassed unless semantic_cache=True (a
+    replayed query set would otherwise measure cache hits); each run reports
+    its hit rate either way."""
+    rag_main = _search_module(dim)
+    embedder = rag_main.embedder
+    corpus = SyntheticCorpus(seed=seed)
+    queries = list(queries) if queries else corpus.queries(n_queries)
+
+    runs = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        for n in sizes:
+            data_dir = os.path.join(tmp, f"n{n}")
+            build, vectors = build_synthetic_store(data_dir, n, embedder, index_factory, corpus)
+            _point_search_at(rag_main, data_dir)
+
+            def search(q):
+                return rag_main.rag_search(q, k, cache=semantic_cache)
+
+            # warm caches (corpus, postings, index) before timing
+            rag_main.semantic_cache.clear()
+            search(queries[0])
+
+            latencies = []
+            responses = []
+            for q in queries:
+                t0 = time.perf_counter()
+                responses.append(search(q))
+                latencies.append((time.perf_counter() - t0) * 1000.0)
+
+            qps = {}
+            for n_threads in threads:
+                t0 = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=n_threads) as pool:
+                    responses.extend(pool.map(search, queries))
+                qps[str(n_threads)] = round(len(queries) / (time.perf_counter() - t0), 1)
+            hits = sum(1 for r in responses if "cached" in r)
+
+            store = rag_main.build_store(dim)
+            runs.append({
+                "chunks": n,
+                "build": build,
+                "index_bytes": os.path.getsize(rag_main.INDEX_PATH),
+                "latency_ms": _percentiles(latencies),
+                "qps": qps,
+                "semantic_cache_hit_rate": round(hits / len(responses), 4) if responses else 0.0,
+                f"recall_at_{k}": _recall_at_k(store, embedder, vectors, queries, k),
+                "rss_mb": rss_mb(),
+                "peak_rss_mb": peak_rss_mb(),
+            })
+            del vectors
+
+    return {
+        "benchmark": "search",
+        "config": {
+            "sizes": list(sizes),
+            "queries": len(queries),
+            "k": k,
+            "threads": list(threads),
+            "dim": dim,
+            "index_factory": index_factory,
+            "seed": seed,
+            "semantic_cache": semantic_cache,
+        },
+        "environment": _environment(),
+        "runs": runs,
+    }
+
+
+def _environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "faiss": getattr(faiss, "__version__", "unknown"),
+        "timestamp": int(time.time()),
+    }
+
+
+def write_report(report, out_path):
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+# ---------------------------------------------------------
+# INGEST BENCHMARK
+# ---------------------------------------------------------
+ATTACHMENT_EXTS = {".pdf", ".docx", ".doc", ".hwp"}
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer:
+    """Local HTTP stand-in for cse.knu.ac.kr serving a directory."""
+
+    def __init__(self, root):
+        self.root = str(root)
+        self.httpd = None
+
+    def __enter__(self):
+        handler = partial(_QuietHandler, directory=self.root)
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def collect_fixtures(dirs=DEFAULT_INGEST_FIXTURES):
+    """Group fixture files by kind: html pages, attachments, plain text."""
+    found = {"html": [], "attachments": [], "text": []}
+    for d in dirs:
+        for path in sorted(Path(d).glob("**/*")):
+            ext = path.suffix.lower()
+            if not path.is_file():
+                continue
+            if ext in (".html", ".htm"):
+                found["html"].append(path)
+            elif ext in ATTACHMENT_EXTS:
+                found["attachments"].append(path)
+            elif ext == ".txt":
+                found["text"].append(path)
+    return found
+
+
+def _stage_site(site_dir, fixtures):
+    """Copy fixtures under ASCII names and write an index page linking the attachments.
+
+    The crawler only keeps pages with >= 400 characters of text, so the
+    index page carries a description paragraph besides the links.
+    """
+    pages = []
+    os.makedirs(os.path.join(site_dir, "pages"))
+    os.makedirs(os.path.join(site_dir, "files"))
+    for i, path in enumerate(fixtures["html"]):
+        name = f"pages/page_{i}.html"
+        shutil.copyfile(path, os.path.join(site_dir, name))
+        pages.append(name)
+
+    links = []
+    for i, path in enumerate(fixtures["attachments"]):
+        name = f"files/attachment_{i}{path.suffix.lower()}"
+        shutil.copyfile(path, os.path.join(site_dir, name))
+        links.append(f'<li><a href="/{name}">{path.name}</a> ({path.stat().st_size} bytes)</li>')
+
+    intro = (
+        "<p>Offline ingest benchmark fixture index. This page stands in for a KNU CSE "
+        "board post with attachments: every linked file below is a saved copy of a "
+        "document the production crawler downloads and extracts (PDF, DOCX, HWP). "
+        "The text of this paragraph only exists so that the crawler's minimum page "
+        "length check keeps the page and follows its attachment links.</p>"
+    )
+    with open(os.path.join(site_dir, "index.html"), "w", encoding="utf-8") as f:
+        f.write(
+            "<html><head><title>ingest fixtures</title></head><body><main>"
+            f"<h1>Fixture attachments</h1>{intro}<ul>{''.join(links)}</ul>"
+            "</main></body></html>"
+        )
+    return pages
+
+
+def _stage_rates(stats):
+    """Seconds and items per second per ingest stage.
+
+    Stage time is summed over all source types, so there is no per-stage
+    byte count to divide by; MB/s is only reported for the whole run.
+    """
+    rates = {}
+    for stage, seconds in stats.get("stageSeconds", {}).items():
+        # one call per item the stage handled: a document (extract, clean,
+        # split) or a batch (embed, persist)
+        calls = stats.get("stageCounts", {}).get(stage, 0)
+        rates[stage] = {
+            "seconds": seconds,
+            "calls": calls,
+            "items_per_sec": round(calls / seconds, 2) if seconds else None,
+        }
+    return rates
+
+
+def bench_ingest(fixture_dirs=DEFAULT_INGEST_FIXTURES, model="hash:384", repeat=1, trace_memory=False, work_dir=None):
+    """Run ingest() against saved fixtures served locally; report per-stage
+    docs/sec and MB/sec, embed time and peak memory."""
+    from .ingest import ingest
+
+    fixtures = collect_fixtures(fixture_dirs)
+    if not any(fixtures.values()):
+        raise SystemExit(f"No fixtures found in {[str(d) for d in fixture_dirs]}")
+    total_bytes = sum(p.stat().st_size for paths in fixtures.values() for p in paths)
+
+    runs = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        site_dir = os.path.join(tmp, "site")
+        pages = _stage_site(site_dir, fixtures)
+        os.environ["ATTACHMENT_DIR"] = os.path.join(tmp, "attachments")
+
+        with FixtureServer(site_dir) as server:
+            base = server.base_url
+            for run in range(repeat):
+                out_dir = os.path.join(tmp, f"run{run}")
+                shutil.rmtree(os.environ["ATTACHMENT_DIR"], ignore_errors=True)
+                if trace_memory:
+                    tracemalloc.start()
+                t0 = time.perf_counter()
+                stats = ingest(
+                    [f"{base}/index.html"],
+                    [f"{base}/"],
+                    index_path=os.path.join(out_dir, "faiss_index"),
+                    docstore_path=os.path.join(out_dir, "docstore.jsonl"),
+                    embedding_model=model,
+                    max_pages=1,
+                    max_depth=0,
+                    delay_ms=0,
+                    manual_urls=[f"{base}/{p}" for p in pages],
+                    pdf_files=[],
+                    docx_files=[],
+                    text_files=[str(p) for p in fixtures["text"]],
+                    crawl_enabled=bool(fixtures["attachments"]),
+                )
+                elapsed = time.perf_counter() - t0
+                python_peak = None
+                if trace_memory:
+                    python_peak = round(tracemalloc.get_traced_memory()[1] / 1e6, 1)
+                    tracemalloc.stop()
+
+                runs.append({
+                    "seconds": round(elapsed, 3),
+                    "docs_per_sec": round(sum(s["docs"] for s in stats["sources"].values()) / elapsed, 2),
+                    "mb_per_sec": round(total_bytes / elapsed / 1e6, 3),
+                    "chunks": stats["chunksAdded"],
+                    "embed_seconds": stats["stageSeconds"].get("embed"),
+                    "stages": _stage_rates(stats),
+                    "sources": stats["sources"],
+                    "peak_rss_mb": peak_rss_mb(),
+                    "python_peak_mb": python_peak,
+                })
+
+    return {
+        "benchmark": "ingest",
+        "config": {
+            "fixture_dirs": [str(d) for d in fixture_dirs],
+            "model": model,
+            "repeat": repeat,
+            "fixtures": {kind: len(paths) for kind, paths in fixtures.items()},
+            "fixture_bytes": total_bytes,
+        },
+        "environment": _environment(),
+        "runs": runs,
+    }
@@ -0,0 +1,537 @@
+# changelog.py — append-only change log on top of a published snapshot
+#
+# A small publish (a scheduler refresh, a file the watcher saw change) used
+# to rewrite the whole index, docstore and every sidecar into a new
+# snapshot. With the change log it appends one record instead, next to the
+# live snapshot's docstore:
+#   changes.f32     normalized float32 vectors of the added rows, back to back
+#   changes.jsonl   one record per publish:
+#                   {"op": "add" | "delete" | "replace", "ts",
+#                    "delete": [[url, source_type], ...],   rows dropped first
+#                    "rows": [docstore rows added],
+#                    "dim", "vectors": [byte offset, count] into changes.f32,
+#                    "texts": {doc_id: text}}               hierarchy.py parents
+# so a publish writes in proportion to its own size. Vectors are written
+# and fsynced before their record; a torn last line (crash mid-append) is
+# ignored by readers and cut off by the next append.
+#
+# Search workers keep the snapshot as loaded (memory-mapped, shared) and
+# put an Overlay beside it: log rows are numbered after the snapshot's and
+# searched in a small side index, dropped rows are masked out. When the log
+# grows only the new records are read. Writers that need the whole corpus
+# in one index (compaction, a full publish) load() it, which replay()s the
+# log onto a private copy in one rebuild. Once the log holds more
+# than CHANGELOG_COMPACT_RATIO of the snapshot's rows (at least
+# CHANGELOG_COMPACT_MIN_ROWS) or CHANGELOG_MAX_RECORDS records, ingest
+# compacts it in the background into a clean snapshot with an empty log.
+#
+# The log files are the only files of a snapshot that change after publish;
+# they are left out of its manifest checksums (snapshots.py).
+
+import os
+import json
+import time
+import logging
+from collections import defaultdict
+
+import numpy as np
+import faiss
+
+from .store import FaissStore
+from .keyword_index import KeywordIndex, keyword_index_path, chunk_stats
+from .filters import MetadataColumns
+from . import hierarchy
+
+logger = logging.getLogger(__name__)
+
+# 0 = every publish writes a full snapshot
+CHANGELOG = os.getenv("CHANGELOG", "1").lower() in ("1", "true", "yes")
+CHANGELOG_COMPACT_RATIO = float(os.getenv("CHANGELOG_COMPACT_RATIO", "0.1"))
+CHANGELOG_COMPACT_MIN_ROWS = int(os.getenv("CHANGELOG_COMPACT_MIN_ROWS", "1000"))
+CHANGELOG_MAX_RECORDS = int(os.getenv("CHANGELOG_MAX_RECORDS", "100"))
+
+LOG_FILE = "changes.jsonl"
+VECTORS_FILE = "changes.f32"
+
+
+def log_path(docstore_path: str) -> str:
+    return os.path.join(os.path.dirname(docstore_path) or ".", LOG_FILE)
+
+
+def vectors_path(docstore_path: str) -> str:
+    return os.path.join(os.path.dirname(docstore_path) or ".", VECTORS_FILE)
+
+
+def pending(docstore_path: str) -> int:
+    """Bytes of change log on top of this docstore (0 = none)."""
+    try:
+        return os.path.getsize(log_path(docstore_path))
+    except OSError:
+        return 0
+
+
+def _sync_append(path: str, data: bytes) -> int:
+    """Append data durably; returns the offset it was written at."""
+    with open(path, "ab") as f:
+        offset = f.tell()
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return offset
+
+
+def _cut_torn_line(path: str):
+    """Drop a partial last record left by a crash, so new records start on a fresh line."""
+    try:
+        with open(path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            if not size:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            f.seek(0)
+            data = f.read()
+            f.truncate(data.rfind(b"\n") + 1)
+            logger.warning(f"Dropped a torn record at the end of {path}")
+    except FileNotFoundError:
+        pass
+
+
+def append(docstore_path: str, rows: list, vectors=None, delete=(), texts: dict | None = None) -> dict:
+    """Append one change on top of the snapshot at docstore_path.
+
+    `delete` is a collection of (url, source_type) whose rows are dropped
+    before `rows` (with their `vectors`, one per row) are added. Callers
+    serialize appends (snapshots.publish_lock). Returns the record written,
+    without rows and texts.
+    """
+    record = {
+        "op": "replace" if delete and rows else "delete" if delete else "add",
+        "ts": int(time.time()),
+        "delete": sorted([url, source_type] for url, source_type in delete),
+        "rows": rows,
+        "texts": texts or {},
+    }
+    if rows:
+        vecs = np.array(vectors, dtype=np.float32)
+        if vecs.shape[0] != len(rows):
+            raise ValueError(f"{len(rows)} rows but {vecs.shape[0]} vectors")
+        faiss.normalize_L2(vecs)
+        offset = _sync_append(vectors_path(docstore_path), vecs.tobytes())
+        record["dim"] = int(vecs.shape[1])
+        record["vectors"] = [offset, len(rows)]
+
+    path = log_path(docstore_path)
+    _cut_torn_line(path)
+    _sync_append(path, (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+    logger.info(f"Change log: {record['op']} {len(rows)} rows, {len(record['delete'])} sources dropped")
+    return {k: v for k, v in record.items() if k not in ("rows", "texts")}
+
+
+def read(docstore_path: str, start: int = 0, end: int | None = None, vectors: bool = True):
+    """(records, end offset) of the log between byte offsets start and end.
+
+    With vectors=True each record with rows gets them as record["vecs"]
+    (float32 [rows, dim]). Reading stops at the first torn record.
+    """
+    path = log_path(docstore_path)
+    try:
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read() if end is None else f.read(max(0, end - start))
+    except FileNotFoundError:
+        return [], start
+    vec_path = vectors_path(docstore_path)
+    vec_size = os.path.getsize(vec_path) if os.path.exists(vec_path) else 0
+
+    records = []
+    pos = start
+    for line in data.splitlines(keepends=True):
+        if not line.endswith(b"\n"):
+            break
+        try:
+            record = json.loads(line)
+        except ValueError:
+            logger.warning(f"Unreadable change log record at byte {pos} of {path}")
+            break
+        if record.get("rows"):
+            offset, count = record["vectors"]
+            nbytes = count * record["dim"] * 4
+            if offset + nbytes > vec_size:
+                logger.warning(f"Change log record at byte {pos} of {path} has no vectors")
+                break
+            if vectors:
+                record["vecs"] = np.fromfile(
+                    vec_path, dtype=np.float32, count=count * record["dim"], offset=offset
+                ).reshape(count, record["dim"])
+        records.append(record)
+        pos += len(line)
+    return records, pos
+
+
+def status(docstore_path: str) -> dict:
+    """Records, rows added and sources dropped in the log (vectors not read)."""
+    records, end = read(docstore_path, vectors=False)
+    return {
+        "records": len(records),
+        "rows": sum(len(r.get("rows") or ()) for r in records),
+        "deleted_sources": sum(len(r.get("delete") or ()) for r in records),
+        "bytes": end,
+    }
+
+
+def should_compact(stats: dict, base_rows: int | None) -> bool:
+    limit = max(CHANGELOG_COMPACT_MIN_ROWS, CHANGELOG_COMPACT_RATIO * (base_rows or 0))
+    return stats["records"] >= CHANGELOG_MAX_RECORDS or stats["rows"] + stats["deleted_sources"] >= limit
+
+
+def replay(store: FaissStore, keywords: KeywordIndex, records: list) -> dict:
+    """Apply records (read with vectors) to a loaded store + keyword index.
+
+    Deletes of all records are resolved first against the combined rows, so
+    the index is rebuilt at most once. Returns the parent texts the records
+    added (doc_id -> text).
+    """
+    base_n = len(store.docstore)
+    if len(keywords.entries) != base_n:
+        keywords.sync(store.docstore)
+    by_source = defaultdict(list)
+    for i, d in enumerate(store.docstore):
+        by_source[(d.get("url"), d.get("source_type"))].append(i)
+
+    alive = [True] * base_n
+    added, vecs, texts = [], [], {}
+    for record in records:
+        if record.get("rows") and record["dim"] != store.index.d:
+            raise ValueError(f"Change log vectors are {record['dim']}-d, index is {store.index.d}-d")
+        for url, source_type in record.get("delete") or ():
+            for i in by_source.pop((url, source_type), ()):
+                alive[i] = False
+        for row in record.get("rows") or ():
+            by_source[(row.get("url"), row.get("source_type"))].append(base_n + len(added))
+            added.append(row)
+            alive.append(True)
+        if record.get("rows"):
+            vecs.append(record["vecs"])
+        texts.update(record.get("texts") or {})
+
+    if not all(alive[:base_n]):
+        keep = [i for i in range(base_n) if alive[i]]
+        store.keep_rows(keep)
+        keywords.keep_rows(keep)
+    new = [i for i, row in enumerate(added) if alive[base_n + i]]
+    if new:
+        vecs = np.concatenate(vecs)[new]
+        if not store.index.is_trained:
+            store.index.train(vecs)
+        store.index.add(vecs)
+        rows = [added[i] for i in new]
+        store.docstore.extend(rows)
+        keywords.entries.extend(chunk_stats(row) for row in rows)
+        keywords._invalidate()
+    return texts
+
+
+def load(index_path: str, docstore_path: str, dim: int = 0, end: int | None = None):
+    """(FaissStore, KeywordIndex, texts, records replayed) for a snapshot plus its log.
+
+    Paths are the snapshot's own (snapshots.resolve). The index is a private
+    in-memory copy, since replay adds to it. texts is the snapshot's
+    TextStore with the parent texts from the log on top (None for a flat
+    corpus).
+    """
+    store = FaissStore(dim, index_path, docstore_path)
+    store.load_or_create()
+    store.dim = store.index.d
+    keywords = KeywordIndex(keyword_index_path(docstore_path))
+    keywords.load()
+    keywords.sync(store.docstore)
+    records, _ = read(docstore_path, end=end)
+    added = replay(store, keywords, records)
+    texts = hierarchy.TextStore.open(docstore_path)
+    if added:
+        texts = hierarchy.OverlayTexts(texts, added)
+    return store, keywords, texts, len(records)
+
+
+class Overlay:
+    """What a change log adds to and drops from a snapshot, kept beside it for search.
+
+    The snapshot is not copied: its (mapped) index, keyword postings and
+    filter columns stay read-only and shared between workers. Log rows get
+    the row ids after the snapshot's (base_n + i) and are searched in small
+    side structures; dropped rows are cleared in `alive`, which every
+    search is masked with. An Overlay is not changed once built;
+    advanced() returns a new one.
+    """
+
+    def __init__(self, base_columns, base_n: int):
+        self.base_columns = base_columns
+        self.base_n = base_n
+        self.rows = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.dim = 0
+        self.keywords = KeywordIndex(None)
+        self.columns = MetadataColumns([], self.keywords.major_masks)
+        self.url_codes = np.zeros(0, dtype=np.int64)
+        self.alive = np.ones(base_n, dtype=bool)
+        self.dropped = 0
+        self.texts = {}
+        self.records = 0
+        self.end = 0
+        self._base_urls = None
+        self._new_urls = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def live(self, mask=None):
+        """mask (bool per row, None = all rows) without the dropped rows; None
+        when that is still every row."""
+        if mask is None:
+            return self.alive if self.dropped else None
+        return mask & self.alive
+
+    def advanced(self, docstore_path: str, end: int | None = None) -> "Overlay":
+        """This overlay moved on by the log between self.end and `end` (only
+        those records are read); self when there are none."""
+        records, end = read(docstore_path, start=self.end, end=end)
+        if not records:
+            return self
+        out = Overlay.__new__(Overlay)
+        out.__dict__.update(self.__dict__)
+        out._apply(records, end)
+        return out
+
+    def _apply(self, records: list, end: int):
+        n = self.base_n
+        rows = list(self.rows)
+        side_alive = self.alive[n:].tolist()
+        by_source = defaultdict(list)
+        for i, row in enumerate(rows):
+            if side_alive[i]:
+                by_source[(row.get("url"), row.get("source_type"))].append(i)
+        vecs = [self.vectors] if rows else []
+        texts = dict(self.texts)
+        dropped = set()
+        for record in records:
+            if record.get("rows"):
+                if self.dim and record["dim"] != self.dim:
+                    raise ValueError(f"Change log vectors are {record['dim']}-d, earlier records {self.dim}-d")
+                self.dim = record["dim"]
+                vecs.append(record["vecs"])
+            for url, source_type in record.get("delete") or ():
+                # every snapshot row predates the log, so each drop applies to them
+                dropped.add((url, source_type))
+                for i in by_source.pop((url, source_type), ()):
+                    side_alive[i] = False
+            for row in record.get("rows") or ():
+                by_source[(row.get("url"), row.get("source_type"))].append(len(rows))
+                rows.append(row)
+                side_alive.append(True)
+            texts.update(record.get("texts") or {})
+
+        added = rows[len(self.rows):]
+        if added:
+            self.vectors = np.ascontiguousarray(np.concatenate(vecs), dtype=np.float32)
+            keywords = KeywordIndex(None)
+            keywords.entries = self.keywords.entries + [chunk_stats(row) for row in added]
+            keywords._invalidate()
+            self.keywords = keywords
+            self.columns = MetadataColumns(rows, keywords.major_masks)
+            self.url_codes = np.concatenate([self.url_codes, self._url_codes(added)])
+        base_alive = self.alive[:n]
+        hit = self._base_rows(dropped)
+        if hit is not None:
+            base_alive = base_alive & ~hit
+        self.rows = rows
+        self.alive = np.concatenate([base_alive, np.asarray(side_alive, dtype=bool)])
+        self.alive.flags.writeable = False
+        self.dropped = len(self.alive) - int(np.count_nonzero(self.alive))
+        self.texts = texts
+        self.records += len(records)
+        self.end = end
+
+    def _urls(self) -> dict:
+        """url -> url code in the snapshot's columns (built once per snapshot)."""
+        if self._base_urls is None:
+            urls = {}
+            for code, url in enumerate(self.base_columns.urls):
+                urls.setdefault(url, code)
+            self._base_urls = urls
+        return self._base_urls
+
+    def _url_codes(self, rows: list) -> np.ndarray:
+        """Group codes for log rows: a url the snapshot has keeps its code, so
+        fusion still keeps one chunk per url across both."""
+        urls = self._urls()
+        new = dict(self._new_urls)
+        codes = []
+        for row in rows:
+            url = row.get("url") or ""
+            code = urls.get(url)
+            if code is None:
+                code = new.setdefault(url, len(urls) + len(new))
+            codes.append(code)
+        self._new_urls = new
+        return np.asarray(codes, dtype=np.int64)
+
+    def _base_rows(self, dropped: set):
+        """Bool per snapshot row whose (url, source_type) is in dropped, or None for none."""
+        if not dropped or not self.base_n:
+            return None
+        cols = self.base_columns
+        urls = self._urls()
+        types = {source_type: code for code, source_type in enumerate(cols.source_types)}
+        wanted = [
+            urls[url or ""] * len(types) + types[source_type or ""]
+            for url, source_type in dropped
+            if (url or "") in urls and (source_type or "") in types
+        ]
+        if not wanted:
+            return None
+        pairs = np.asarray(cols.url_codes, dtype=np.int64) * len(types) + cols.source_type_codes
+        return np.isin(pairs, wanted)
+
+
+class _Stacked:
+    """Snapshot array followed by the overlay's, indexed by arrays of row ids."""
+
+    def __init__(self, base, tail):
+        self.base = base
+        self.tail = tail
+
+    def __len__(self):
+        return len(self.base) + len(self.tail)
+
+    def __getitem__(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        n = len(self.base)
+        low = ids < n
+        out = np.empty(ids.shape, dtype=np.int64)
+        out[low] = np.asarray(self.base)[ids[low]]
+        out[~low] = self.tail[ids[~low] - n]
+        return out
+
+
+class LayeredRows:
+    """Snapshot rows followed by the overlay's, as one docstore sequence."""
+
+    def __init__(self, base, overlay: Overlay):
+        self.base = base
+        self.overlay = overlay
+
+    def __len__(self):
+        return self.overlay.base_n + len(self.overlay)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        n = self.overlay.base_n
+        return self.base[i] if i < n else self.overlay.rows[i - n]
+
+    def __iter__(self):
+        yield from self.base
+        yield from self.overlay.rows
+
+
+class LayeredStore:
+    """FaissStore.search_ids over the snapshot's index plus the overlay's vectors."""
+
+    def __init__(self, base: FaissStore, overlay: Overlay):
+        if overlay.dim and overlay.dim != base.index.d:
+            raise ValueError(f"Change log vectors are {overlay.dim}-d, index is {base.index.d}-d")
+        self.base = base
+        self.overlay = overlay
+        self.dim = base.index.d
+        self.index_path = base.index_path
+        self.docstore_path = base.docstore_path
+
+    @property
+    def ntotal(self) -> int:
+        return self.base.ntotal + len(self.overlay)
+
+    def search_ids(self, query_emb, k=5, mask=None):
+        o = self.overlay
+        mask = o.live(mask)
+        scores, ids = self.base.search_ids(query_emb, k=k, mask=None if mask is None else mask[:o.base_n])
+        if not len(o):
+            return scores, ids
+        vec = np.asarray(query_emb, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        side = o.vectors @ (vec / norm if norm else vec)
+        side_ids = np.arange(len(side))
+        if mask is not None:
+            side_ids = np.flatnonzero(mask[o.base_n:])
+            side = side[side_ids]
+        top = np.argsort(-side, kind="stable")[:k]
+        scores = np.concatenate([scores, side[top]])
+        ids = np.concatenate([ids, side_ids[top] + o.base_n])
+        order = np.argsort(-scores, kind="stable")[:k]
+        return scores[order], ids[order]
+
+
+class LayeredKeywords:
+    """KeywordIndex.score over the snapshot's postings plus the overlay's.
+
+    Keyword scores are per row (no corpus-wide statistics), so the two top
+    lists merge like shard results.
+    """
+
+    def __init__(self, base: KeywordIndex, overlay: Overlay):
+        self.base = base
+        self.overlay = overlay
+
+    def __len__(self):
+        return len(self.base) + len(self.overlay)
+
+    def score(self, query, max_results: int = 50, mask=None):
+        o = self.overlay
+        mask = o.live(mask)
+        ids, scores = self.base.score(query, max_results=max_results, mask=None if mask is None else mask[:o.base_n])
+        if not len(o):
+            return ids, scores
+        more_ids, more_scores = o.keywords.score(
+            query, max_results=max_results, mask=None if mask is None else mask[o.base_n:]
+        )
+        ids = np.concatenate([ids, more_ids + o.base_n])
+        scores = np.concatenate([scores, more_scores])
+        # same order as one index: score, then lowest row id
+        order = np.lexsort((ids, -scores))[:max_results]
+        return ids[order], scores[order]
+
+
+class LayeredColumns:
+    """MetadataColumns.mask over the snapshot's columns plus the overlay's."""
+
+    def __init__(self, base, overlay: Overlay):
+        self.base = base
+        self.overlay = overlay
+        self.size = overlay.base_n + len(overlay)
+        self.url_codes = _Stacked(base.url_codes, overlay.url_codes)
+
+    def mask(self, **filters):
+        o = self.overlay
+        base = self.base.mask(**filters)
+        if base is None:
+            return o.live()
+        return o.live(np.concatenate([base, o.columns.mask(**filters)]))
+
+
+def carry(src_docstore: str, dst_docstore: str, start: int) -> int:
+    """Re-append the records after byte `start` of one log to another; returns how many.
+
+    Compaction uses it for changes published while it was building the new
+    snapshot.
+    """
+    records, _ = read(src_docstore, start=start)
+    for record in records:
+        append(
+            dst_docstore,
+            record.get("rows") or [],
+            record.get("vecs"),
+            delete=[tuple(src) for src in record.get("delete") or ()],
+            texts=record.get("texts"),
+        )
+    return len(records)
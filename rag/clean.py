@@ -1,10 +1,186 @@
 # clean.py — strict HTML / text cleaner for SheBots RAG
-
+#
+# Cleaning rules (junk tags/selectors, content containers, garbage phrases)
+# live in clean_rules.json next to this file, or in the file pointed to by
+# CLEAN_RULES_PATH. The file has a "default" rule set plus optional
+# per-site overrides keyed by host name:
+#
+#   {"default": {...}, "sites": {"cse.knu.ac.kr": {"extra_garbage_patterns": [...]}}}
+#
+# A site entry replaces a default key ("garbage_patterns": [...]) or extends
+# it ("extra_garbage_patterns": [...]). Rules are compiled once per site.
+# The file is read at import: a missing or invalid packaged file fails
+# startup, while a bad CLEAN_RULES_PATH override falls back to it with a
+# warning.
+
+import os
 import re
+import json
+import logging
+from pathlib import Path
+from urllib.parse import urlparse
 from bs4 import BeautifulSoup
+from bs4.element import Tag
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULES_PATH = str(Path(__file__).with_name("clean_rules.json"))
+RULES_PATH = os.getenv("CLEAN_RULES_PATH", DEFAULT_RULES_PATH)
+
+RULE_KEYS = (
+    "drop_tags",
+    "drop_selectors",
+    "content_selectors",
+    "garbage_patterns",
+    "text_garbage_patterns",
+    "collapse_terms",
+)
+
+_HTML_SNIFF = re.compile(r"<(?:html|body|head)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+class CleanRules:
+    """Compiled cleaning rules for one site."""
+
+    def __init__(self, rules: dict):
+        self.drop_tags = set(rules.get("drop_tags", []))
+        self.drop_classes = set()
+        self.drop_ids = set()
+        # Anything that isn't a bare tag / .class / #id falls back to soup.select
+        self.complex_selectors = []
+        for sel in rules.get("drop_selectors", []):
+            if re.fullmatch(r"\.[\w-]+", sel):
+                self.drop_classes.add(sel[1:])
+            elif re.fullmatch(r"#[\w-]+", sel):
+                self.drop_ids.add(sel[1:])
+            elif re.fullmatch(r"[\w-]+", sel):
+                self.drop_tags.add(sel)
+            else:
+                self.complex_selectors.append(sel)
+
+        self.content_selectors = list(rules.get("content_selectors", []))
+        self.garbage = _alternation(rules.get("garbage_patterns", []))
+        self.text_garbage = _alternation(rules.get("text_garbage_patterns", []))
+
+        terms = [re.escape(t) for t in rules.get("collapse_terms", [])]
+        self.collapse = (
+            re.compile(r"(" + "|".join(terms) + r")\s*(?:\1\s*)+") if terms else None
+        )
+
+    def is_junk(self, tag: Tag) -> bool:
+        if tag.name in self.drop_tags:
+            return True
+        attrs = tag.attrs
+        if self.drop_ids and attrs.get("id") in self.drop_ids:
+            return True
+        if self.drop_classes:
+            classes = attrs.get("class")
+            if classes and not self.drop_classes.isdisjoint(classes):
+                return True
+        return False
+
+
+def _alternation(patterns):
+    """Compile a list of patterns into one case-insensitive alternation.
+
+    Order is preserved, so longer phrases must be listed before their prefixes.
+    """
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE)
+
+
+def _read_rule_file(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        rules = json.load(f)
+    if not isinstance(rules, dict):
+        raise ValueError("expected a JSON object")
+    return rules
+
+
+def _load_rule_file(path: str) -> dict:
+    """Load the rule file; a broken packaged file is a startup error.
+
+    Only an override set through CLEAN_RULES_PATH falls back, with a
+    warning, to the packaged rules.
+    """
+    if path != DEFAULT_RULES_PATH:
+        try:
+            return _read_rule_file(path)
+        except Exception as e:
+            logger.warning(f"Failed to load clean rules {path}: {e}; using {DEFAULT_RULES_PATH}")
+    try:
+        return _read_rule_file(DEFAULT_RULES_PATH)
+    except Exception as e:
+        raise RuntimeError(f"Failed to load packaged clean rules {DEFAULT_RULES_PATH}: {e}") from e
+
+
+def _merge_rules(base: dict, override: dict) -> dict:
+    merged = {k: list(base.get(k, [])) for k in RULE_KEYS}
+    for key in RULE_KEYS:
+        if key in override:
+            merged[key] = list(override[key])
+        extra = override.get(f"extra_{key}")
+        if extra:
+            merged[key].extend(extra)
+    return merged
+
+
+_rule_file = _load_rule_file(RULES_PATH)
+_compiled: dict[str, CleanRules] = {}
+
+
+def _site_key(site: str | None) -> str:
+    if not site:
+        return ""
+    host = urlparse(site).netloc if "://" in site else site
+    host = host.lower().split(":")[0]
+    return host[4:] if host.startswith("www.") else host
+
+
+def get_rules(site: str | None = None) -> CleanRules:
+    """Return compiled rules for a site (host name or full URL)."""
+    key = _site_key(site)
+    rules = _compiled.get(key)
+    if rules is not None:
+        return rules
+
+    default = _merge_rules({}, _rule_file.get("default", {}))
+    site_rules = _rule_file.get("sites", {}).get(key) if key else None
+    merged = _merge_rules(default, site_rules) if site_rules else default
+
+    rules = CleanRules(merged)
+    _compiled[key] = rules
+    return rules
+
+
+def reload_rules():
+    """Drop compiled rules so the next call re-reads the rule file."""
+    global _rule_file
+    _rule_file = None
+    _compiled.clear()
+
+
+def _strip_junk(root: Tag, rules: CleanRules):
+    """Single tree walk removing every junk tag; junk subtrees are not descended."""
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        for child in list(node.children):
+            if not isinstance(child, Tag):
+                continue
+            if rules.is_junk(child):
+                child.decompose()
+            else:
+                stack.append(child)
+
+    for css in rules.complex_selectors:
+        for tag in root.select(css):
+            tag.decompose()
 
 
-def clean_html_strict(html: str) -> str:
+def clean_html_strict(html: str, site: str | None = None) -> str:
     """
     Aggressively clean KNU CSE HTML pages:
     - remove nav/header/footer/sidebars/forms/scripts/styles
@@ -13,63 +189,18 @@ def clean_html_strict(html: str) -> str:
     - normalize whitespace
 
     This is tuned for the structure of the CSE site so that RAG chunks contain
-    mostly meaningful content instead of menus and layout text.
+    mostly meaningful content instead of menus and layout text. Pass `site`
+    (host or page URL) to apply that site's rules from the rule file.
     """
+    rules = get_rules(site)
     soup = BeautifulSoup(html, "lxml")
 
-    # Remove global junk tags
-    for tag in soup(
-        [
-            "nav",
-            "header",
-            "footer",
-            "aside",
-            "script",
-            "style",
-            "noscript",
-            "form",
-            "input",
-            "button",
-            "svg",
-        ]
-    ):
-        tag.decompose()
-
-    # Remove known KNU CSE UI blocks (menus, sidebars, breadcrumbs, etc.)
-    for css in [
-        ".gnb",
-        ".lnb",
-        ".snb",
-        ".sub_nav",
-        ".subMenu",
-        ".topMenu",
-        ".bottomMenu",
-        ".breadcrumb",
-        ".search",
-        ".pagination",
-        ".footer",
-        ".header",
-        ".sitemap",
-        ".location",
-        ".quick_menu",
-    ]:
-        for tag in soup.select(css):
-            tag.decompose()
+    # Remove global junk tags and known UI blocks (menus, sidebars, breadcrumbs, etc.)
+    _strip_junk(soup, rules)
 
     # Prefer real content containers
     main = None
-    for selector in [
-        "main",
-        "article",
-        "#content",
-        ".content",
-        ".sub_content",
-        ".write_view",
-        ".board_view",
-        ".view_cont",
-        ".board",
-        ".bbs_view",
-    ]:
+    for selector in rules.content_selectors:
         main = soup.select_one(selector)
         if main:
             break
@@ -80,36 +211,18 @@ def clean_html_strict(html: str) -> str:
     text = container.get_text(separator=" ", strip=True)
 
     # Remove specific garbage phrases that often repeat on CSE site
-    garbage_patterns = [
-        r"ENGLISH LOGIN",
-        r"English Login",
-        r"사이트 내 전체검색",
-        r"검색어 필수",
-        r"검색하고자 하는 키워드 입력 후 Enter 또는 검색아이콘 클릭을 통해 검색해 주세요",
-        r"검색하고자 하는 키워드 입력 후 Enter",
-        r"통합검색은 홈페이지의 내용을 전체 검색합니다",
-        r"사이트 맵",
-        r"사이트맵",
-        r"전체 메뉴",
-        r"전체메뉴",
-        r"닫기",
-        r"열기",
-        r"HOME\s*>\s*",
-    ]
-    for pat in garbage_patterns:
-        text = re.sub(pat, " ", text, flags=re.IGNORECASE)
+    if rules.garbage is not None:
+        text = rules.garbage.sub(" ", text)
 
     # Collapse very repetitive keywords that come from layout
-    text = re.sub(r"(컴퓨터학부\s*){2,}", "컴퓨터학부 ", text)
-    text = re.sub(r"(글솝\s*){2,}", "글솝 ", text)
+    if rules.collapse is not None:
+        text = rules.collapse.sub(r"\1 ", text)
 
     # Normalize whitespace
-    text = re.sub(r"\s+", " ", text).strip()
-
-    return text
+    return _WHITESPACE.sub(" ", text).strip()
 
 
-def clean_text(text: str) -> str:
+def clean_text(text: str, site: str | None = None) -> str:
     """
     Backwards-compatible wrapper.
 
@@ -119,19 +232,13 @@ def clean_text(text: str) -> str:
     - removes obvious garbage patterns if present
     """
     # Heuristic: if it looks like HTML, run through full HTML cleaner
-    if "<html" in text.lower() or "<body" in text.lower() or "<head" in text.lower():
-        return clean_html_strict(text)
+    if _HTML_SNIFF.search(text):
+        return clean_html_strict(text, site)
 
     # Plain text: just normalize whitespace + remove a few known menu phrases
+    rules = get_rules(site)
     cleaned = text
-    for pat in [
-        r"ENGLISH LOGIN",
-        r"사이트 내 전체검색",
-        r"검색어 필수",
-        r"사이트 맵",
-        r"사이트맵",
-    ]:
-        cleaned = re.sub(pat, " ", cleaned, flags=re.IGNORECASE)
-
-    cleaned = re.sub(r"\s+", " ", cleaned).strip()
-    return cleaned
+    if rules.text_garbage is not None:
+        cleaned = rules.text_garbage.sub(" ", cleaned)
+
+    return _WHITESPACE.sub(" ", cleaned).strip()
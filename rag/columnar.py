@@ -0,0 +1,269 @@
+# columnar.py — bulk export / import of a snapshot as columnar files
+#
+# export_store() writes the live snapshot to a directory:
+#   vectors.npy            float32 [rows, dim], the normalized stored vectors
+#   columns/<field>.jsonl  one line per row: the JSON value of that docstore
+#                          field, or an empty line when the row doesn't have it
+#   doctexts.bin / .json   parent text store, when the corpus has one (hierarchy.py)
+#   export.json            rows, dim, embedding model, index type, fields
+#
+# import_store() publishes those files as a new snapshot, indexed with any
+# FAISS_INDEX_FACTORY, without fetching or embedding anything. Keyword stats,
+# mmap sidecars and language / shard indexes are rebuilt as after an ingest.
+#
+# Both directions stream COLUMNAR_BATCH_ROWS rows at a time: vectors go
+# through memory-mapped .npy files and docstore lines are read and written
+# one by one, so memory stays bounded by the batch (plus the FAISS index
+# being built). Approximate index types are trained on at most
+# COLUMNAR_TRAIN_ROWS vectors sampled evenly across the export.
+
+import os
+import json
+import time
+import shutil
+import logging
+
+import numpy as np
+import faiss
+
+from .store import FaissStore, INDEX_FACTORY
+from .keyword_index import KeywordIndex, keyword_index_path, chunk_stats
+from .mapped import MappedDocstore, line_offsets, atomic_write_json
+from . import hierarchy
+from . import snapshots
+
+logger = logging.getLogger(__name__)
+
+COLUMNAR_BATCH_ROWS = int(os.getenv("COLUMNAR_BATCH_ROWS", "8192"))
+COLUMNAR_TRAIN_ROWS = int(os.getenv("COLUMNAR_TRAIN_ROWS", "65536"))
+
+EXPORT_FILE = "export.json"
+VECTORS_FILE = "vectors.npy"
+COLUMNS_DIR = "columns"
+FORMAT = "columnar-1"
+
+
+def _copy_texts(src_dir: str, dst_dir: str) -> bool:
+    """Copy the hierarchy text store from src_dir into dst_dir, if there is one."""
+    copied = False
+    for name in (hierarchy.TEXTS_FILE, hierarchy.TEXTS_INDEX_FILE):
+        src = os.path.join(src_dir, name)
+        if os.path.exists(src):
+            shutil.copyfile(src, os.path.join(dst_dir, name))
+            copied = True
+    return copied
+
+
+def _field_file(out_dir: str, field: str) -> str:
+    # field names are docstore keys; keep them usable as file names
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in field)
+    return os.path.join(out_dir, COLUMNS_DIR, f"{safe}.jsonl")
+
+
+class _ColumnWriter:
+    """One .jsonl file per field, all advanced one row at a time."""
+
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+        self.files = {}
+        self.paths = {}
+        self.rows = 0
+        os.makedirs(os.path.join(out_dir, COLUMNS_DIR), exist_ok=True)
+
+    def _open(self, field: str):
+        path = _field_file(self.out_dir, field)
+        if path in self.paths.values():
+            raise ValueError(f"Docstore fields map to the same column file: {field}")
+        f = open(path, "w", encoding="utf-8")
+        # rows written before this field first appeared don't have it
+        f.write("\n" * self.rows)
+        self.files[field] = f
+        self.paths[field] = path
+        return f
+
+    def write(self, row: dict):
+        for field in row:
+            if field not in self.files:
+                self._open(field)
+        for field, f in self.files.items():
+            if field in row:
+                f.write(json.dumps(row[field], ensure_ascii=False))
+            f.write("\n")
+        self.rows += 1
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def export_store(out_dir: str, index_path: str, docstore_path: str, batch_rows: int | None = None) -> dict:
+    """Export the live snapshot (or the plain files) to out_dir; returns export.json.
+
+    A pending change log is compacted first, so the export has every row.
+    """
+    from .ingest import compact
+
+    batch_rows = batch_rows or COLUMNAR_BATCH_ROWS
+    compact(index_path, docstore_path)
+    base_dir = snapshots.data_dir(docstore_path)
+    index_path, docstore_path, version = snapshots.resolve(index_path, docstore_path)
+    store = FaissStore(0, index_path, docstore_path)
+    store.load_or_create(with_docstore=False, mmap=True)
+    ivf = faiss.try_extract_index_ivf(store.index)
+    if ivf is not None:
+        # a direct map is needed to reconstruct IVF vectors; not possible on a mapped index
+        store.load_or_create(with_docstore=False)
+        faiss.try_extract_index_ivf(store.index).make_direct_map()
+
+    ntotal, dim = int(store.index.ntotal), int(store.index.d)
+    os.makedirs(out_dir, exist_ok=True)
+    vectors = np.lib.format.open_memmap(
+        os.path.join(out_dir, VECTORS_FILE), mode="w+", dtype=np.float32, shape=(ntotal, dim)
+    )
+    columns = _ColumnWriter(out_dir)
+    rows = 0
+    try:
+        with open(docstore_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    # keep row numbers aligned with the index
+                    row = {}
+                columns.write(row)
+                rows += 1
+                if rows <= ntotal and (rows % batch_rows == 0 or rows == ntotal):
+                    start = (rows - 1) // batch_rows * batch_rows
+                    vectors[start:rows] = store.index.reconstruct_n(start, rows - start)
+    finally:
+        columns.close()
+    if rows != ntotal:
+        raise ValueError(f"Index has {ntotal} vectors but docstore has {rows} rows")
+    vectors.flush()
+    del vectors
+
+    m = snapshots.manifest(base_dir, version) if version else None
+    info = {
+        "format": FORMAT,
+        "rows": rows,
+        "dim": dim,
+        "embedding_model": (m or {}).get("embedding_model"),
+        "index_factory": (m or {}).get("index_factory"),
+        "source_version": version,
+        "fields": list(columns.paths),
+        "texts": _copy_texts(os.path.dirname(docstore_path) or ".", out_dir),
+        "created_at": int(time.time()),
+    }
+    atomic_write_json(os.path.join(out_dir, EXPORT_FILE), info)
+    logger.info(f"Exported {rows} rows ({dim}-d) from {version or docstore_path} to {out_dir}")
+    return info
+
+
+def read_export(src_dir: str) -> dict:
+    with open(os.path.join(src_dir, EXPORT_FILE), "r", encoding="utf-8") as f:
+        info = json.load(f)
+    if info.get("format") != FORMAT:
+        raise ValueError(f"Unknown export format {info.get('format')!r} in {src_dir}")
+    return info
+
+
+def iter_rows(src_dir: str, fields: list):
+    """Docstore rows rebuilt from the column files, in row order."""
+    files = [open(_field_file(src_dir, field), "r", encoding="utf-8") for field in fields]
+    try:
+        for lines in zip(*files):
+            yield {
+                field: json.loads(line)
+                for field, line in zip(fields, lines)
+                if line.strip()
+            }
+    finally:
+        for f in files:
+            f.close()
+
+
+def _train(index, vectors: np.ndarray, train_rows: int):
+    if index.is_trained:
+        return
+    n = len(vectors)
+    pick = np.linspace(0, n - 1, num=min(n, train_rows), dtype=np.int64) if n else np.zeros(0, dtype=np.int64)
+    sample = np.ascontiguousarray(vectors[pick], dtype=np.float32)
+    logger.info(f"Training {index.__class__.__name__} on {len(sample)} of {n} vectors")
+    index.train(sample)
+
+
+def import_store(
+    src_dir: str,
+    index_path: str,
+    docstore_path: str,
+    index_factory: str | None = None,
+    embedding_model: str | None = None,
+    batch_rows: int | None = None,
+):
+    """Publish an export as a new snapshot with `index_factory` (default
+    FAISS_INDEX_FACTORY); returns the snapshot manifest."""
+    from .ingest import finish_snapshot
+
+    batch_rows = batch_rows or COLUMNAR_BATCH_ROWS
+    info = read_export(src_dir)
+    vectors = np.load(os.path.join(src_dir, VECTORS_FILE), mmap_mode="r")
+    rows, dim = info["rows"], info["dim"]
+    if vectors.shape != (rows, dim):
+        raise ValueError(f"{VECTORS_FILE} has shape {vectors.shape}, export.json says {(rows, dim)}")
+    embedding_model = embedding_model or info.get("embedding_model")
+
+    store = FaissStore(dim, index_path, docstore_path, index_factory=index_factory or INDEX_FACTORY)
+    store.index = store._new_index()
+    store._configure()
+    _train(store.index, vectors, COLUMNAR_TRAIN_ROWS)
+
+    with snapshots.publish_lock(snapshots.data_dir(docstore_path)):
+        snap = snapshots.begin(docstore_path)
+        try:
+            store.index_path, store.docstore_path = snap.index_path, snap.docstore_path
+            keywords = KeywordIndex(keyword_index_path(snap.docstore_path))
+            written = 0
+            with open(snap.docstore_path, "w", encoding="utf-8") as f:
+                batch = []
+                for row in iter_rows(src_dir, info["fields"]):
+                    batch.append(row)
+                    if len(batch) == batch_rows:
+                        written = _import_batch(store, keywords, f, batch, vectors, written)
+                        batch = []
+                written = _import_batch(store, keywords, f, batch, vectors, written)
+            if written != rows:
+                raise ValueError(f"Column files hold {written} rows, export.json says {rows}")
+            keywords._invalidate()
+
+            os.makedirs(os.path.dirname(snap.index_path) or ".", exist_ok=True)
+            faiss.write_index(store.index, snap.index_path)
+            store.docstore = MappedDocstore(snap.docstore_path, line_offsets(snap.docstore_path))
+            if info.get("texts"):
+                _copy_texts(src_dir, os.path.dirname(snap.docstore_path))
+
+            manifest = finish_snapshot(
+                snap,
+                store,
+                keywords,
+                embedding_model,
+                imported_from=info.get("source_version"),
+            )
+        except Exception:
+            snapshots.abort(snap)
+            raise
+    logger.info(f"Imported {rows} rows into snapshot {snap.version} ({store.index_factory})")
+    return manifest
+
+
+def _import_batch(store, keywords, f, batch, vectors, start):
+    if not batch:
+        return start
+    end = start + len(batch)
+    if end > len(vectors):
+        raise ValueError(f"Column files hold more rows than {VECTORS_FILE}")
+    # exported vectors are already normalized
+    store.index.add(np.ascontiguousarray(vectors[start:end], dtype=np.float32))
+    for row in batch:
+        f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    keywords.entries.extend(chunk_stats(row) for row in batch)
+    return end
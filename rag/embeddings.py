@@ -7,16 +7,61 @@ except Exception:
     # ignore if huggingface_hub isn't importable yet; sentence-transformers will show an error later
     _hf = None
 
-from sentence_transformers import SentenceTransformer
 import os
+import re
+import zlib
+import numpy as np
 
 _model = None
 
+
+class HashEmbedder:
+    """Deterministic offline stand-in for a SentenceTransformer.
+
+    Feature-hashes lowercase word tokens into `dim` signed buckets and
+    L2-normalizes, so texts sharing words land close together. Used by the
+    benchmarks (EMBEDDING_MODEL=hash or hash:<dim>); no download, no torch.
+    """
+
+    _token_re = re.compile(r"[0-9A-Za-z가-힣]+")
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self._buckets = {}
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _bucket(self, token):
+        b = self._buckets.get(token)
+        if b is None:
+            h = zlib.crc32(token.encode('utf-8'))
+            b = self._buckets[token] = (h % self.dim, 1.0 if (h >> 31) & 1 else -1.0)
+        return b
+
+    def encode(self, texts, show_progress_bar=False, **kwargs):
+        out = np.zeros((len(texts), self.dim), dtype='float32')
+        for row, text in enumerate(texts):
+            for token in self._token_re.findall(text.lower()):
+                col, sign = self._bucket(token)
+                out[row, col] += sign
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return out / norms
+
+
+def load_embedding_model(model_name):
+    """A new model instance (not the process-wide one), e.g. a per-language model."""
+    if model_name == 'hash' or model_name.startswith('hash:'):
+        return HashEmbedder(int(model_name.split(':', 1)[1]) if ':' in model_name else 384)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+
 def get_embedding_model(name=None):
     global _model
     if _model is None:
-        model_name = name or os.getenv('EMBEDDING_MODEL','sentence-transformers/all-MiniLM-L6-v2')
-        _model = SentenceTransformer(model_name)
+        _model = load_embedding_model(name or os.getenv('EMBEDDING_MODEL','sentence-transformers/all-MiniLM-L6-v2'))
     return _model
 
 def embed_texts(texts, model=None):
@@ -0,0 +1,150 @@
+# filters.py — metadata filters evaluated as row bitsets
+#
+# Every filter value (a source_type, a major, a url prefix, a fetched_at
+# range) resolves to a boolean array over docstore rows. Filters are ANDed
+# and the result is handed to FAISS as an ID selector and to the keyword
+# index as a postings mask, so filtered searches stay exact without
+# over-fetching and dropping results afterwards.
+#
+# The columns can be saved as .npy files (columns/ next to the docstore) and
+# memory-mapped read-only, so uvicorn workers share them via the page cache.
+
+import os
+import json
+
+import numpy as np
+import faiss
+
+from .keyword_index import MAJOR_BITS
+from .mapped import atomic_write_npy, atomic_write_json
+
+COLUMNS_DIR = "columns"
+_ARRAYS = ("url_codes", "fetched_at", "source_type_codes", "major_masks")
+
+
+class MetadataColumns:
+    """Columnar view of the docstore fields that can be filtered on."""
+
+    def __init__(self, docs: list, major_masks: np.ndarray):
+        n = len(docs)
+        self.size = n
+        # url -> small int, for grouping candidates by document
+        codes: dict[str, int] = {}
+        self.urls: list[str] = []
+        url_codes = np.zeros(n, dtype=np.int64)
+        source_types: dict[str, int] = {}
+        source_type_codes = np.zeros(n, dtype=np.int32)
+        for i, d in enumerate(docs):
+            key = str(d.get("url"))
+            code = codes.get(key)
+            if code is None:
+                code = codes[key] = len(codes)
+                self.urls.append(d.get("url") or "")
+            url_codes[i] = code
+            source_type_codes[i] = source_types.setdefault(d.get("source_type") or "", len(source_types))
+        self.url_codes = url_codes
+        self.source_type_codes = source_type_codes
+        self.source_types = list(source_types)
+        self.fetched_at = np.fromiter(
+            (int(d.get("fetched_at") or 0) for d in docs), dtype=np.int64, count=n
+        )
+        self.major_masks = major_masks
+        self._reset_caches()
+
+    def _reset_caches(self):
+        self._majors: dict[str, np.ndarray] = {}
+        self._prefixes: dict[str, np.ndarray] = {}
+
+    def save(self, out_dir: str):
+        os.makedirs(out_dir, exist_ok=True)
+        for name in _ARRAYS:
+            atomic_write_npy(os.path.join(out_dir, f"{name}.npy"), np.asarray(getattr(self, name)))
+        atomic_write_json(
+            os.path.join(out_dir, "columns.json"),
+            {"urls": self.urls, "source_types": self.source_types},
+        )
+
+    @classmethod
+    def load(cls, columns_dir: str):
+        """Columns saved by save(), arrays memory-mapped read-only."""
+        cols = cls.__new__(cls)
+        for name in _ARRAYS:
+            setattr(cols, name, np.load(os.path.join(columns_dir, f"{name}.npy"), mmap_mode="r"))
+        with open(os.path.join(columns_dir, "columns.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        cols.urls = meta["urls"]
+        cols.source_types = meta["source_types"]
+        cols.size = len(cols.url_codes)
+        cols._reset_caches()
+        return cols
+
+    def source_type_bits(self, value: str) -> np.ndarray:
+        wanted = [
+            self.source_types.index(st.strip()) for st in value.split(",")
+            if st.strip() in self.source_types
+        ]
+        return np.isin(self.source_type_codes, wanted)
+
+    def major_bits(self, major: str) -> np.ndarray:
+        if major not in MAJOR_BITS:
+            raise ValueError(f"Unknown major '{major}' (expected one of {sorted(MAJOR_BITS)})")
+        bits = self._majors.get(major)
+        if bits is None:
+            bits = self._majors[major] = (self.major_masks & MAJOR_BITS[major]) != 0
+        return bits
+
+    def url_prefix_bits(self, prefix: str) -> np.ndarray:
+        bits = self._prefixes.get(prefix)
+        if bits is None:
+            # test each distinct url once, then broadcast to rows
+            hits = np.fromiter((u.startswith(prefix) for u in self.urls), dtype=bool, count=len(self.urls))
+            bits = hits[self.url_codes]
+            if len(self._prefixes) >= 256:
+                self._prefixes.clear()
+            self._prefixes[prefix] = bits
+        return bits
+
+    def mask(
+        self,
+        source_type: str | None = None,
+        major: str | None = None,
+        url_prefix: str | None = None,
+        fetched_after: int | None = None,
+        fetched_before: int | None = None,
+    ) -> np.ndarray | None:
+        """AND of all given filters, or None when no filter is set."""
+        parts = []
+        if source_type:
+            parts.append(self.source_type_bits(source_type))
+        if major:
+            parts.append(self.major_bits(major))
+        if url_prefix:
+            parts.append(self.url_prefix_bits(url_prefix))
+        if fetched_after is not None:
+            parts.append(self.fetched_at >= fetched_after)
+        if fetched_before is not None:
+            parts.append(self.fetched_at <= fetched_before)
+        if not parts:
+            return None
+
+        mask = parts[0].copy()
+        for p in parts[1:]:
+            mask &= p
+        return mask
+
+
+def faiss_selector_params(mask: np.ndarray, index=None):
+    """SearchParameters restricting a FAISS search to rows set in mask.
+
+    IVF / HNSW indexes need their own parameter type (carrying nprobe /
+    efSearch). The packed bitmap is returned too; it must stay alive for
+    the search.
+    """
+    bitmap = np.packbits(mask, bitorder="little")
+    sel = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+    ivf = faiss.try_extract_index_ivf(index) if index is not None else None
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=sel, nprobe=ivf.nprobe), bitmap
+    if index is not None and hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=index.hnsw.efSearch), bitmap
+    return faiss.SearchParameters(sel=sel), bitmap
@@ -0,0 +1,261 @@
+# fusion.py — hybrid score fusion + reranking over chunk-id arrays
+#
+# Candidates are docstore row ids with one semantic and one keyword score
+# vector. Normalization, fusion, best-chunk-per-url grouping and top-k
+# selection are NumPy operations; result dicts are only built for the
+# rows that are actually returned.
+
+import os
+
+import numpy as np
+
+FUSION_MODE = os.getenv("FUSION_MODE", "weighted")  # "weighted" | "rrf"
+SEMANTIC_WEIGHT = float(os.getenv("FUSION_SEMANTIC_WEIGHT", "0.55"))
+KEYWORD_WEIGHT = float(os.getenv("FUSION_KEYWORD_WEIGHT", "0.45"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Characters kept per chunk in snippet mode
+SNIPPET_CHARS = int(os.getenv("SNIPPET_CHARS", "300"))
+
+
+class Candidates:
+    """Union of semantic + keyword hits, one slot per docstore row."""
+
+    def __init__(self, ids, semantic, keyword, from_semantic, final=None, rerank=None):
+        self.ids = ids
+        self.semantic = semantic
+        self.keyword = keyword
+        self.from_semantic = from_semantic
+        self.final = final if final is not None else np.zeros(len(ids), dtype=np.float64)
+        # second-stage (cross-encoder) scores, when that stage ran
+        self.rerank = rerank
+
+    def __len__(self):
+        return len(self.ids)
+
+    def take(self, positions):
+        return Candidates(
+            self.ids[positions],
+            self.semantic[positions],
+            self.keyword[positions],
+            self.from_semantic[positions],
+            self.final[positions],
+            self.rerank[positions] if self.rerank is not None else None,
+        )
+
+
+def _as_arrays(ids, scores):
+    return np.asarray(ids, dtype=np.int64), np.asarray(scores, dtype=np.float64)
+
+
+def merge(sem_ids, sem_scores, kw_ids, kw_scores) -> Candidates:
+    """Merge semantic + keyword candidates without domain bias.
+
+    Both inputs are (row ids, scores) with unique ids; a row found by only
+    one retriever gets 0 for the other score.
+    """
+    sem_ids, sem_scores = _as_arrays(sem_ids, sem_scores)
+    kw_ids, kw_scores = _as_arrays(kw_ids, kw_scores)
+
+    ids = np.union1d(sem_ids, kw_ids)
+    semantic = np.zeros(len(ids), dtype=np.float64)
+    keyword = np.zeros(len(ids), dtype=np.float64)
+    from_semantic = np.zeros(len(ids), dtype=bool)
+
+    sem_pos = np.searchsorted(ids, sem_ids)
+    semantic[sem_pos] = sem_scores
+    from_semantic[sem_pos] = True
+    keyword[np.searchsorted(ids, kw_ids)] = kw_scores
+    return Candidates(ids, semantic, keyword, from_semantic)
+
+
+def _ranks(scores, present):
+    """1-based rank of each candidate within one retriever (0 = not retrieved)."""
+    ranks = np.zeros(len(scores), dtype=np.int64)
+    pos = np.flatnonzero(present)
+    order = pos[np.argsort(-scores[pos], kind="stable")]
+    ranks[order] = np.arange(1, len(order) + 1)
+    return ranks
+
+
+def fuse(cands: Candidates, mode: str | None = None) -> Candidates:
+    """
+    Fusion score tuned for numeric requirement queries:
+        weighted: final = 0.55 * semantic + 0.45 * keyword_norm
+        rrf:      final = sum over retrievers of 1 / (RRF_K + rank)
+    """
+    mode = mode or FUSION_MODE
+    if mode == "rrf":
+        final = np.zeros(len(cands), dtype=np.float64)
+        for ranks in (_ranks(cands.semantic, cands.from_semantic), _ranks(cands.keyword, cands.keyword > 0)):
+            hit = ranks > 0
+            final[hit] += 1.0 / (RRF_K + ranks[hit])
+    elif mode == "weighted":
+        max_key = cands.keyword.max() if len(cands) else 0.0
+        if max_key <= 0:
+            max_key = 1.0
+        final = SEMANTIC_WEIGHT * cands.semantic + KEYWORD_WEIGHT * (cands.keyword / max_key)
+    else:
+        raise ValueError(f"Unknown fusion mode '{mode}' (expected 'weighted' or 'rrf')")
+    cands.final = final
+    return cands
+
+
+def best_per_group(cands: Candidates, group_codes: np.ndarray) -> Candidates:
+    """Keep the best-scoring candidate per group (url) so one doc can't dominate.
+
+    The survivors come back in group order; top_k() does the final ordering.
+    """
+    if not len(cands):
+        return cands
+    order = np.argsort(-cands.final, kind="stable")
+    _, first = np.unique(group_codes[cands.ids[order]], return_index=True)
+    return cands.take(order[first])
+
+
+def top_k(cands: Candidates, limit: int) -> Candidates:
+    """Highest final scores, best first (argpartition, then sort only the top)."""
+    if limit <= 0 or not len(cands):
+        return cands.take(np.zeros(0, dtype=np.int64))
+    if len(cands) > limit:
+        part = np.argpartition(-cands.final, limit - 1)[:limit]
+    else:
+        part = np.arange(len(cands))
+    return cands.take(part[np.argsort(-cands.final[part], kind="stable")])
+
+
+def distinct_parents(cands: Candidates, docs: list, limit: int) -> Candidates:
+    """The first `limit` candidates, in order, with one child per hierarchy parent.
+
+    Children of one parent (same doc_id and parent_span, possibly under
+    different urls) come back as the same section, so only the best is kept.
+    """
+    keep, seen = [], set()
+    for pos, i in enumerate(cands.ids.tolist()):
+        if len(keep) == limit:
+            break
+        row = docs[i]
+        if "parent_span" in row:
+            parent = (row.get("doc_id"), tuple(row["parent_span"]))
+            if parent in seen:
+                continue
+            seen.add(parent)
+        keep.append(pos)
+    return cands.take(np.asarray(keep, dtype=np.int64))
+
+
+def rerank(
+    cands: Candidates,
+    group_codes: np.ndarray,
+    k: int,
+    max_chunks: int,
+    mode: str | None = None,
+    pool: int = 0,
+    docs: list | None = None,
+) -> Candidates:
+    """Fuse scores, keep best chunk per url and cut to the adaptive limit.
+
+    `pool` keeps at least that many fused candidates for a second-stage
+    reranker, which then makes the final cut. With `docs` (a hierarchy
+    corpus) siblings are dropped before the cut, so it holds distinct
+    parents.
+    """
+    if not len(cands):
+        return cands
+    grouped = best_per_group(fuse(cands, mode), group_codes)
+    limit = min(len(grouped), max_chunks, max(k, 1))
+    cut = max(limit, min(pool, len(grouped)))
+    if docs is None:
+        return top_k(grouped, cut)
+    return distinct_parents(top_k(grouped, len(grouped)), docs, cut)
+
+
+def reorder(cands: Candidates, scores: np.ndarray, limit: int) -> Candidates:
+    """Order candidates by second-stage scores and keep the top `limit`."""
+    cands.rerank = np.asarray(scores, dtype=np.float64)
+    return cands.take(np.argsort(-cands.rerank, kind="stable")[:limit])
+
+
+def iter_hits(cands: Candidates, docs: list, texts=None):
+    """Result dicts for the returned candidates, one at a time, best first.
+
+    With a hierarchy TextStore, a child chunk comes back as its parent
+    section (text = parent, child_text = the matched chunk); later children
+    of an already returned parent are skipped.
+    """
+    seen = set()
+    reranked = cands.rerank.tolist() if cands.rerank is not None else [None] * len(cands)
+    for i, sem, key, fin, from_sem, ce in zip(
+        cands.ids.tolist(),
+        cands.semantic.tolist(),
+        cands.keyword.tolist(),
+        cands.final.tolist(),
+        cands.from_semantic.tolist(),
+        reranked,
+    ):
+        item = dict(docs[i])
+        if texts is not None and "parent_span" in item:
+            parent = (item.get("doc_id"), tuple(item["parent_span"]))
+            if parent in seen:
+                continue
+            seen.add(parent)
+            text = texts.span(item.get("doc_id"), *item["parent_span"])
+            if text is not None:
+                item["child_text"] = item.get("text")
+                item["text"] = text
+        if from_sem:
+            item["score"] = sem
+        item["semantic_score"] = sem
+        item["keyword_score"] = key
+        item["final_score"] = fin
+        if ce is not None:
+            item["rerank_score"] = ce
+        yield item
+
+
+def materialize(cands: Candidates, docs: list, texts=None) -> list:
+    """Build result dicts for the returned candidates only."""
+    return list(iter_hits(cands, docs, texts))
+
+
+def snippet(text: str, terms, width: int = SNIPPET_CHARS) -> str:
+    """The `width`-character window of text covering the most distinct query terms.
+
+    Windows start at a term occurrence (backed up to a space), so a snippet
+    never opens mid-word; with no matches it is the start of the text.
+    """
+    text = text or ""
+    if len(text) <= width:
+        return text
+    lower = text.lower()
+    hits = []
+    for term in set(terms):
+        pos = lower.find(term)
+        while pos >= 0 and len(hits) < 512:
+            hits.append((pos, term))
+            pos = lower.find(term, pos + len(term))
+    if not hits:
+        return text[:width].rstrip() + "…"
+    hits.sort()
+    best_start, best_count = 0, -1
+    j = 0
+    for i, (start, _) in enumerate(hits):
+        # hits[i:j] all start inside [start, start + width)
+        j = max(j, i)
+        while j < len(hits) and hits[j][0] + len(hits[j][1]) <= start + width:
+            j += 1
+        count = len({t for _, t in hits[i:j]})
+        if count > best_count:
+            best_start, best_count = start, count
+    begin = text.rfind(" ", max(0, best_start - width // 5), best_start)
+    begin = max(0, min(begin + 1 if begin >= 0 else best_start, len(text) - width))
+    out = text[begin:begin + width].strip()
+    return ("…" if begin > 0 else "") + out + ("…" if begin + width < len(text) else "")
+
+
+def shape_hit(item: dict, fields=None, terms=None, width: int = SNIPPET_CHARS) -> dict:
+    """Apply snippet mode (terms given) and a field projection to one result dict."""
+    if terms is not None and "text" in item:
+        item["text"] = snippet(item["text"], terms, width)
+    if fields:
+        item = {f: item[f] for f in fields if f in item}
+    return item
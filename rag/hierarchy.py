@@ -0,0 +1,204 @@
+# hierarchy.py — parent/child chunks over a shared per-document text store
+#
+# With CHILD_CHUNK_SIZE > 0, a source's cleaned text is first cut into
+# parent sections (CHUNK_SIZE, no overlap), and each parent into small
+# child chunks (CHILD_CHUNK_SIZE / CHILD_CHUNK_OVERLAP). Only children are
+# rows: they are embedded and keyword-indexed, and each row carries
+#   doc_id        content hash of the document's cleaned text
+#   parent_span   [start, end] byte offsets of its parent in that text
+#   child_span    [start, end] byte offsets of the child itself
+#
+# The document text is stored once per snapshot, next to the docstore:
+#   doctexts.bin    UTF-8 texts back to back
+#   doctexts.json   {doc_id: [start, end]} byte range of each text
+# so a parent is a slice of a memory-mapped file, never a second copy in
+# docstore.jsonl. Search retrieves on children and returns their parent
+# sections (fusion.iter_hits), one per (doc_id, parent).
+#
+# CHILD_CHUNK_SIZE=0 (default) keeps the flat CHUNK_SIZE chunks.
+
+import os
+import json
+import mmap
+import logging
+
+from .splitter import split_text, split_spans
+from .mapped import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+CHILD_CHUNK_SIZE = int(os.getenv("CHILD_CHUNK_SIZE", "0"))
+CHILD_CHUNK_OVERLAP = int(os.getenv("CHILD_CHUNK_OVERLAP", "50"))
+
+TEXTS_FILE = "doctexts.bin"
+TEXTS_INDEX_FILE = "doctexts.json"
+
+
+def enabled() -> bool:
+    return CHILD_CHUNK_SIZE > 0
+
+
+def _byte_offsets(text: str, offsets) -> dict:
+    """char offset -> UTF-8 byte offset, walking the text once."""
+    out = {}
+    pos = nbytes = 0
+    for off in sorted(set(offsets)):
+        nbytes += len(text[pos:off].encode("utf-8"))
+        out[off] = nbytes
+        pos = off
+    return out
+
+
+def split(text: str, chunk_size=None, child_size=None, child_overlap=None) -> list:
+    """[(chunk text, extra meta)] for one document.
+
+    Flat split_text() chunks with empty meta when the hierarchy is off,
+    else one entry per child with its parent_span / child_span.
+    """
+    child_size = CHILD_CHUNK_SIZE if child_size is None else child_size
+    if child_size <= 0:
+        return [(c, {}) for c in split_text(text, chunk_size)]
+    if chunk_size is None:
+        try:
+            chunk_size = int(os.getenv("CHUNK_SIZE", "1800"))
+        except ValueError:
+            chunk_size = 1800
+    child_overlap = CHILD_CHUNK_OVERLAP if child_overlap is None else child_overlap
+
+    pairs = []
+    for p_start, p_end in split_spans(text, chunk_size, 0):
+        for c_start, c_end in split_spans(text[p_start:p_end], child_size, child_overlap):
+            pairs.append(((p_start, p_end), (p_start + c_start, p_start + c_end)))
+    to_bytes = _byte_offsets(text, [o for pair in pairs for span in pair for o in span])
+
+    out = []
+    for (p_start, p_end), (c_start, c_end) in pairs:
+        child = text[c_start:c_end]
+        if not child.strip():
+            continue
+        out.append((child, {
+            "parent_span": [to_bytes[p_start], to_bytes[p_end]],
+            "child_span": [to_bytes[c_start], to_bytes[c_end]],
+        }))
+    return out
+
+
+def texts_path(docstore_path: str) -> str:
+    return os.path.join(os.path.dirname(docstore_path) or ".", TEXTS_FILE)
+
+
+class TextStore:
+    """Read-only document texts of one snapshot (doctexts.bin, memory-mapped)."""
+
+    def __init__(self, path: str, ranges: dict):
+        self.path = path
+        self.ranges = ranges
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mm = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.ranges
+
+    def raw(self, doc_id: str) -> bytes:
+        start, end = self.ranges[doc_id]
+        return self._mm[start:end]
+
+    def get(self, doc_id: str) -> str:
+        return self.raw(doc_id).decode("utf-8")
+
+    def span(self, doc_id: str, start: int, end: int) -> str | None:
+        """Text of bytes [start, end) of one document, or None when it isn't stored."""
+        rng = self.ranges.get(doc_id)
+        if rng is None:
+            return None
+        base = rng[0]
+        return self._mm[base + start:min(base + end, rng[1])].decode("utf-8", errors="ignore")
+
+    @classmethod
+    def open(cls, docstore_path: str) -> "TextStore | None":
+        """The text store published next to docstore_path, or None (flat corpus)."""
+        path = texts_path(docstore_path)
+        index = os.path.join(os.path.dirname(path), TEXTS_INDEX_FILE)
+        if not os.path.exists(path) or not os.path.exists(index):
+            return None
+        with open(index, "r", encoding="utf-8") as f:
+            ranges = json.load(f)
+        return cls(path, ranges)
+
+
+class OverlayTexts:
+    """A snapshot's TextStore plus documents added by its change log (changelog.py)."""
+
+    def __init__(self, base: "TextStore | None", texts: dict):
+        self.base = base
+        self.texts = {doc_id: text.encode("utf-8") for doc_id, text in texts.items()}
+
+    def __len__(self):
+        return len(self.texts) + (len(self.base) if self.base is not None else 0)
+
+    def extended(self, texts: dict) -> "OverlayTexts":
+        """A new overlay with texts on top of this one's (this one is left as is)."""
+        out = OverlayTexts(self.base, texts)
+        out.texts = {**self.texts, **out.texts}
+        return out
+
+    def __contains__(self, doc_id):
+        return doc_id in self.texts or (self.base is not None and doc_id in self.base)
+
+    def raw(self, doc_id: str) -> bytes:
+        data = self.texts.get(doc_id)
+        if data is None:
+            if self.base is None:
+                raise KeyError(doc_id)
+            return self.base.raw(doc_id)
+        return data
+
+    def get(self, doc_id: str) -> str:
+        return self.raw(doc_id).decode("utf-8")
+
+    def span(self, doc_id: str, start: int, end: int) -> str | None:
+        data = self.texts.get(doc_id)
+        if data is None:
+            return self.base.span(doc_id, start, end) if self.base is not None else None
+        return data[start:end].decode("utf-8", errors="ignore")
+
+
+def write(docstore_path: str, rows: list, new_texts: dict, base: "TextStore | None" = None) -> int:
+    """Write the text store for a snapshot's rows; returns the number of documents.
+
+    Texts come from `new_texts` (doc_id -> text, this publish) or the
+    previous snapshot's `base` store; documents no row refers to any more
+    are dropped. Nothing is written when no row has a doc_id.
+    """
+    wanted = []
+    seen = set()
+    for d in rows:
+        doc_id = d.get("doc_id")
+        if doc_id and "parent_span" in d and doc_id not in seen:
+            seen.add(doc_id)
+            wanted.append(doc_id)
+    if not wanted:
+        return 0
+
+    path = texts_path(docstore_path)
+    ranges = {}
+    pos = 0
+    with open(path + ".tmp", "wb") as f:
+        for doc_id in wanted:
+            if doc_id in new_texts:
+                data = new_texts[doc_id].encode("utf-8")
+            elif base is not None and doc_id in base:
+                data = base.raw(doc_id)
+            else:
+                logger.warning(f"Text of document {doc_id} is missing; its rows return the child text")
+                continue
+            f.write(data)
+            ranges[doc_id] = [pos, pos + len(data)]
+            pos += len(data)
+    os.replace(path + ".tmp", path)
+    atomic_write_json(os.path.join(os.path.dirname(path), TEXTS_INDEX_FILE), ranges)
+    return len(ranges)
@@ -2,11 +2,18 @@
 # - uses strict HTML cleaner for KNU CSE pages
 # - supports manual URLs + PDF/DOCX/TXT files
 # - stores clean chunks into FAISS + docstore
+# - precomputes per-chunk keyword stats (keyword_index.jsonl)
+# - optional parent/child chunks over a shared text store (hierarchy.py)
+# - small publishes append to the live snapshot's change log (changelog.py),
+#   compacted into a new snapshot in the background
+# - times each stage (fetch/extract/clean/split/embed/persist) into metrics
 
 import os
 import time
 import json
+import hashlib
 import logging
+import threading
 import requests
 
 from .loader import (
@@ -17,12 +24,27 @@ from .loader import (
     extract_image_ocr,
 )
 from .clean import clean_html_strict, clean_text
-from .splitter import split_text
 from .embeddings import embed_texts
-from .store import FaissStore, Doc
+from .store import Doc
+from .keyword_index import keyword_index_path
+from . import mapped
+from . import snapshots
+from . import shards
+from . import lang
+from . import hierarchy
+from . import changelog
+from .metrics import (
+    Trace,
+    INGEST_STAGE_SECONDS,
+    INGEST_DOCS,
+    INGEST_BYTES,
+    INGEST_CHUNKS,
+    INGEST_ERRORS,
+)
 
-# Manual ingestion lists
-from .data import MANUAL_URLS, PDF_FILES, DOCX_FILES, TEXT_FILES
+# Manual ingestion lists (files: everything under SOURCE_DIRS plus data.py)
+from .data import MANUAL_URLS
+from . import sources
 
 logger = logging.getLogger(__name__)
 
@@ -30,22 +52,38 @@ logger = logging.getLogger(__name__)
 # ---------------------------------------------------------
 # ATTACHMENT PROCESSING
 # ---------------------------------------------------------
-def process_attachment(attachment, page_url, page_title):
+def record_source(trace, source_type, nbytes, nchunks):
+    INGEST_DOCS.inc(source_type=source_type)
+    INGEST_BYTES.inc(nbytes, source_type=source_type)
+    INGEST_CHUNKS.inc(nchunks, source_type=source_type)
+    trace.add(source_type, docs=1, bytes=nbytes, chunks=nchunks)
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def process_attachment(attachment, page_url, page_title, trace=None):
     """Extract text from an attached file and convert into clean chunks."""
+    trace = trace or Trace(INGEST_STAGE_SECONDS)
     att_type = attachment["type"]
     filepath = attachment["path"]
 
     logger.info(f"Processing {att_type} attachment: {filepath}")
 
     text = ""
-    if att_type == "pdf":
-        text = extract_pdf(filepath)
-    elif att_type == "docx":
-        text = extract_docx(filepath)
-    elif att_type == "hwp":
-        text = extract_hwp(filepath)
-    elif att_type == "image":
-        text = extract_image_ocr(filepath)
+    with trace.span("extract", source_type=att_type):
+        if att_type == "pdf":
+            text = extract_pdf(filepath)
+        elif att_type == "docx":
+            text = extract_docx(filepath)
+        elif att_type == "hwp":
+            text = extract_hwp(filepath)
+        elif att_type == "image":
+            text = extract_image_ocr(filepath)
 
     # Skip tiny or empty attachments
     if not text or len(text.strip()) < 50:
@@ -53,11 +91,14 @@ def process_attachment(attachment, page_url, page_title):
         return []
 
     # Plain-text cleaning (attachments are usually not full HTML pages)
-    cleaned = clean_text(text)
-    chunks = split_text(cleaned)
+    with trace.span("clean", source_type=att_type):
+        cleaned = clean_text(text)
+    with trace.span("split", source_type=att_type):
+        chunks = hierarchy.split(cleaned)
+    doc_id = content_hash(cleaned)
 
     result_chunks = []
-    for i, chunk in enumerate(chunks):
+    for i, (chunk, extra) in enumerate(chunks):
         meta = {
             "url": page_url,
             "title": page_title,
@@ -67,12 +108,321 @@ def process_attachment(attachment, page_url, page_title):
             "attachment_path": filepath,
             "fetched_at": int(time.time()),
         }
-        result_chunks.append({"text": chunk, "meta": meta})
+        if extra:
+            meta.update(doc_id=doc_id, **extra)
+        result_chunks.append(_with_doc({"text": chunk, "meta": meta}, cleaned))
 
+    record_source(trace, att_type, _file_size(filepath), len(result_chunks))
     logger.info(f"Extracted {len(result_chunks)} chunks from attachment {filepath}")
     return result_chunks
 
 
+def _stage_seconds(trace):
+    return {stage: round(sec, 4) for stage, sec in trace.seconds.items()}
+
+
+def _stage_counts(trace):
+    return dict(trace.counts)
+
+
+def _source_totals(trace):
+    return {src: {k: int(v) for k, v in t.items()} for src, t in trace.totals.items()}
+
+
+# ---------------------------------------------------------
+# PER-SOURCE CHUNKING (shared with the scheduler)
+# ---------------------------------------------------------
+def _read_text(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+FILE_EXTRACTORS = {
+    "manual_pdf": extract_pdf,
+    "manual_docx": extract_docx,
+    "manual_text": _read_text,
+}
+FILE_LABELS = {"manual_pdf": "PDF", "manual_docx": "DOCX", "manual_text": "TEXT"}
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:16]
+
+
+def _with_doc(chunk, cleaned):
+    # child chunks carry their document's text to publish_chunks (not stored per row)
+    if "parent_span" in chunk["meta"]:
+        chunk["doc"] = cleaned
+    return chunk
+
+
+def _chunk_dicts(chunks, url, title, source_type, cleaned):
+    """Chunk dicts for one source from hierarchy.split() output; content_hash
+    fingerprints its cleaned text and doubles as the child chunks' doc_id."""
+    digest = content_hash(cleaned)
+    now = int(time.time())
+    return [
+        _with_doc(
+            {
+                "text": c,
+                "meta": {
+                    "url": url,
+                    "title": title,
+                    "chunk_id": f"{hash((url, source_type))}_{i}",
+                    "source_type": source_type,
+                    "fetched_at": now,
+                    "content_hash": digest,
+                    **({"doc_id": digest, **extra} if extra else {}),
+                },
+            },
+            cleaned,
+        )
+        for i, (c, extra) in enumerate(chunks)
+    ]
+
+
+def html_chunks(url, title, html, trace):
+    """Chunks of a crawled page (attachments are handled separately)."""
+    # Use strict cleaner for KNU site HTML
+    with trace.span("clean", source_type="html"):
+        text = clean_html_strict(html, url)
+    with trace.span("split", source_type="html"):
+        chunks = hierarchy.split(text)
+    out = _chunk_dicts(chunks, url, title, "html", text)
+    for i, c in enumerate(out):
+        c["meta"]["chunk_id"] = f"{hash(url)}_{i}"
+    return out
+
+
+def manual_url_chunks(url, html, trace):
+    with trace.span("clean", source_type="manual_url"):
+        html_clean = clean_html_strict(html, url)
+    with trace.span("split", source_type="manual_url"):
+        chunks = hierarchy.split(html_clean)
+    return _chunk_dicts(chunks, url, f"manual:{url}", "manual_url", html_clean)
+
+
+def file_chunks(path, source_type, trace):
+    """Chunks of a manual_pdf / manual_docx / manual_text file."""
+    with trace.span("extract", source_type=source_type):
+        text = FILE_EXTRACTORS[source_type](path)
+    with trace.span("clean", source_type=source_type):
+        cleaned = clean_text(text)
+    with trace.span("split", source_type=source_type):
+        chunks = hierarchy.split(cleaned)
+    return _chunk_dicts(chunks, path, source_type, source_type, cleaned)
+
+
+# ---------------------------------------------------------
+# PUBLISH
+# ---------------------------------------------------------
+def finish_snapshot(snap, store, keywords, embedding_model, **manifest):
+    """Write everything derived from a snapshot's persisted index + docstore
+    (keyword index, mmap sidecars, language and shard indexes), then commit
+    it with `manifest` as extra manifest fields. The caller aborts on error.
+    """
+    derive_snapshot(snap, store, keywords, embedding_model)
+    return commit_snapshot(snap, store, embedding_model, **manifest)
+
+
+def derive_snapshot(snap, store, keywords, embedding_model):
+    keywords.persist()
+
+    # mmap-friendly copies for multi-worker serving
+    mapped.publish(
+        snap.docstore_path,
+        store.docstore,
+        keywords,
+        model=embedding_model,
+        version=snap.version,
+        ntotal=int(store.index.ntotal),
+    )
+    if lang.LANG_INDEXES:
+        lang.build(store)
+    if shards.SEARCH_SHARDS > 1:
+        shards.build_shards(snap.index_path, snap.docstore_path, shards.SEARCH_SHARDS, version=snap.version)
+
+
+def commit_snapshot(snap, store, embedding_model, **manifest):
+    return snapshots.commit(
+        snap,
+        embedding_model=embedding_model,
+        dim=store.dim,
+        index_factory=store.index_factory,
+        rows=len(store.docstore),
+        ntotal=int(store.index.ntotal),
+        **manifest,
+    )
+
+
+def use_changelog() -> bool:
+    """Whether publishes go to the change log; language and shard indexes
+    are only rebuilt with a full snapshot, so those keep writing one."""
+    return changelog.CHANGELOG and not lang.LANG_INDEXES and shards.SEARCH_SHARDS <= 1
+
+
+def publish_chunks(chunks, index_path, docstore_path, embedding_model, trace=None, replace=None):
+    """Embed `chunks`, add them to the live corpus and publish a new snapshot.
+
+    `replace` is a set of (url, source_type) whose existing rows are dropped
+    first, so a refreshed source swaps its chunks instead of duplicating
+    them (an empty chunk list just deletes). Search keeps serving the
+    previous snapshot until CURRENT flips. Returns (store, snapshot, parent).
+
+    Once a snapshot exists (and use_changelog()), the change is appended to
+    its change log instead and (None, live snapshot, parent) is returned;
+    the log is compacted into a new snapshot in the background when it
+    grows past the CHANGELOG_* limits.
+
+    Child chunks (hierarchy.py) bring their document text in c["doc"]; it
+    goes to the snapshot's text store once per document, not into the rows.
+    """
+    trace = trace or Trace(INGEST_STAGE_SECONDS)
+    replace = replace or set()
+    texts = [c["text"] for c in chunks]
+    doc_texts = {c["meta"]["doc_id"]: c["doc"] for c in chunks if "doc" in c}
+    embeddings = None
+    if texts:
+        logger.info(f"Embedding {len(chunks)} chunks...")
+        with trace.span("embed", source_type="all"):
+            embeddings = embed_texts(texts, model=embedding_model)
+
+    base_dir = snapshots.data_dir(docstore_path)
+    with snapshots.publish_lock(base_dir), trace.span("persist", source_type="all"):
+        # Start from the live snapshot (or the plain files before the first one)
+        base_index, base_docstore, parent = snapshots.resolve(index_path, docstore_path)
+        if parent is not None and use_changelog():
+            # Small write: one change log record on top of the live snapshot
+            rows = [{"text": t, **c["meta"], "lang": lang.detect(t)} for t, c in zip(texts, chunks)]
+            changelog.append(base_docstore, rows, embeddings, delete=replace, texts=doc_texts)
+            live = snapshots.Snapshot(base_dir, parent, os.path.dirname(base_docstore))
+        else:
+            live = None
+    if live is not None:
+        stats = changelog.status(base_docstore)
+        if changelog.should_compact(stats, (snapshots.manifest(base_dir, parent) or {}).get("rows")):
+            compact_in_background(index_path, docstore_path, embedding_model)
+        return None, live, parent
+
+    # Full snapshot: the first publish, or with the change log off
+    with snapshots.publish_lock(base_dir), trace.span("persist", source_type="all"):
+        base_index, base_docstore, parent = snapshots.resolve(index_path, docstore_path)
+        dim = len(embeddings[0]) if embeddings is not None else 0
+        # a change log left on the live snapshot is folded in
+        store, keywords, base_texts, _ = changelog.load(base_index, base_docstore, dim)
+        if replace:
+            keep = [
+                i for i, d in enumerate(store.docstore)
+                if (d.get("url"), d.get("source_type")) not in replace
+            ]
+            if len(keep) < len(store.docstore):
+                logger.info(f"Replacing {len(store.docstore) - len(keep)} rows from {len(replace)} sources")
+                keywords.keep_rows(keep)
+                store.keep_rows(keep)
+
+        docs = [Doc(t, {**c["meta"], "lang": lang.detect(t)}) for t, c in zip(texts, chunks)]
+        if docs:
+            store.upsert(embeddings, docs)
+
+        # Everything is written into a fresh snapshot dir, then published at once
+        snap = snapshots.begin(docstore_path)
+        try:
+            store.index_path, store.docstore_path = snap.index_path, snap.docstore_path
+            store.persist()
+
+            # Precompute per-chunk token stats so search never re-scans chunk text
+            keywords.path = keyword_index_path(snap.docstore_path)
+            keywords.sync(store.docstore)
+
+            # Parent sections of child chunks: one copy of each document's text
+            hierarchy.write(snap.docstore_path, store.docstore, doc_texts, base_texts)
+
+            finish_snapshot(
+                snap,
+                store,
+                keywords,
+                embedding_model,
+                chunks_added=len(chunks),
+                sources_replaced=len(replace),
+            )
+        except Exception:
+            snapshots.abort(snap)
+            raise
+
+    return store, snap, parent
+
+
+_compacting = threading.Lock()
+
+
+def compact(index_path, docstore_path, embedding_model=None):
+    """Fold the live snapshot's change log into a new snapshot with an empty log.
+
+    The new snapshot is built without holding the publish lock; records
+    appended meanwhile are carried over to its log just before it is
+    committed. Returns its manifest, or None when there was nothing to do
+    (no log, or another compaction running in this or another process).
+    """
+    base_dir = snapshots.data_dir(docstore_path)
+    if not _compacting.acquire(blocking=False):
+        return None
+    try:
+        with snapshots.compaction_lock(base_dir) as taken:
+            return _compact(index_path, docstore_path, embedding_model) if taken else None
+    finally:
+        _compacting.release()
+
+
+def _compact(index_path, docstore_path, embedding_model):
+    """compact() once this thread and process hold the compaction locks."""
+    base_dir = snapshots.data_dir(docstore_path)
+    base_index, base_docstore, version = snapshots.resolve(index_path, docstore_path)
+    if version is None or not changelog.pending(base_docstore):
+        return None
+    m = snapshots.manifest(base_dir, version) or {}
+    embedding_model = embedding_model or m.get("embedding_model")
+    _, end = changelog.read(base_docstore, vectors=False)
+
+    store, keywords, texts, n = changelog.load(base_index, base_docstore, end=end)
+    store.index_factory = m.get("index_factory") or store.index_factory
+    logger.info(f"Compacting {n} change log records of snapshot {version} ({len(store.docstore)} rows)")
+    snap = snapshots.begin(docstore_path)
+    try:
+        store.index_path, store.docstore_path = snap.index_path, snap.docstore_path
+        store.persist()
+        keywords.path = keyword_index_path(snap.docstore_path)
+        # parent texts from the snapshot and the log, written out as one store
+        hierarchy.write(snap.docstore_path, store.docstore, {}, texts)
+        derive_snapshot(snap, store, keywords, embedding_model)
+
+        with snapshots.publish_lock(base_dir):
+            if snapshots.current(base_dir) != version:
+                raise RuntimeError(f"Snapshot {snapshots.current(base_dir)} was published while compacting {version}")
+            carried = changelog.carry(base_docstore, snap.docstore_path, end)
+            manifest = commit_snapshot(
+                snap,
+                store,
+                embedding_model,
+                compacted_from=version,
+                changes_compacted=n,
+                changes_carried=carried,
+            )
+    except Exception:
+        snapshots.abort(snap)
+        raise
+    return manifest
+
+
+def compact_in_background(index_path, docstore_path, embedding_model=None):
+    def run():
+        try:
+            compact(index_path, docstore_path, embedding_model)
+        except Exception as e:
+            logger.error(f"Change log compaction failed: {e}")
+
+    threading.Thread(target=run, name="compact", daemon=True).start()
+
+
 # ---------------------------------------------------------
 # MAIN INGEST FUNCTION
 # ---------------------------------------------------------
@@ -85,28 +435,58 @@ def ingest(
     max_pages=300,
     max_depth=2,
     delay_ms=1500,
+    manual_urls=None,
+    pdf_files=None,
+    docx_files=None,
+    text_files=None,
+    crawl_enabled=None,
 ):
     """
     Ingests:
-      - (optionally) crawled HTML pages (currently disabled for safety)
+      - (optionally) crawled HTML pages (disabled unless CRAWL_ENABLED=1)
       - manually listed URLs (MANUAL_URLS)
-      - PDFs / DOCX / TXT listed in data.py
-
-    Produces:
-      - FAISS index at index_path
-      - docstore.jsonl at docstore_path
+      - PDFs / DOCX / TXT found under SOURCE_DIRS or listed in data.py (sources.py)
+
+    The source lists default to data.py and the source registry; pass them
+    explicitly to ingest something else (e.g. the offline ingest benchmark).
+
+    Produces a new snapshot (snapshots.py) next to docstore_path holding:
+      - FAISS index
+      - docstore.jsonl
+      - keyword_index.jsonl
+      - doctexts.bin / doctexts.json, with CHILD_CHUNK_SIZE set (hierarchy.py)
+      - memory-mappable sidecars + VERSION stamp (mapped.py)
+      - per-language sub-indexes, when LANG_INDEXES is set (lang.py)
+      - SEARCH_SHARDS shard directories, when sharding is on (shards.py)
+      - manifest.json
+    and makes it CURRENT. index_path / docstore_path are only read, as the
+    starting point, until the first snapshot exists. After that the chunks
+    go to the live snapshot's change log (see publish_chunks).
     """
-
-    # If you want auto-crawling later, re-enable this:
-    # pages = crawl(start_urls, allowlist,
-    #               max_pages=max_pages, max_depth=max_depth,
-    #               delay_ms=delay_ms)
-
-    pages = []  # manual mode for now
+    manual_urls = MANUAL_URLS if manual_urls is None else manual_urls
+    registry = sources.by_type()
+    pdf_files = registry["manual_pdf"] if pdf_files is None else pdf_files
+    docx_files = registry["manual_docx"] if docx_files is None else docx_files
+    text_files = registry["manual_text"] if text_files is None else text_files
+    if crawl_enabled is None:
+        crawl_enabled = os.getenv("CRAWL_ENABLED", "0").lower() in ("1", "true", "yes")
+
+    trace = Trace(INGEST_STAGE_SECONDS)
+
+    if crawl_enabled:
+        with trace.span("crawl", source_type="html"):
+            pages = crawl(start_urls, allowlist,
+                          max_pages=max_pages, max_depth=max_depth,
+                          delay_ms=delay_ms)
+    else:
+        pages = []  # manual mode for now
 
     all_chunks = []
     attachment_count = 0
+    attachment_dupes = 0
     html_chunk_count = 0
+    # attachments are stored by content hash: one file linked from many posts is extracted once
+    extracted_paths = set()
 
     # ---------------------------------------------------------
     # 1) PROCESS CRAWLED HTML PAGES (currently none)
@@ -115,30 +495,25 @@ def ingest(
         url = p["url"]
         title = p.get("title", "")
 
-        # Use strict cleaner for KNU site HTML
-        text = clean_html_strict(p["text"])
-        chunks = split_text(text)
-
         # HTML chunks
-        for i, c in enumerate(chunks):
-            meta = {
-                "url": url,
-                "title": title,
-                "chunk_id": f"{hash(url)}_{i}",
-                "source_type": "html",
-                "fetched_at": int(time.time()),
-            }
-            all_chunks.append({"text": c, "meta": meta})
+        chunks = html_chunks(url, title, p["text"], trace)
+        all_chunks.extend(chunks)
         html_chunk_count += len(chunks)
+        record_source(trace, "html", len(p["text"].encode("utf-8")), len(chunks))
 
         # Attachments inside crawled pages
         attachments = p.get("attachments", [])
         for att in attachments:
+            if att.get("path") in extracted_paths:
+                attachment_dupes += 1
+                continue
+            extracted_paths.add(att.get("path"))
             try:
-                att_chunks = process_attachment(att, url, title)
+                att_chunks = process_attachment(att, url, title, trace)
                 all_chunks.extend(att_chunks)
                 attachment_count += 1
             except Exception as e:
+                INGEST_ERRORS.inc(source_type=att.get("type", "attachment"))
                 logger.error(
                     f"Failed to process attachment {att.get('path')}: {e}"
                 )
@@ -149,92 +524,39 @@ def ingest(
 
     # 2A) Manual URLs (main source of FAQ / notice content)
     logger.info("Starting manual URL ingestion...")
-    for url in MANUAL_URLS:
+    for url in manual_urls:
         try:
-            r = requests.get(url, timeout=12)
+            with trace.span("fetch", source_type="manual_url"):
+                r = requests.get(url, timeout=12)
             if r.status_code != 200:
+                INGEST_ERRORS.inc(source_type="manual_url")
                 logger.error(f"Manual URL failed {url} (status {r.status_code})")
                 continue
 
-            html_clean = clean_html_strict(r.text)
-            chunks = split_text(html_clean)
-
-            for i, c in enumerate(chunks):
-                meta = {
-                    "url": url,
-                    "title": f"manual:{url}",
-                    "chunk_id": f"{hash((url, 'manual_url'))}_{i}",
-                    "source_type": "manual_url",
-                    "fetched_at": int(time.time()),
-                }
-                all_chunks.append({"text": c, "meta": meta})
+            chunks = manual_url_chunks(url, r.text, trace)
+            all_chunks.extend(chunks)
+            record_source(trace, "manual_url", len(r.content), len(chunks))
 
         except Exception as e:
+            INGEST_ERRORS.inc(source_type="manual_url")
             logger.error(f"Manual URL fetch error {url}: {e}")
 
-    # 2B) Manual PDFs
-    logger.info("Ingesting manual PDFs...")
-    for pdf_path in PDF_FILES:
-        try:
-            text = extract_pdf(pdf_path)
-            cleaned = clean_text(text)
-            chunks = split_text(cleaned)
-
-            for i, c in enumerate(chunks):
-                meta = {
-                    "url": pdf_path,
-                    "title": "manual_pdf",
-                    "chunk_id": f"{hash((pdf_path, 'manual_pdf'))}_{i}",
-                    "source_type": "manual_pdf",
-                    "fetched_at": int(time.time()),
-                }
-                all_chunks.append({"text": c, "meta": meta})
-
-        except Exception as e:
-            logger.error(f"Failed to ingest PDF {pdf_path}: {e}")
-
-    # 2C) Manual DOCX files
-    logger.info("Ingesting manual DOCX files...")
-    for docx_path in DOCX_FILES:
-        try:
-            text = extract_docx(docx_path)
-            cleaned = clean_text(text)
-            chunks = split_text(cleaned)
-
-            for i, c in enumerate(chunks):
-                meta = {
-                    "url": docx_path,
-                    "title": "manual_docx",
-                    "chunk_id": f"{hash((docx_path, 'manual_docx'))}_{i}",
-                    "source_type": "manual_docx",
-                    "fetched_at": int(time.time()),
-                }
-                all_chunks.append({"text": c, "meta": meta})
-
-        except Exception as e:
-            logger.error(f"Failed to ingest DOCX {docx_path}: {e}")
-
-    # 2D) Manual TEXT files
-    logger.info("Ingesting manual TEXT files...")
-    for txt_path in TEXT_FILES:
-        try:
-            with open(txt_path, "r", encoding="utf-8") as f:
-                text = f.read()
-            cleaned = clean_text(text)
-            chunks = split_text(cleaned)
-
-            for i, c in enumerate(chunks):
-                meta = {
-                    "url": txt_path,
-                    "title": "manual_text",
-                    "chunk_id": f"{hash((txt_path, 'manual_text'))}_{i}",
-                    "source_type": "manual_text",
-                    "fetched_at": int(time.time()),
-                }
-                all_chunks.append({"text": c, "meta": meta})
-
-        except Exception as e:
-            logger.error(f"Failed to ingest TEXT file {txt_path}: {e}")
+    # 2B-2D) Manual PDF / DOCX / TEXT files
+    for source_type, paths in (
+        ("manual_pdf", pdf_files),
+        ("manual_docx", docx_files),
+        ("manual_text", text_files),
+    ):
+        label = FILE_LABELS[source_type]
+        logger.info(f"Ingesting manual {label} files...")
+        for path in paths:
+            try:
+                chunks = file_chunks(path, source_type, trace)
+                all_chunks.extend(chunks)
+                record_source(trace, source_type, _file_size(path), len(chunks))
+            except Exception as e:
+                INGEST_ERRORS.inc(source_type=source_type)
+                logger.error(f"Failed to ingest {label} file {path}: {e}")
 
     # ---------------------------------------------------------
     # SAFETY CHECK
@@ -246,32 +568,38 @@ def ingest(
             "chunksAdded": 0,
             "totalChunks": 0,
             "attachmentsProcessed": attachment_count,
+            "attachmentsDeduplicated": attachment_dupes,
             "htmlChunks": 0,
             "manualChunks": 0,
+            "stageSeconds": _stage_seconds(trace),
+            "stageCounts": _stage_counts(trace),
+            "sources": _source_totals(trace),
         }
 
     # ---------------------------------------------------------
     # 3) EMBED + SAVE TO FAISS
     # ---------------------------------------------------------
-    logger.info(f"Embedding {len(all_chunks)} chunks...")
-    texts = [c["text"] for c in all_chunks]
-    embeddings = embed_texts(texts, model=embedding_model)
-    dim = len(embeddings[0])
-
-    store = FaissStore(dim, index_path, docstore_path)
-    store.load_or_create()
+    store, snap, parent = publish_chunks(all_chunks, index_path, docstore_path, embedding_model, trace)
 
-    docs = [Doc(t, c["meta"]) for t, c in zip(texts, all_chunks)]
-    store.upsert(embeddings, docs)
-    store.persist()
+    logger.info(f"Ingestion complete (snapshot {snap.version}, parent {parent}).")
 
-    logger.info("Ingestion complete.")
+    if store is not None:
+        total = len(store.docstore)
+    else:
+        # appended to the change log: the snapshot's rows plus the log's
+        m = snapshots.manifest(snapshots.data_dir(docstore_path), snap.version) or {}
+        total = (m.get("rows") or 0) + changelog.status(snap.docstore_path)["rows"]
 
     return {
         "pagesCrawled": len(pages),
         "chunksAdded": len(all_chunks),
-        "totalChunks": len(store.docstore),
+        "totalChunks": total,
+        "snapshot": snap.version,
         "attachmentsProcessed": attachment_count,
+        "attachmentsDeduplicated": attachment_dupes,
         "htmlChunks": html_chunk_count,
         "manualChunks": len(all_chunks) - html_chunk_count,
+        "stageSeconds": _stage_seconds(trace),
+        "stageCounts": _stage_counts(trace),
+        "sources": _source_totals(trace),
     }
@@ -0,0 +1,282 @@
+# keyword_index.py — precomputed per-chunk token statistics for keyword scoring
+#
+# Ingest stores one line per docstore row in keyword_index.jsonl (same row
+# order as docstore.jsonl):
+#   {"tf": {token: count}, "title_tf": {token: count}, "length": n, "major_mask": bits}
+#
+# At load time the per-chunk counts are inverted into postings, so query-time
+# keyword scoring is arithmetic over arrays instead of re-lowercasing and
+# substring-counting every chunk.
+#
+# For multi-worker serving the postings are also packed into CSR .npy files
+# (keywords/ next to the docstore) that every worker memory-maps read-only.
+#
+# Query tokens are matched against the vocabulary by substring. Tokens are
+# maximal [0-9A-Za-z가-힣] runs, so a query token can never match across a
+# token boundary and the hit counts equal text.lower().count(token). The
+# vocabulary terms each query token matches are kept in an LRU of
+# KEYWORD_MATCH_CACHE_SIZE tokens per postings list.
+#
+# Query-side analysis (tokens, weights, target major) and the major alias
+# config live in query.py.
+
+import os
+import json
+import logging
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from .mapped import atomic_write_npy, atomic_write_json
+from .metrics import cache_lookup
+from .query import (
+    MAJOR_ALIASES,
+    MAJOR_MATCHER,
+    AnalyzedQuery,
+    analyze,
+    tokenize,
+)
+
+logger = logging.getLogger(__name__)
+
+KEYWORD_INDEX_FILE = "keyword_index.jsonl"
+KEYWORD_PACK_DIR = "keywords"
+KEYWORD_MATCH_CACHE_SIZE = int(os.getenv("KEYWORD_MATCH_CACHE_SIZE", "4096"))
+
+# One bit per major, so "which majors does this chunk mention" is an int
+MAJOR_BITS = {key: 1 << i for i, key in enumerate(MAJOR_ALIASES)}
+ALL_MAJORS_MASK = sum(MAJOR_BITS.values())
+
+
+def major_mask(title: str, url: str) -> int:
+    """Bitmask of majors whose aliases appear in the chunk's title or url."""
+    mask = 0
+    for text in (title, url):
+        for key in MAJOR_MATCHER.keys((text or "").lower()):
+            mask |= MAJOR_BITS[key]
+    return mask
+
+
+def chunk_stats(doc: dict) -> dict:
+    """Token statistics for one docstore record."""
+    text = doc.get("text") or doc.get("content") or ""
+    title = doc.get("title") or ""
+    tokens = tokenize(text)
+    return {
+        "tf": dict(Counter(tokens)),
+        "title_tf": dict(Counter(tokenize(title))),
+        "length": len(tokens),
+        "major_mask": major_mask(title, doc.get("url")),
+    }
+
+
+def keyword_index_path(docstore_path: str) -> str:
+    """The keyword index always lives next to its docstore."""
+    return os.path.join(os.path.dirname(docstore_path) or ".", KEYWORD_INDEX_FILE)
+
+
+class _Postings:
+    """term -> (row ids, counts) with a substring lookup cache."""
+
+    def __init__(self, per_row_tf):
+        lists: dict[str, tuple[list, list]] = {}
+        for row, tf in enumerate(per_row_tf):
+            for term, n in tf.items():
+                ids, counts = lists.setdefault(term, ([], []))
+                ids.append(row)
+                counts.append(n)
+        self.terms = {
+            term: (np.asarray(ids, dtype=np.int64), np.asarray(counts, dtype=np.float64))
+            for term, (ids, counts) in lists.items()
+        }
+        self._matches: OrderedDict = OrderedDict()
+        self._matches_lock = threading.Lock()
+
+    def lookup(self, term: str):
+        return self.terms[term]
+
+    def matching(self, token: str):
+        """Vocabulary terms containing token, with token's count inside each."""
+        with self._matches_lock:
+            found = self._matches.get(token)
+            if found is not None:
+                self._matches.move_to_end(token)
+        cache_lookup("keyword_matches", found is not None)
+        if found is None:
+            found = [(term, term.count(token)) for term in self.terms if token in term]
+            with self._matches_lock:
+                self._matches[token] = found
+                while len(self._matches) > KEYWORD_MATCH_CACHE_SIZE:
+                    self._matches.popitem(last=False)
+        return found
+
+    def add_hits(self, scores: np.ndarray, token: str, weight: float, mask=None):
+        for term, times in self.matching(token):
+            ids, counts = self.lookup(term)
+            if mask is not None:
+                keep = mask[ids]
+                ids, counts = ids[keep], counts[keep]
+            # ids are unique within one posting list, so fancy-index add is safe
+            scores[ids] += counts * (weight * times)
+
+    def pack(self, out_dir: str, name: str):
+        """Write the postings as CSR arrays: <name>_terms.json, _indptr/_ids/_counts.npy."""
+        terms = list(self.terms)
+        lengths = np.fromiter((len(self.terms[t][0]) for t in terms), dtype=np.int64, count=len(terms))
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        ids = np.concatenate([self.terms[t][0] for t in terms]) if terms else np.zeros(0)
+        counts = np.concatenate([self.terms[t][1] for t in terms]) if terms else np.zeros(0)
+        atomic_write_json(os.path.join(out_dir, f"{name}_terms.json"), terms)
+        atomic_write_npy(os.path.join(out_dir, f"{name}_indptr.npy"), indptr)
+        atomic_write_npy(os.path.join(out_dir, f"{name}_ids.npy"), ids.astype(np.int32))
+        atomic_write_npy(os.path.join(out_dir, f"{name}_counts.npy"), counts.astype(np.int32))
+
+
+class _PackedPostings(_Postings):
+    """Read-only postings over memory-mapped CSR arrays (see _Postings.pack)."""
+
+    def __init__(self, pack_dir: str, name: str):
+        with open(os.path.join(pack_dir, f"{name}_terms.json"), "r", encoding="utf-8") as f:
+            self.terms = {term: i for i, term in enumerate(json.load(f))}
+        self.indptr = np.load(os.path.join(pack_dir, f"{name}_indptr.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(pack_dir, f"{name}_ids.npy"), mmap_mode="r")
+        self.counts = np.load(os.path.join(pack_dir, f"{name}_counts.npy"), mmap_mode="r")
+        self._matches = OrderedDict()
+        self._matches_lock = threading.Lock()
+
+    def lookup(self, term: str):
+        i = self.terms[term]
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return self.ids[start:end], self.counts[start:end]
+
+
+class KeywordIndex:
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        self.size = 0
+        self.major_masks = np.zeros(0, dtype=np.int64)
+        self._text = None
+        self._title = None
+
+    @classmethod
+    def from_docs(cls, docs, path=None):
+        index = cls(path)
+        index.sync(docs)
+        return index
+
+    @classmethod
+    def load_packed(cls, pack_dir: str):
+        """Read-only index over the memory-mapped CSR files written by pack()."""
+        index = cls(None)
+        index.major_masks = np.load(os.path.join(pack_dir, "major_masks.npy"), mmap_mode="r")
+        index.size = len(index.major_masks)
+        index._text = _PackedPostings(pack_dir, "text")
+        index._title = _PackedPostings(pack_dir, "title")
+        return index
+
+    def __len__(self):
+        return self.size
+
+    def load(self):
+        self.entries = []
+        if self.path and os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self.entries.append(json.loads(line))
+        self._invalidate()
+
+    def persist(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            for e in self.entries:
+                f.write(json.dumps(e, ensure_ascii=False) + "\n")
+
+    def pack(self, pack_dir: str):
+        """Write postings + major masks as .npy files for load_packed()."""
+        os.makedirs(pack_dir, exist_ok=True)
+        self._ensure_postings()
+        self._text.pack(pack_dir, "text")
+        self._title.pack(pack_dir, "title")
+        atomic_write_npy(os.path.join(pack_dir, "major_masks.npy"), np.asarray(self.major_masks, dtype=np.int64))
+
+    def sync(self, docstore: list):
+        """Bring the index in line with the docstore.
+
+        The docstore is append-only, so normally only the new tail needs stats.
+        If the index has more rows than the docstore it was built for a
+        different docstore and is rebuilt from scratch.
+        """
+        if len(self.entries) > len(docstore):
+            logger.warning("Keyword index larger than docstore, rebuilding")
+            self.entries = []
+        if len(self.entries) < len(docstore):
+            self.entries.extend(chunk_stats(d) for d in docstore[len(self.entries):])
+            self._invalidate()
+
+    def keep_rows(self, rows):
+        """Keep only the entries for `rows` (mirrors FaissStore.keep_rows)."""
+        self.entries = [self.entries[r] for r in rows]
+        self._invalidate()
+
+    def _invalidate(self):
+        self._text = None
+        self._title = None
+        self.size = len(self.entries)
+        self.major_masks = np.fromiter(
+            (e.get("major_mask", 0) for e in self.entries), dtype=np.int64, count=len(self.entries)
+        )
+
+    def _ensure_postings(self):
+        if self._text is None:
+            self._text = _Postings(e["tf"] for e in self.entries)
+            self._title = _Postings(e["title_tf"] for e in self.entries)
+
+    def score(self, query: "str | AnalyzedQuery", max_results: int = 50, mask=None):
+        """
+        Keyword relevance for requirements & numeric facts:
+        - token overlaps
+        - title boosts (2x)
+        - extra boosts for digits and requirement terms
+        - major-aware boost/penalty from the precomputed major bitmask
+
+        `query` is a string or an AnalyzedQuery (query.analyze). `mask`
+        (bool per row) drops filtered-out rows from the postings.
+        Returns (row ids, scores) sorted by score, best first.
+        """
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+        query = analyze(query)
+        if not query.tokens or not self.size:
+            return empty
+        if mask is not None:
+            if len(mask) != self.size:
+                raise ValueError("Filter mask does not match keyword index size")
+            if not mask.any():
+                return empty
+        self._ensure_postings()
+
+        scores = np.zeros(self.size, dtype=np.float64)
+        for t, weight in query.weighted:
+            self._title.add_hits(scores, t, 2.0 * weight, mask)
+            self._text.add_hits(scores, t, weight, mask)
+
+        target_major = query.target_major
+        if target_major:
+            target_bit = MAJOR_BITS[target_major]
+            on_target = (self.major_masks & target_bit) != 0
+            off_target = ~on_target & ((self.major_masks & (ALL_MAJORS_MASK ^ target_bit)) != 0)
+            scores[on_target] *= 1.6
+            scores[off_target] *= 0.7
+
+        ids = np.flatnonzero(scores > 0)
+        if len(ids) > max_results:
+            # ties at the cut go to the lowest row ids, so the result doesn't
+            # depend on partition order (sharded search merges to the same list)
+            kth = -np.partition(-scores[ids], max_results - 1)[max_results - 1]
+            above = ids[scores[ids] > kth]
+            ties = ids[scores[ids] == kth][: max_results - len(above)]
+            ids = np.concatenate([above, ties])
+        ids = ids[np.argsort(-scores[ids], kind="stable")]
+        return ids, scores[ids]
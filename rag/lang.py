@@ -0,0 +1,214 @@
+# lang.py — chunk language tags and per-language semantic sub-indexes
+#
+# Ingest tags every chunk with `lang` ("ko", "en" or "und") from the share
+# of Hangul among its letters. With LANG_INDEXES=ko,en each listed language
+# also gets its own FAISS index over just its rows, next to the snapshot's
+# main index:
+#   snapshots/<version>/langs/langs.json        {lang: {rows, model, dim}}
+#                       langs/<lang>/faiss_index
+#                       langs/<lang>/rows.npy    local row -> docstore row
+#
+# A sub-index reuses the main index's vectors unless LANG_MODELS names a
+# model for that language (LANG_MODELS="ko=jhgan/ko-sroberta-multitask"),
+# in which case its rows and matching queries are embedded with that model.
+#
+# Search detects the query language and runs the semantic retriever on the
+# matching sub-index only. When it cannot fill the candidate pool, or its
+# best score is below LANG_FALLBACK_SCORE, the other languages' rows in the
+# main index are searched too (cross-lingual fallback) and the best sem_k of
+# both are kept. Hits from a sub-index with its own model are re-scored
+# against the main index first, so both lists are on one scale. Keyword
+# retrieval always covers the whole corpus.
+
+import os
+import re
+import json
+import logging
+import threading
+
+import numpy as np
+import faiss
+
+from .store import FaissStore
+from .embeddings import load_embedding_model
+from .mapped import atomic_write_npy, atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+LANG_INDEXES = [l.strip() for l in os.getenv("LANG_INDEXES", "").split(",") if l.strip()]
+LANG_MODELS = dict(
+    part.split("=", 1) for part in os.getenv("LANG_MODELS", "").split(";") if "=" in part
+)
+LANG_ROUTING = os.getenv("LANG_ROUTING", "1").lower() in ("1", "true", "yes")
+HANGUL_RATIO = float(os.getenv("LANG_HANGUL_RATIO", "0.3"))
+LANG_FALLBACK_SCORE = float(os.getenv("LANG_FALLBACK_SCORE", "0.25"))
+
+LANGS_DIR = "langs"
+LANGS_FILE = "langs.json"
+ROWS_FILE = "rows.npy"
+
+# make_direct_map() on a shared IVF index, once
+_direct_map_lock = threading.Lock()
+
+_hangul_re = re.compile(r"[가-힣ᄀ-ᇿ㄰-㆏]")
+_latin_re = re.compile(r"[A-Za-z]")
+
+
+def detect(text: str) -> str:
+    """"ko" when at least HANGUL_RATIO of the letters are Hangul, "en" for
+    other Latin text, "und" when there are no letters (numbers, symbols)."""
+    hangul = len(_hangul_re.findall(text or ""))
+    latin = len(_latin_re.findall(text or ""))
+    if hangul + latin == 0:
+        return "und"
+    return "ko" if hangul / (hangul + latin) >= HANGUL_RATIO else "en"
+
+
+def langs_dir(docstore_path: str) -> str:
+    return os.path.join(os.path.dirname(docstore_path) or ".", LANGS_DIR)
+
+
+def build(store: FaissStore, langs: list | None = None) -> dict:
+    """Write a sub-index per language for a persisted store; returns langs.json."""
+    langs = LANG_INDEXES if langs is None else langs
+    docs = store.docstore
+    tags = np.array([d.get("lang") or detect(d.get("text") or "") for d in docs], dtype=object)
+    vectors = None
+    out_root = langs_dir(store.docstore_path)
+    info = {}
+    for lang in langs:
+        rows = np.flatnonzero(tags == lang)
+        out = os.path.join(out_root, lang)
+        model = LANG_MODELS.get(lang)
+        if model:
+            embedder = load_embedding_model(model)
+            texts = [docs[r].get("text") or "" for r in rows]
+            sub = FaissStore(embedder.get_sentence_embedding_dimension(), os.path.join(out, "faiss_index"), "")
+            sub.load_or_create(with_docstore=False)
+            if len(rows):
+                embeddings = embedder.encode(texts, show_progress_bar=False)
+                try:
+                    sub.upsert(embeddings, [])
+                except RuntimeError as e:
+                    # too few rows to train an IVF / PQ quantizer
+                    logger.warning(f"Language index {lang}: {e}; using a flat index")
+                    sub.index_factory = "Flat"
+                    sub.index = sub._new_index()
+                    sub.upsert(embeddings, [])
+        else:
+            if vectors is None:
+                vectors = store.vectors()
+            sub = FaissStore(store.index.d, os.path.join(out, "faiss_index"), "")
+            # same (trained) index type, emptied, like the shards
+            sub.index = faiss.clone_index(store.index)
+            sub.index.reset()
+            if len(rows):
+                sub.index.add(vectors[rows])
+        os.makedirs(out, exist_ok=True)
+        faiss.write_index(sub.index, sub.index_path + ".tmp")
+        os.replace(sub.index_path + ".tmp", sub.index_path)
+        atomic_write_npy(os.path.join(out, ROWS_FILE), rows)
+        info[lang] = {"rows": int(len(rows)), "model": model, "dim": int(sub.index.d)}
+        logger.info(f"Language index {lang}: {len(rows)} of {len(docs)} rows")
+    atomic_write_json(os.path.join(out_root, LANGS_FILE), info)
+    return info
+
+
+class LangIndex:
+    def __init__(self, lang: str, store: FaissStore, rows: np.ndarray, model: str | None):
+        self.lang = lang
+        self.store = store
+        self.rows = rows
+        self.model = model
+        self._embedder = None
+
+    def encode(self, query: str, vector):
+        """Query vector for this index: the shared one unless it has its own model."""
+        if not self.model:
+            return vector
+        if self._embedder is None:
+            self._embedder = load_embedding_model(self.model)
+        return self._embedder.encode([query])[0]
+
+
+def _main_scores(store: FaissStore, vector, ids) -> np.ndarray:
+    """Inner products of the (normalized) query vector with rows `ids` of the main index."""
+    ivf = faiss.try_extract_index_ivf(store.index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        with _direct_map_lock:
+            if ivf.direct_map.type == faiss.DirectMap.NoMap:
+                ivf.make_direct_map()
+    vectors = store.index.reconstruct_batch(np.asarray(ids, dtype=np.int64))
+    vec = np.array([vector], dtype=np.float32)
+    faiss.normalize_L2(vec)
+    return (vectors @ vec[0]).astype(np.float32)
+
+
+class LangRouter:
+    """Per-language sub-indexes of one snapshot plus the fallback masks."""
+
+    def __init__(self, indexes: dict, size: int):
+        self.indexes = indexes
+        self.size = size
+        self._others = {}
+
+    def others(self, lang: str) -> np.ndarray:
+        """Rows not in `lang` (searched in the main index on fallback)."""
+        bits = self._others.get(lang)
+        if bits is None:
+            bits = np.ones(self.size, dtype=bool)
+            bits[self.indexes[lang].rows] = False
+            self._others[lang] = bits
+        return bits
+
+    def search(self, query: str, vector, store: FaissStore, sem_k: int, mask=None):
+        """Semantic top sem_k as (scores, row ids, route).
+
+        route = {"lang", "index", "fallback"}; index is "all" when the query
+        language has no sub-index and the main index was searched as usual.
+        """
+        lang = detect(query)
+        sub = self.indexes.get(lang)
+        if sub is None:
+            scores, ids = store.search_ids(vector, k=sem_k, mask=mask)
+            return scores, ids, {"lang": lang, "index": "all", "fallback": False}
+
+        local_mask = None if mask is None else np.asarray(mask)[sub.rows]
+        scores, local_ids = sub.store.search_ids(sub.encode(query, vector), k=sem_k, mask=local_mask)
+        ids = np.asarray(sub.rows)[local_ids]
+
+        if len(ids) and scores[0] >= LANG_FALLBACK_SCORE:
+            fill = sem_k - len(ids)
+        else:
+            fill = sem_k
+        if fill <= 0:
+            return scores, ids, {"lang": lang, "index": lang, "fallback": False}
+
+        other = self.others(lang)
+        if mask is not None:
+            other = other & mask
+        more_scores, more_ids = store.search_ids(vector, k=fill, mask=other)
+        if sub.model and len(ids):
+            # its own model's scores aren't comparable with the main index's
+            scores = _main_scores(store, vector, ids)
+        scores = np.concatenate([scores, more_scores])
+        ids = np.concatenate([ids, more_ids])
+        order = np.argsort(-scores, kind="stable")[:sem_k]
+        return scores[order], ids[order], {"lang": lang, "index": lang, "fallback": True}
+
+
+def open_router(docstore_path: str, size: int, mmap: bool = False) -> LangRouter | None:
+    """Sub-indexes published next to the docstore, or None (route disabled / not built)."""
+    root = langs_dir(docstore_path)
+    if not LANG_ROUTING or not os.path.exists(os.path.join(root, LANGS_FILE)):
+        return None
+    with open(os.path.join(root, LANGS_FILE), "r", encoding="utf-8") as f:
+        info = json.load(f)
+    indexes = {}
+    for lang, meta in info.items():
+        out = os.path.join(root, lang)
+        store = FaissStore(meta["dim"], os.path.join(out, "faiss_index"), "")
+        store.load_or_create(with_docstore=False, mmap=mmap)
+        rows = np.load(os.path.join(out, ROWS_FILE), mmap_mode="r" if mmap else None)
+        indexes[lang] = LangIndex(lang, store, rows, meta.get("model"))
+    return LangRouter(indexes, size)
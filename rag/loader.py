@@ -1,4 +1,10 @@
 import os, time, logging, urllib.parse
+import re
+import json
+import uuid
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
 import httpx
 from urllib.parse import urljoin, urlparse
@@ -10,6 +16,18 @@ logger = logging.getLogger(__name__)
 
 USER_AGENT = "SheBotsRAG/1.0 (+contact@example.com)"
 
+# Attachment downloads: size cap, accepted content types, parallel downloads
+ATTACHMENT_MAX_BYTES = int(os.getenv('ATTACHMENT_MAX_BYTES', str(50 * 1024 * 1024)))
+ATTACHMENT_WORKERS = int(os.getenv('ATTACHMENT_WORKERS', '4'))
+# content-type prefixes (';'-separated); HTML error / login pages are refused
+ATTACHMENT_TYPES = [t.strip().lower() for t in os.getenv(
+    'ATTACHMENT_TYPES',
+    'application/pdf;application/msword;application/vnd.openxmlformats;application/vnd.ms-;'
+    'application/x-hwp;application/hwp;application/haansoft;application/vnd.hancom;'
+    'application/octet-stream;application/download;application/x-download;application/force-download;image/',
+).split(';') if t.strip()]
+DOWNLOADS_FILE = 'downloads.json'
+
 # ========================= FILE EXTRACTION HELPERS =========================
 
 def extract_pdf(path):
@@ -85,36 +103,130 @@ def extract_image_ocr(path):
         return ""
 
 
+# ========================= ATTACHMENT DOWNLOADS =========================
+#
+# Files are streamed to a temp file while being hashed, then stored as
+# <sha256[:32]><ext>: the same attachment linked from many posts is kept
+# (and later extracted) once, and names are stable across runs.
+# downloads.json in the save dir maps each url to its file plus the
+# ETag / Last-Modified seen, so the next crawl sends a conditional GET.
+
+_download_lock = threading.Lock()
+_download_index = {}
+
+_DISPOSITION_NAME = re.compile(r"filename\*?=(?:UTF-8'')?\"?([^\";]+)", re.IGNORECASE)
+_KNOWN_EXTS = {'.pdf', '.hwp', '.hwpx', '.doc', '.docx', '.jpg', '.jpeg', '.png', '.gif', '.bmp'}
+
+
+def _downloads(save_dir):
+    """url -> download record for save_dir (caller holds _download_lock)."""
+    index = _download_index.get(save_dir)
+    if index is None:
+        try:
+            with open(os.path.join(save_dir, DOWNLOADS_FILE), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        _download_index[save_dir] = index
+    return index
+
+
+def _remember(save_dir, url, record):
+    with _download_lock:
+        index = _downloads(save_dir)
+        index[url] = record
+        path = os.path.join(save_dir, DOWNLOADS_FILE)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+
+def _extension(url, ctype, disposition):
+    """File extension from Content-Disposition, the url path or the content type."""
+    m = _DISPOSITION_NAME.search(disposition or '')
+    for name in ((urllib.parse.unquote(m.group(1)) if m else ''), urlparse(url).path):
+        ext = os.path.splitext(name.strip())[1].lower()
+        if ext in _KNOWN_EXTS:
+            return ext
+    return mimetypes.guess_extension(ctype) or '.bin'
+
+
 def download_file(url, save_dir):
-    """Download a file from URL and save to directory."""
+    """Stream a file from URL into save_dir; returns its path or None.
+
+    Refuses content types outside ATTACHMENT_TYPES and anything larger
+    than ATTACHMENT_MAX_BYTES (by Content-Length, or while streaming).
+    """
     try:
         os.makedirs(save_dir, exist_ok=True)
         headers = {'User-Agent': USER_AGENT}
-        r = httpx.get(url, headers=headers, timeout=30.0, follow_redirects=True)
-        if r.status_code != 200:
-            logger.warning(f"Failed to download {url}: status {r.status_code}")
-            return None
-        
-        # Generate filename from URL
-        parsed = urlparse(url)
-        filename = os.path.basename(parsed.path)
-        if not filename or '.' not in filename:
-            # Guess extension from content-type
-            ctype = r.headers.get('content-type', '').split(';')[0].strip()
-            ext = mimetypes.guess_extension(ctype) or '.bin'
-            filename = f"{hash(url)}{ext}"
-        
-        filepath = os.path.join(save_dir, filename)
-        with open(filepath, 'wb') as f:
-            f.write(r.content)
-        
-        logger.info(f"Downloaded: {url} -> {filepath}")
+        with _download_lock:
+            known = _downloads(save_dir).get(url)
+        if known and os.path.exists(os.path.join(save_dir, known['file'])):
+            if known.get('etag'):
+                headers['If-None-Match'] = known['etag']
+            if known.get('last_modified'):
+                headers['If-Modified-Since'] = known['last_modified']
+        else:
+            known = None
+
+        with httpx.stream('GET', url, headers=headers, timeout=30.0, follow_redirects=True) as r:
+            if r.status_code == 304 and known:
+                filepath = os.path.join(save_dir, known['file'])
+                logger.info(f"Unchanged: {url} -> {filepath}")
+                return filepath
+            if r.status_code != 200:
+                logger.warning(f"Failed to download {url}: status {r.status_code}")
+                return None
+
+            ctype = r.headers.get('content-type', '').split(';')[0].strip().lower()
+            if ctype and not any(ctype.startswith(t) for t in ATTACHMENT_TYPES):
+                logger.warning(f"Skipping {url}: content type {ctype}")
+                return None
+            length = r.headers.get('content-length', '')
+            if length.isdigit() and int(length) > ATTACHMENT_MAX_BYTES:
+                logger.warning(f"Skipping {url}: {int(length)} bytes > ATTACHMENT_MAX_BYTES")
+                return None
+
+            digest = hashlib.sha256()
+            size = 0
+            tmp = os.path.join(save_dir, f".part-{uuid.uuid4().hex}")
+            try:
+                with open(tmp, 'wb') as f:
+                    for block in r.iter_bytes(1 << 16):
+                        size += len(block)
+                        if size > ATTACHMENT_MAX_BYTES:
+                            logger.warning(f"Skipping {url}: larger than ATTACHMENT_MAX_BYTES")
+                            return None
+                        digest.update(block)
+                        f.write(block)
+                sha = digest.hexdigest()
+                filename = sha[:32] + _extension(url, ctype, r.headers.get('content-disposition'))
+                filepath = os.path.join(save_dir, filename)
+                if os.path.exists(filepath):
+                    logger.info(f"Already stored: {url} -> {filepath}")
+                else:
+                    os.replace(tmp, filepath)
+                    logger.info(f"Downloaded: {url} -> {filepath} ({size} bytes)")
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+            _remember(save_dir, url, {
+                'file': filename,
+                'sha256': sha,
+                'bytes': size,
+                'etag': r.headers.get('etag'),
+                'last_modified': r.headers.get('last-modified'),
+                'fetched_at': int(time.time()),
+            })
         return filepath
     except Exception as e:
         logger.error(f"Download error {url}: {e}")
         return None
 
 
+
 def detect_attachments(html, base_url, page_url):
     """Detect and return metadata for attachments (images, PDFs, HWP, DOCX)."""
     soup = BeautifulSoup(html, 'lxml')
@@ -248,7 +360,11 @@ def crawl(start_urls, allowlist, max_pages=300, max_depth=2, delay_ms=1500):
 
     results = []
     attachment_dir = os.getenv('ATTACHMENT_DIR', './data/attachments')
-    
+    # attachments download in the background while crawling continues;
+    # a url linked from several pages is fetched once
+    downloads = ThreadPoolExecutor(max_workers=max(1, ATTACHMENT_WORKERS), thread_name_prefix='download')
+    pending = {}
+
     while q and len(results) < max_pages:
         url, depth = q.popleft()
         if url in seen:
@@ -270,23 +386,16 @@ def crawl(start_urls, allowlist, max_pages=300, max_depth=2, delay_ms=1500):
         if not text or len(text) < 400:
             continue
         
-        # Download attachments
-        downloaded_attachments = []
+        # Queue attachment downloads
         for att in attachments:
-            filepath = download_file(att['url'], attachment_dir)
-            if filepath:
-                downloaded_attachments.append({
-                    'type': att['type'],
-                    'url': att['url'],
-                    'path': filepath,
-                    'source_page': att['source_page']
-                })
-        
+            if att['url'] not in pending:
+                pending[att['url']] = downloads.submit(download_file, att['url'], attachment_dir)
+
         results.append({
             'url': url,
             'title': title,
             'text': text,
-            'attachments': downloaded_attachments
+            'attachments': attachments
         })
 
         if depth < max_depth:
@@ -302,4 +411,17 @@ def crawl(start_urls, allowlist, max_pages=300, max_depth=2, delay_ms=1500):
                 if new_norm not in seen and any(new_norm.startswith(a) for a in allowlist):
                     q.append((new_norm, depth+1))
 
+    downloads.shutdown(wait=True)
+    for page in results:
+        downloaded_attachments = []
+        for att in page['attachments']:
+            filepath = pending[att['url']].result()
+            if filepath:
+                downloaded_attachments.append({
+                    'type': att['type'],
+                    'url': att['url'],
+                    'path': filepath,
+                    'source_page': att['source_page']
+                })
+        page['attachments'] = downloaded_attachments
     return results
@@ -0,0 +1,255 @@
+# loadtest.py — concurrency sweeps against the HTTP service
+# - drives a running server (--base-url) or the FastAPI app in-process (ASGI transport)
+# - replays a query log: plain text (one query per line) or JSONL with /rag/search params
+# - optional mixed workload: POST /rag/ingest in the background to measure interference
+
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import tempfile
+
+import httpx
+import numpy as np
+
+from .bench import (
+    SyntheticCorpus,
+    build_synthetic_store,
+    _percentiles,
+    _search_module,
+    _point_search_at,
+    _environment,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERIES = [
+    "현장실습",
+    "졸업 요건 학점",
+    "글솝 졸업요건",
+    "심컴 졸업 학점",
+    "how many credits to graduate",
+    "internship credits global software",
+    "ABEEK 인정 과목",
+    "데이터과학전공 필수 과목",
+    "TOEIC 졸업 요건",
+    "platform software major requirements",
+]
+
+
+def load_query_log(path):
+    """Read a replayable query log into a list of /rag/search param dicts."""
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                params = json.loads(line)
+                if "q" in params and "query" not in params:
+                    params["query"] = params.pop("q")
+                entries.append(params)
+            else:
+                entries.append({"query": line})
+    return entries
+
+
+def in_process_app(synthetic=0, dim=384, work_dir=None, n_queries=200, seed=13):
+    """rag_main's FastAPI app for in-process runs.
+
+    With synthetic=N the app is wired to the hash embedder and pointed at a
+    freshly built N-chunk synthetic corpus (fully offline); the returned
+    queries come from the same corpus. Otherwise the app is imported as
+    configured by the environment and queries is None.
+    """
+    if not synthetic:
+        from . import rag_main
+        return rag_main.app, None
+
+    from .embeddings import HashEmbedder
+    rag_main = _search_module(dim)
+    corpus = SyntheticCorpus(seed=seed)
+    data_dir = work_dir or tempfile.mkdtemp(prefix="rag-loadtest-")
+    os.makedirs(data_dir, exist_ok=True)
+    build_synthetic_store(data_dir, synthetic, HashEmbedder(dim), corpus=corpus)
+    _point_search_at(rag_main, data_dir)
+    return rag_main.app, [{"query": q} for q in corpus.queries(n_queries)]
+
+
+def _latency(values_ms):
+    return _percentiles(values_ms) if len(values_ms) else None
+
+
+class _Level:
+    """Measurements for one concurrency level."""
+
+    def __init__(self):
+        self.latencies = []
+        self.during_ingest = []
+        self.statuses = {}
+        self.errors = 0
+        self.cache_hits = 0
+        self.ingests = []
+        self.ingest_running = False
+
+
+async def _search_worker(client, queries, level, deadline, max_requests, counter, rng, semantic_cache):
+    while time.monotonic() < deadline:
+        if max_requests is not None:
+            if counter[0] >= max_requests:
+                return
+            counter[0] += 1
+        params = dict(rng.choice(queries))
+        if not semantic_cache:
+            params.setdefault("cache", "false")
+        overlapped = level.ingest_running
+        t0 = time.perf_counter()
+        try:
+            r = await client.get("/rag/search", params=params)
+            status = str(r.status_code)
+        except Exception as e:
+            logger.debug(f"search failed: {e}")
+            status = "error"
+        elapsed = (time.perf_counter() - t0) * 1000.0
+        level.statuses[status] = level.statuses.get(status, 0) + 1
+        if status == "200":
+            level.latencies.append(elapsed)
+            level.during_ingest.append(overlapped or level.ingest_running)
+            try:
+                level.cache_hits += "cached" in r.json()
+            except ValueError:
+                pass
+        else:
+            level.errors += 1
+
+
+async def _ingest_worker(client, level, deadline, interval_s):
+    while time.monotonic() < deadline:
+        level.ingest_running = True
+        t0 = time.perf_counter()
+        try:
+            r = await client.post("/rag/ingest", json={"full": False})
+            ok = r.status_code == 200
+        except Exception as e:
+            logger.warning(f"ingest failed: {e}")
+            ok = False
+        finally:
+            level.ingest_running = False
+        level.ingests.append({"seconds": round(time.perf_counter() - t0, 3), "ok": ok})
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            await asyncio.sleep(min(interval_s, remaining))
+
+
+def _summarize(concurrency, level, wall_s):
+    lat = np.asarray(level.latencies)
+    mask = np.asarray(level.during_ingest, dtype=bool)
+    out = {
+        "concurrency": concurrency,
+        "requests": len(level.latencies) + level.errors,
+        "errors": level.errors,
+        "statuses": level.statuses,
+        "seconds": round(wall_s, 3),
+        "throughput_rps": round(len(level.latencies) / wall_s, 2) if wall_s else None,
+        "latency_ms": _latency(level.latencies),
+        "semantic_cache_hit_rate": round(level.cache_hits / len(level.latencies), 4) if level.latencies else 0.0,
+    }
+    if level.ingests:
+        out["ingest"] = {
+            "runs": len(level.ingests),
+            "seconds": [i["seconds"] for i in level.ingests],
+            "failed": sum(1 for i in level.ingests if not i["ok"]),
+        }
+        out["latency_ms_during_ingest"] = _latency(lat[mask])
+        out["latency_ms_without_ingest"] = _latency(lat[~mask])
+    return out
+
+
+async def _run_level(client, queries, concurrency, duration_s, requests_per_level, ingest_interval_s, seed, semantic_cache):
+    level = _Level()
+    rng = random.Random(seed + concurrency)
+    deadline = time.monotonic() + duration_s
+    counter = [0]
+    tasks = [
+        _search_worker(client, queries, level, deadline, requests_per_level, counter, rng, semantic_cache)
+        for _ in range(concurrency)
+    ]
+    if ingest_interval_s is not None:
+        tasks.append(_ingest_worker(client, level, deadline, ingest_interval_s))
+    t0 = time.perf_counter()
+    await asyncio.gather(*tasks)
+    return _summarize(concurrency, level, time.perf_counter() - t0)
+
+
+async def _sweep(client, queries, levels, duration_s, requests_per_level, ingest_interval_s, warmup, seed, semantic_cache):
+    for params in queries[:warmup]:
+        await client.get("/rag/search", params=params if semantic_cache else {"cache": "false", **params})
+    results = []
+    for concurrency in levels:
+        summary = await _run_level(
+            client, queries, concurrency, duration_s, requests_per_level, ingest_interval_s, seed, semantic_cache
+        )
+        logger.info(
+            f"concurrency={concurrency} rps={summary['throughput_rps']} "
+            f"p95={summary['latency_ms'] and summary['latency_ms']['p95']}ms errors={summary['errors']}"
+        )
+        results.append(summary)
+    return results
+
+
+def run_loadtest(
+    levels=(1, 2, 4, 8, 16),
+    queries=None,
+    base_url=None,
+    app=None,
+    duration_s=10.0,
+    requests_per_level=None,
+    ingest_interval_s=None,
+    timeout_s=60.0,
+    warmup=5,
+    seed=7,
+    semantic_cache=False,
+):
+    """Sweep concurrency levels and return throughput / latency curves.
+
+    Exactly one of base_url (running server) or app (in-process ASGI app)
+    must be given. ingest_interval_s enables the mixed ingest+search
+    workload: one client re-POSTs /rag/ingest, waiting that long between runs.
+    Searches send cache=false unless semantic_cache=True, so replayed queries
+    measure the pipeline rather than the semantic answer cache; each level
+    reports its cache hit rate either way.
+    """
+    if (base_url is None) == (app is None):
+        raise ValueError("Pass either base_url or app")
+    queries = queries or [{"query": q} for q in DEFAULT_QUERIES]
+    limits = httpx.Limits(max_connections=max(levels) + 2, max_keepalive_connections=max(levels) + 2)
+
+    async def main():
+        if app is not None:
+            transport = httpx.ASGITransport(app=app)
+            client = httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=timeout_s)
+        else:
+            client = httpx.AsyncClient(base_url=base_url, timeout=timeout_s, limits=limits)
+        async with client:
+            return await _sweep(
+                client, queries, levels, duration_s, requests_per_level, ingest_interval_s, warmup, seed, semantic_cache
+            )
+
+    curves = asyncio.run(main())
+    return {
+        "benchmark": "loadtest",
+        "environment": _environment(),
+        "config": {
+            "target": base_url or "in-process",
+            "levels": list(levels),
+            "duration_s": duration_s,
+            "requests_per_level": requests_per_level,
+            "queries": len(queries),
+            "mixed_ingest_interval_s": ingest_interval_s,
+            "semantic_cache": semantic_cache,
+        },
+        "levels": curves,
+    }
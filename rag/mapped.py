@@ -0,0 +1,162 @@
+# mapped.py — read-only, memory-mapped corpus shared by uvicorn workers
+#
+# Ingest publishes, next to docstore.jsonl (inside each snapshot, see snapshots.py):
+#   docstore.offsets.npy   int64 byte offset of every docstore line (+ end)
+#   columns/               MetadataColumns arrays (filters.py)
+#   keywords/              keyword postings in CSR form (keyword_index.py)
+#   VERSION                stamp written last, by atomic rename
+#
+# Workers open these with mmap (and the FAISS index with IO_FLAG_MMAP_IFC),
+# so N workers share one copy in the page cache instead of N private heaps.
+# Files are only ever replaced by rename, never rewritten in place, so a
+# worker still mapping the previous version keeps reading a consistent
+# inode. Workers watch VERSION and reload everything together when it
+# changes.
+
+import os
+import json
+import mmap
+import time
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+OFFSETS_FILE = "docstore.offsets.npy"
+VERSION_FILE = "VERSION"
+
+
+def atomic_write_npy(path: str, arr: np.ndarray):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
+def atomic_write_json(path: str, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _sidecar(docstore_path: str, name: str) -> str:
+    return os.path.join(os.path.dirname(docstore_path) or ".", name)
+
+
+def version_path(docstore_path: str) -> str:
+    return _sidecar(docstore_path, VERSION_FILE)
+
+
+def read_version(docstore_path: str) -> dict | None:
+    try:
+        with open(version_path(docstore_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def line_offsets(path: str) -> np.ndarray:
+    """Byte offset of each line start, plus the file size at the end."""
+    offsets = [0]
+    with open(path, "rb") as f:
+        for line in f:
+            offsets.append(offsets[-1] + len(line))
+    return np.asarray(offsets, dtype=np.int64)
+
+
+class MappedDocstore:
+    """Sequence of docstore rows read lazily from a memory-mapped jsonl."""
+
+    def __init__(self, path: str, offsets: np.ndarray):
+        self.path = path
+        self.offsets = offsets
+        self._file = open(path, "rb")
+        size = int(offsets[-1])
+        self._mm = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        try:
+            return json.loads(self._mm[self.offsets[i]:self.offsets[i + 1]])
+        except ValueError:
+            # keep row numbers aligned with the FAISS / keyword index
+            return {}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def publish(
+    docstore_path: str,
+    docs: list,
+    keywords,
+    model: str | None = None,
+    version: str | None = None,
+    ntotal: int | None = None,
+) -> dict:
+    """Write the mmap sidecars for a freshly persisted docstore, then the VERSION stamp."""
+    from .filters import MetadataColumns, COLUMNS_DIR
+    from .keyword_index import KEYWORD_PACK_DIR
+
+    atomic_write_npy(_sidecar(docstore_path, OFFSETS_FILE), line_offsets(docstore_path))
+    MetadataColumns(docs, keywords.major_masks).save(_sidecar(docstore_path, COLUMNS_DIR))
+    keywords.pack(_sidecar(docstore_path, KEYWORD_PACK_DIR))
+
+    stamp = {
+        "version": version or f"{time.time_ns():x}",
+        "rows": len(docs),
+        "ntotal": ntotal,
+        "model": model,
+        "created_at": int(time.time()),
+    }
+    atomic_write_json(version_path(docstore_path), stamp)
+    logger.info(f"Published mapped corpus version {stamp['version']} ({len(docs)} rows)")
+    return stamp
+
+
+def load(docstore_path: str, index_path: str, dim: int, retries: int = 5):
+    """(FaissStore, MappedDocstore, KeywordIndex, MetadataColumns, stamp) for the current VERSION.
+
+    VERSION is re-read after opening everything, and every artifact must
+    agree on the row count; otherwise an ingest was publishing meanwhile and
+    the load is retried, so a worker never mixes two versions.
+    Returns None when no mapped corpus has been published.
+    """
+    from .store import FaissStore
+    from .filters import MetadataColumns, COLUMNS_DIR
+    from .keyword_index import KeywordIndex, KEYWORD_PACK_DIR
+
+    for attempt in range(retries):
+        stamp = read_version(docstore_path)
+        if stamp is None:
+            return None
+        try:
+            store = FaissStore(dim, index_path, docstore_path)
+            store.load_or_create(with_docstore=False, mmap=True)
+            offsets = np.load(_sidecar(docstore_path, OFFSETS_FILE), mmap_mode="r")
+            docs = MappedDocstore(docstore_path, offsets)
+            keywords = KeywordIndex.load_packed(_sidecar(docstore_path, KEYWORD_PACK_DIR))
+            columns = MetadataColumns.load(_sidecar(docstore_path, COLUMNS_DIR))
+        except (OSError, ValueError) as e:
+            logger.info(f"Mapped corpus not readable yet ({e}), retrying")
+        else:
+            rows = stamp.get("rows")
+            consistent = (
+                read_version(docstore_path) == stamp
+                and os.fstat(docs._file.fileno()).st_size == int(offsets[-1])
+                and rows == len(docs) == len(keywords) == columns.size == store.index.ntotal
+            )
+            if consistent:
+                return store, docs, keywords, columns, stamp
+            logger.info("Corpus changed while loading, retrying")
+        time.sleep(0.05 * (attempt + 1))
+    raise RuntimeError("Mapped corpus kept changing during load")
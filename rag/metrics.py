@@ -0,0 +1,187 @@
+# metrics.py — lightweight timing spans + Prometheus-style metrics
+#
+# No client library needed: counters and histograms keep their values in
+# dicts keyed by label values, and render() emits the Prometheus text
+# exposition format for the /metrics endpoint.
+
+import time
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _label_str(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[n] for n in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.values = defaultdict(float)
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] += amount
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0.0)
+
+    def render(self):
+        lines = self.header()
+        with _lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_label_str(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = {}
+        self.sums = defaultdict(float)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            counts = self.counts.get(key)
+            if counts is None:
+                counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.sums[key] += value
+
+    def render(self):
+        lines = self.header()
+        names = self.labelnames + ("le",)
+        with _lock:
+            for key, counts in sorted(self.counts.items()):
+                for bound, n in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_label_str(names, key + (bound,))} {n}")
+                lines.append(f"{self.name}_bucket{_label_str(names, key + ('+Inf',))} {counts[-1]}")
+                lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {self.sums[key]}")
+                lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {counts[-1]}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class Trace:
+    """Per-request (or per-ingest) stage timings.
+
+    Each span adds its duration to the trace and, if a histogram is given,
+    observes it with label stage=<name> plus any fixed labels.
+    """
+
+    def __init__(self, histogram: Histogram | None = None, **labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.seconds = defaultdict(float)
+        self.counts = defaultdict(int)
+        # free-form tallies, e.g. totals["manual_pdf"]["bytes"]
+        self.totals = defaultdict(lambda: defaultdict(float))
+
+    @contextmanager
+    def span(self, stage, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.seconds[stage] += elapsed
+            self.counts[stage] += 1
+            if self.histogram is not None:
+                self.histogram.observe(elapsed, stage=stage, **self.labels, **labels)
+
+    def add(self, group, **amounts):
+        for name, amount in amounts.items():
+            self.totals[group][name] += amount
+
+    def as_ms(self):
+        return {stage: round(s * 1000.0, 3) for stage, s in self.seconds.items()}
+
+
+# ----------------------------- Search -----------------------------
+
+SEARCH_SECONDS = Histogram("rag_search_seconds", "End-to-end /rag/search latency.")
+SEARCH_STAGE_SECONDS = Histogram(
+    "rag_search_stage_seconds", "/rag/search latency by pipeline stage.", ["stage"]
+)
+SEARCH_CANDIDATES = Histogram(
+    "rag_search_candidates", "Candidates produced per search stage.", ["stage"], buckets=COUNT_BUCKETS
+)
+SEARCH_TIMEOUTS = Counter(
+    "rag_search_retriever_timeouts_total", "Retrievers that missed SEARCH_DEADLINE_MS.", ["retriever"]
+)
+LANGUAGE_ROUTES = Counter(
+    "rag_search_language_routes_total",
+    "Semantic searches by query language, index searched and whether the cross-lingual fallback ran.",
+    ["lang", "index", "fallback"],
+)
+CACHE_REQUESTS = Counter(
+    "rag_cache_requests_total", "Cache lookups by cache and result (hit/miss).", ["cache", "result"]
+)
+SEMANTIC_CACHE_HIT_AGE = Histogram(
+    "rag_semantic_cache_hit_age_seconds",
+    "Age of the cached answers served by the semantic answer cache.",
+    buckets=(1, 10, 60, 300, 900, 1800, 3600, 14400, 86400),
+)
+SLOW_QUERIES = Counter("rag_slow_queries_total", "Searches slower than SLOW_QUERY_MS (written to the slow-query log).")
+
+# ----------------------------- Ingest -----------------------------
+
+INGEST_STAGE_SECONDS = Histogram(
+    "rag_ingest_stage_seconds",
+    "Ingest time per document by stage and source type.",
+    ["stage", "source_type"],
+)
+INGEST_DOCS = Counter("rag_ingest_documents_total", "Documents ingested by source type.", ["source_type"])
+INGEST_BYTES = Counter("rag_ingest_bytes_total", "Raw bytes ingested by source type.", ["source_type"])
+INGEST_CHUNKS = Counter("rag_ingest_chunks_total", "Chunks produced by source type.", ["source_type"])
+INGEST_ERRORS = Counter("rag_ingest_errors_total", "Failed documents by source type.", ["source_type"])
+
+
+def cache_lookup(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
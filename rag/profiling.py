@@ -0,0 +1,166 @@
+# profiling.py — opt-in per-query profiling and the slow-query log
+#
+# With SLOW_QUERY_MS set, every search slower than that many ms is appended
+# to the slow-query log (slow_queries.jsonl in DATA_DIR, or SLOW_QUERY_LOG)
+# with its stage timings, candidate counts, index version and cache status.
+# All workers append to the same file, so /rag/admin/slow-queries and
+# `test.py slow-queries` see the slowest recent queries of every worker.
+#
+# A PROFILE_SAMPLE_RATE share of searches also runs under cProfile (the
+# request thread plus the retriever threads it fans out to); when such a
+# search turns out slow, its PROFILE_TOP functions by cumulative time go
+# into the log entry too. profile=true on /rag/search forces a profile and
+# returns it in the response.
+
+import os
+import json
+import time
+import random
+import pstats
+import cProfile
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+
+from .metrics import SLOW_QUERIES
+
+logger = logging.getLogger(__name__)
+
+# 0 = no slow-query log
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "25"))
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+# how much of the end of the log /rag/admin/slow-queries looks at
+SLOW_QUERY_TAIL_BYTES = 2 * 1024 * 1024
+
+
+class QueryProfile:
+    """cProfile data for one query, collected from every thread it ran on."""
+
+    def __init__(self):
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def section(self):
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            # another profiler is active (on 3.12+ only one per interpreter)
+            yield
+            return
+        try:
+            yield
+        finally:
+            prof.disable()
+            with self._lock:
+                self._profiles.append(prof)
+
+    def call(self, fn, *args, **kwargs):
+        """fn(*args, **kwargs) profiled (for work handed to another thread)."""
+        with self.section():
+            return fn(*args, **kwargs)
+
+    def top(self, n: int | None = None) -> list:
+        """Functions by cumulative time, merged over all sections."""
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return []
+        stats = pstats.Stats(profiles[0])
+        for prof in profiles[1:]:
+            stats.add(prof)
+        rows = [
+            {
+                "function": f"{os.path.basename(filename)}:{line}({name})",
+                "calls": int(calls),
+                "tottime_ms": round(tottime * 1000.0, 3),
+                "cumtime_ms": round(cumtime * 1000.0, 3),
+            }
+            for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items()
+        ]
+        rows.sort(key=lambda r: -r["cumtime_ms"])
+        return rows[:n or PROFILE_TOP]
+
+
+class _NoProfile:
+    def section(self):
+        return nullcontext()
+
+    def call(self, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    def top(self, n: int | None = None) -> list:
+        return []
+
+
+NO_PROFILE = _NoProfile()
+
+
+def start(force: bool = False):
+    """A QueryProfile for this query when forced or sampled, else NO_PROFILE."""
+    if force or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE):
+        return QueryProfile()
+    return NO_PROFILE
+
+
+class SlowQueryLog:
+    """Append-only JSONL of queries slower than threshold_ms."""
+
+    def __init__(self, path: str, threshold_ms: float | None = None):
+        self.path = path
+        self.threshold_ms = SLOW_QUERY_MS if threshold_ms is None else threshold_ms
+        self._lock = threading.Lock()
+
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0 and bool(self.path)
+
+    def is_slow(self, total_ms: float) -> bool:
+        return self.enabled() and total_ms >= self.threshold_ms
+
+    def record(self, entry: dict) -> bool:
+        """Log entry (needs total_ms) if it is slow; returns whether it was logged."""
+        if not self.is_slow(entry["total_ms"]):
+            return False
+        entry = {"ts": int(time.time()), "pid": os.getpid(), **entry}
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        SLOW_QUERIES.inc()
+        logger.warning(f"Slow query ({entry['total_ms']} ms): {entry.get('query')!r}")
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                if os.path.exists(self.path) and os.path.getsize(self.path) > SLOW_QUERY_LOG_MAX_BYTES:
+                    os.replace(self.path, self.path + ".1")
+                # one write per entry in append mode, so workers don't interleave lines
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+        except OSError as e:
+            logger.error(f"Could not write slow-query log {self.path}: {e}")
+        return True
+
+    def recent(self) -> list:
+        """Entries from the end of the log (up to SLOW_QUERY_TAIL_BYTES), oldest first."""
+        try:
+            with open(self.path, "rb") as f:
+                size = f.seek(0, os.SEEK_END)
+                f.seek(max(0, size - SLOW_QUERY_TAIL_BYTES))
+                data = f.read()
+        except OSError:
+            return []
+        lines = data.split(b"\n")
+        if size > SLOW_QUERY_TAIL_BYTES:
+            lines = lines[1:]  # first line is probably cut
+        out = []
+        for line in lines:
+            try:
+                out.append(json.loads(line))
+            except ValueError:
+                continue
+        return out
+
+    def slowest(self, n: int = 20, since: int | None = None) -> list:
+        entries = [e for e in self.recent() if since is None or e.get("ts", 0) >= since]
+        entries.sort(key=lambda e: -e.get("total_ms", 0))
+        return entries[:n]
@@ -0,0 +1,192 @@
+# query.py — query analysis, done once per query and cached
+#
+# Major aliases and requirement terms live in query_terms.json next to this
+# file, or in the file pointed to by QUERY_TERMS_PATH:
+#
+#   {"majors": {"data_science": ["data science", "데이터과학"], ...},
+#    "requirement_terms": ["학점", "credits", ...]}
+#
+# The aliases are compiled once into an Aho-Corasick automaton, so finding
+# every major a text mentions is one pass over the text instead of a
+# substring test per alias. Majors keep their file order; it fixes the
+# major bits stored by ingest (keyword_index.MAJOR_BITS), so append new
+# majors at the end and re-ingest after changing aliases. A missing or
+# invalid packaged file fails at import, since an empty alias table would
+# silently shift the stored major bits; a bad QUERY_TERMS_PATH override
+# falls back to the packaged file with a warning.
+#
+# analyze() turns a query string into an AnalyzedQuery (tokens, numeric and
+# requirement terms, target major and its aliases). Results are kept in an
+# LRU of QUERY_CACHE_SIZE entries, and search passes the analyzed query
+# down to the keyword scorer instead of re-tokenizing at each step.
+
+import os
+import re
+import json
+import logging
+import threading
+from collections import OrderedDict, deque
+from pathlib import Path
+
+from .metrics import cache_lookup
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TERMS_PATH = str(Path(__file__).with_name("query_terms.json"))
+TERMS_PATH = os.getenv("QUERY_TERMS_PATH", DEFAULT_TERMS_PATH)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "4096"))
+
+TOKEN_RE = re.compile(r"[0-9A-Za-z가-힣]+")
+
+# keyword weight multipliers (see KeywordIndex.score)
+NUMERIC_WEIGHT = 1.6
+REQUIREMENT_WEIGHT = 1.4
+
+
+def _read_terms(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        terms = json.load(f)
+    if not isinstance(terms, dict) or not isinstance(terms.get("majors"), dict):
+        raise ValueError('expected a JSON object with a "majors" object')
+    return terms
+
+
+def _load_terms(path: str) -> dict:
+    """Load the terms file; a broken packaged file is a startup error.
+
+    Only an override set through QUERY_TERMS_PATH falls back, with a
+    warning, to the packaged terms.
+    """
+    if path != DEFAULT_TERMS_PATH:
+        try:
+            return _read_terms(path)
+        except Exception as e:
+            logger.warning(f"Failed to load query terms {path}: {e}; using {DEFAULT_TERMS_PATH}")
+    try:
+        return _read_terms(DEFAULT_TERMS_PATH)
+    except Exception as e:
+        raise RuntimeError(f"Failed to load packaged query terms {DEFAULT_TERMS_PATH}: {e}") from e
+
+
+class AliasMatcher:
+    """Aho-Corasick automaton: which keys have an alias occurring in a text."""
+
+    def __init__(self, aliases: dict):
+        self.order = {key: i for i, key in enumerate(aliases)}
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [set()]
+        for key, names in aliases.items():
+            for name in names:
+                node = 0
+                for ch in name.lower():
+                    nxt = self.goto[node].get(ch)
+                    if nxt is None:
+                        nxt = len(self.goto)
+                        self.goto.append({})
+                        self.fail.append(0)
+                        self.out.append(set())
+                        self.goto[node][ch] = nxt
+                    node = nxt
+                if node:
+                    self.out[node].add(key)
+
+        # failure links, breadth first (root's children fail to the root)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                self.out[nxt] |= self.out[self.fail[nxt]]
+
+    def keys(self, text: str) -> list:
+        """Keys with at least one alias in `text` (lower-cased), in config order."""
+        found = set()
+        node = 0
+        goto, fail, out = self.goto, self.fail, self.out
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found |= out[node]
+        return sorted(found, key=self.order.get)
+
+
+_terms = _load_terms(TERMS_PATH)
+MAJOR_ALIASES = {key: set(a.lower() for a in names) for key, names in _terms.get("majors", {}).items()}
+REQ_TERMS = set(_terms.get("requirement_terms", []))
+MAJOR_MATCHER = AliasMatcher(MAJOR_ALIASES)
+
+
+def tokenize(text: str):
+    """Universal tokenizer: handles English, Korean, numbers, etc."""
+    return TOKEN_RE.findall(text.lower())
+
+
+class AnalyzedQuery:
+    """Everything the pipeline derives from the query text, computed once."""
+
+    def __init__(self, text: str):
+        self.text = text
+        lower = text.lower()
+        self.tokens = tuple(TOKEN_RE.findall(lower))
+        self.numeric = tuple(t for t in self.tokens if t.isdigit())
+        self.requirement = tuple(t for t in self.tokens if t in REQ_TERMS)
+        self.majors = tuple(MAJOR_MATCHER.keys(lower))
+        self.target_major = self.majors[0] if self.majors else None
+        self.aliases = tuple(sorted(MAJOR_ALIASES[self.target_major])) if self.target_major else ()
+
+        # (token, weight) pairs scored by the keyword index
+        weighted = []
+        for t in self.tokens:
+            if len(t) < 2:
+                continue
+            weight = 1.0
+            if t.isdigit():
+                weight *= NUMERIC_WEIGHT
+            if t in REQ_TERMS:
+                weight *= REQUIREMENT_WEIGHT
+            weighted.append((t, weight))
+        self.weighted = tuple(weighted)
+
+    def as_dict(self) -> dict:
+        return {
+            "tokens": list(self.tokens),
+            "numeric": list(self.numeric),
+            "requirement": list(self.requirement),
+            "target_major": self.target_major,
+            "aliases": list(self.aliases),
+        }
+
+
+_cache: OrderedDict = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def analyze(query) -> AnalyzedQuery:
+    """AnalyzedQuery for a query string (an AnalyzedQuery is returned as is)."""
+    if isinstance(query, AnalyzedQuery):
+        return query
+    query = query or ""
+    with _cache_lock:
+        analyzed = _cache.get(query)
+        if analyzed is not None:
+            _cache.move_to_end(query)
+    cache_lookup("query_analysis", analyzed is not None)
+    if analyzed is None:
+        analyzed = AnalyzedQuery(query)
+        with _cache_lock:
+            _cache[query] = analyzed
+            while len(_cache) > QUERY_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return analyzed
+
+
+def detect_target_major(query) -> str | None:
+    return analyze(query).target_major
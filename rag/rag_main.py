@@ -6,22 +6,43 @@
 # - Adaptive chunk limit
 # - Works for ANY question or dataset
 from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import os
 import json
-import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 from pathlib import Path
 
+import numpy as np
+
 # Load .env next to this file to be robust to CWD
 load_dotenv(Path(__file__).with_name(".env"))
 
 import logging
 
 # Remove manual sys.path manipulation and import via package
-from .ingest import ingest
+from .ingest import ingest, compact
 from .store import FaissStore
 from .embeddings import get_embedding_model
+from .filters import MetadataColumns
+from .fusion import merge, rerank, reorder, materialize, iter_hits, shape_hit, SNIPPET_CHARS
+from . import reranker
+from . import metrics
+from . import mapped
+from . import snapshots
+from . import shards
+from . import lang
+from . import hierarchy
+from . import scheduler
+from . import semantic_cache
+from . import profiling
+from . import changelog
+from .metrics import Trace, SEARCH_SECONDS, SEARCH_STAGE_SECONDS, SEARCH_CANDIDATES, SEARCH_TIMEOUTS, LANGUAGE_ROUTES
+from .query import AnalyzedQuery, analyze
+from .keyword_index import KeywordIndex, keyword_index_path
 
 app = FastAPI(title="Universal Hybrid RAG")
 
@@ -40,6 +61,13 @@ EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM
 TOP_K = int(os.getenv("TOP_K", "5"))
 MAX_CHUNKS = int(os.getenv("MAX_CHUNKS", "12"))
 SEMANTIC_CAND_MULTIPLIER = int(os.getenv("SEMANTIC_CAND_MULTIPLIER", "6"))
+# Serve the memory-mapped corpus published by ingest (shared across workers)
+MMAP_INDEX = os.getenv("MMAP_INDEX", "1").lower() in ("1", "true", "yes")
+# Semantic + keyword retrievers run concurrently and share this budget (0 = no deadline)
+SEARCH_DEADLINE_MS = int(os.getenv("SEARCH_DEADLINE_MS", "1000"))
+SEARCH_THREADS = int(os.getenv("SEARCH_THREADS", "8"))
+# Searches slower than SLOW_QUERY_MS are appended here (see profiling.py)
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", str(DATA_DIR / "slow_queries.jsonl"))
 
 logging.basicConfig(
     level=logging.INFO,
@@ -50,179 +78,410 @@ logger = logging.getLogger("RAG")
 logger.info("Loading embedding model globally...")
 embedder = get_embedding_model(EMBEDDING_MODEL)
 
+if reranker.enabled():
+    logger.info(f"Loading cross-encoder {reranker.CROSS_ENCODER_MODEL}...")
+    reranker.get_cross_encoder()
+
 # ----------------------------- Utils -----------------------------
 
-def load_docstore():
+def active_paths():
+    """(index_path, docstore_path, snapshot version) being served.
+
+    The CURRENT snapshot when one has been published, else INDEX_PATH /
+    DOCSTORE_PATH. Re-read per request, so a publish or rollback is picked
+    up by every worker without a restart.
+    """
+    return snapshots.resolve(INDEX_PATH, DOCSTORE_PATH)
+
+
+def load_docstore(path: str | None = None):
+    path = path or active_paths()[1]
     docs = []
-    if os.path.exists(DOCSTORE_PATH):
-        with open(DOCSTORE_PATH, "r", encoding="utf-8") as f:
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
             for line in f:
                 try:
                     docs.append(json.loads(line))
                 except:
-                    pass
+                    # keep row numbers aligned with the FAISS / keyword index
+                    docs.append({})
     return docs
 
 
-def tokenize(text: str):
-    """Universal tokenizer: handles English, Korean, numbers, etc."""
-    return re.findall(r"[0-9A-Za-z가-힣]+", text.lower())
+def _file_key(path: str):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
 
 
-MAJOR_ALIASES = {
-    "platform_software": {"platform software", "플랫폼소프트웨어"},
-    "global_software": {"global software", "글솝", "glassop", "global sw"},
-    "data_science": {"data science", "데이터과학"},
-    "advanced_computing": {"advanced computing", "심화컴퓨터공학", "abeek"},
-}
+class Corpus:
+    """Everything a search reads, from one snapshot (plus its change log):
+    rows, keyword index, filter columns, FAISS index, language router and
+    hierarchy texts.
 
-def detect_target_major(query: str) -> str | None:
-    q = (query or "").lower()
-    for key, aliases in MAJOR_ALIASES.items():
-        if any(a in q for a in aliases):
-            return key
-    return None
+    A Corpus is never changed after load_corpus() publishes it; a new
+    snapshot or change log record gets a new Corpus, swapped in with one
+    assignment. A request keeps the one it started with, so an index can't
+    be paired with another version's rows. With a change log, `base` is
+    the snapshot's own Corpus and `overlay` the log on top of it
+    (changelog.Overlay); otherwise base is the corpus itself.
+    """
 
-def keyword_rank(query: str, docs: list, max_results: int = 50):
+    def __init__(
+        self, key, docs, keywords, columns, texts, index_path, docstore_path, version,
+        store=None, stamp_version=None, base=None, overlay=None,
+    ):
+        self.key = key
+        self.docs = docs
+        self.keywords = keywords
+        self.columns = columns
+        self.texts = texts
+        self.index_path = index_path
+        self.docstore_path = docstore_path
+        self.version = version
+        # loaded with the corpus (mapped), else on first faiss_store()
+        self.store = store
+        self.stamp_version = stamp_version
+        self.base = base or self
+        self.overlay = overlay
+        self.changes = overlay.records if overlay is not None else 0
+        self.log_end = overlay.end if overlay is not None else 0
+        self._router = None
+        self._router_loaded = False
+        self._lock = threading.Lock()
+
+    def faiss_store(self, dim: int) -> FaissStore:
+        metrics.cache_lookup("faiss_index", self.store is not None)
+        if self.store is None:
+            with self._lock:
+                if self.store is None:
+                    if self.overlay is not None:
+                        self.store = changelog.LayeredStore(self.base.faiss_store(dim), self.overlay)
+                    else:
+                        store = FaissStore(dim, self.index_path, self.docstore_path)
+                        store.load_or_create(with_docstore=False)
+                        self.store = store
+        return self.store
+
+    def router(self):
+        """LangRouter over this snapshot's language sub-indexes, or None when not built."""
+        if not self._router_loaded:
+            with self._lock:
+                if not self._router_loaded:
+                    # sub-indexes only cover the snapshot, not rows from its change log
+                    if self.overlay is None:
+                        self._router = lang.open_router(self.docstore_path, len(self.docs), mmap=MMAP_INDEX)
+                    self._router_loaded = True
+        return self._router
+
+
+# The corpus being served; replaced (never modified) when files change
+_corpus: Corpus | None = None
+# One request thread loads a new corpus; the others keep serving the old one
+_load_lock = threading.Lock()
+
+
+def _publish(corpus: Corpus) -> Corpus:
+    global _corpus
+    _corpus = corpus
+    return corpus
+
+
+def _reload(key, build):
+    """The served corpus if it has `key`, else build() published in its place.
+
+    While another thread builds, requests keep the corpus they have (if
+    any) instead of all loading the same files. build(old) gets the served
+    corpus and returns None when the files aren't usable.
     """
-    Enhanced keyword relevance for requirements & numeric facts:
-    - token overlaps
-    - title boosts (2x)
-    - extra boosts for digits and requirement terms
+    corpus = _corpus
+    metrics.cache_lookup("corpus", corpus is not None and corpus.key == key)
+    if corpus is not None and corpus.key == key:
+        return corpus
+    if not _load_lock.acquire(blocking=corpus is None):
+        return corpus
+    try:
+        if _corpus is not None and _corpus.key == key:
+            return _corpus
+        built = build(_corpus)
+        return _publish(built) if built is not None else None
+    finally:
+        _load_lock.release()
+
+
+def _log_key(docstore_path: str):
+    """Identity of the snapshot's change log, or None without one."""
+    key = _file_key(changelog.log_path(docstore_path))
+    return key if key is not None and key[1] else None
+
+
+def _with_log(base: Corpus, old: Corpus | None, log_key) -> Corpus:
+    """base, or base with its change log (up to log_key) in an Overlay beside it.
+
+    The snapshot's index, postings and columns are shared, not copied. When
+    `old` layered the same snapshot, only the records appended since are read.
     """
-    q_tokens = tokenize(query)
-    if not q_tokens:
-        return []
-
-    numeric_terms = set([t for t in q_tokens if t.isdigit()])
-    req_terms = {"credit", "credits", "학점", "internship", "인턴", "요건", "requirements", "졸업", "필수"}
-    target_major = detect_target_major(query)
-
-    scored_docs = []
-    for d in docs:
-        text = (d.get("text") or d.get("content") or "").lower()
-        title = (d.get("title") or "").lower()
-        url = (d.get("url") or "").lower()
-        if not text and not title:
-            continue
-
-        score = 0.0
-        for t in q_tokens:
-            if len(t) < 2:
-                continue
-            title_hits = title.count(t)
-            text_hits = text.count(t)
-            base = 2.0 * title_hits + 1.0 * text_hits
-            if t in numeric_terms:
-                base *= 1.6
-            if t in req_terms:
-                base *= 1.4
-            score += base
-
-        # Major-aware boosting/penalty based on title/url path
-        if target_major:
-            target_aliases = MAJOR_ALIASES.get(target_major, set())
-            # Found target major in title or url/path
-            if any(a in title or a in url for a in target_aliases):
-                score *= 1.6
-            else:
-                # Penalize obvious mismatches (aliases from other majors)
-                other_aliases = set().union(*(v for k, v in MAJOR_ALIASES.items() if k != target_major))
-                if any(a in title or a in url for a in other_aliases):
-                    score *= 0.7
-
-        if score > 0:
-            newd = dict(d)
-            newd["keyword_score"] = float(score)
-            scored_docs.append(newd)
-
-    scored_docs.sort(key=lambda x: x.get("keyword_score", 0.0), reverse=True)
-    return scored_docs[:max_results]
-
-
-def build_store(dim: int) -> FaissStore:
-    store = FaissStore(dim, INDEX_PATH, DOCSTORE_PATH)
-    store.load_or_create()
-    return store
-
-
-def merge(semantic, keyword):
-    """Merge semantic + keyword candidates without domain bias."""
-    merged = {}
-    for d in semantic:
-        key = (d.get("url"), d.get("text"))
-        merged[key] = {
-            **d,
-            "semantic_score": float(d.get("score", 0.0)),
-            "keyword_score": float(d.get("keyword_score", 0.0)),
-        }
-
-    for d in keyword:
-        key = (d.get("url"), d.get("text"))
-        if key not in merged:
-            merged[key] = {
-                **d,
-                "semantic_score": float(d.get("semantic_score", 0.0)),
-                "keyword_score": float(d.get("keyword_score", 0.0)),
-            }
-        else:
-            merged[key]["keyword_score"] = max(
-                merged[key]["keyword_score"],
-                float(d.get("keyword_score", 0.0)),
-            )
+    if log_key is None:
+        return base
+    if old is not None and old.base is base and old.overlay is not None and old.log_end <= log_key[1]:
+        overlay = old.overlay.advanced(base.docstore_path, log_key[1])
+        logger.info(f"Read {overlay.records - old.changes} new change log records of snapshot {base.version}")
+    else:
+        overlay = changelog.Overlay(base.columns, len(base.docs)).advanced(base.docstore_path, log_key[1])
+        logger.info(
+            f"Serving snapshot {base.version} plus {overlay.records} change log records "
+            f"({len(overlay)} rows added, {overlay.dropped} dropped)"
+        )
+    texts = base.texts
+    if overlay.texts:
+        texts = hierarchy.OverlayTexts(texts, overlay.texts)
+    return Corpus(
+        (base.key[0], log_key),
+        changelog.LayeredRows(base.docs, overlay),
+        changelog.LayeredKeywords(base.keywords, overlay),
+        changelog.LayeredColumns(base.columns, overlay),
+        texts, base.index_path, base.docstore_path, base.version,
+        stamp_version=base.stamp_version, base=base, overlay=overlay,
+    )
 
-    return list(merged.values())
 
+def _load_mapped(index_path: str, docstore_path: str, version: str | None, log_key):
+    """Memory-mapped corpus + FAISS index, reloaded together when VERSION changes.
 
-def rerank(cands: list, k: int, max_chunks: int):
+    Returns None when nothing has been published yet (fall back to files).
     """
-    Fusion score tuned for numeric requirement queries:
-        final = 0.55 * semantic + 0.45 * keyword_norm
+    stamp_key = _file_key(mapped.version_path(docstore_path))
+    if stamp_key is None:
+        return None
+    base_key = ("mapped", docstore_path, stamp_key)
+
+    def build(old):
+        if old is not None and old.base.key[0] == base_key:
+            return _with_log(old.base, old, log_key)
+        loaded = mapped.load(docstore_path, index_path, embedder.get_sentence_embedding_dimension())
+        if loaded is None:
+            return None
+        store, docs, keywords, columns, stamp = loaded
+        logger.info(f"Serving mapped corpus version {stamp['version']} ({len(docs)} rows)")
+        base = Corpus(
+            (base_key, None), docs, keywords, columns,
+            hierarchy.TextStore.open(docstore_path), index_path, docstore_path, version,
+            store=store, stamp_version=stamp["version"],
+        )
+        return _with_log(base, None, log_key)
+
+    return _reload((base_key, log_key), build)
+
+
+def _load_files(index_path: str, docstore_path: str, version: str | None, log_key):
+    kw_path = keyword_index_path(docstore_path)
+    base_key = (docstore_path, _file_key(docstore_path), _file_key(kw_path), _file_key(index_path))
+
+    def build(old):
+        if old is not None and old.base.key[0] == base_key:
+            return _with_log(old.base, old, log_key)
+        docs = load_docstore(docstore_path)
+        keywords = KeywordIndex(kw_path)
+        keywords.load()
+        # Docstores written before the keyword index existed get stats computed here
+        keywords.sync(docs)
+        columns = MetadataColumns(docs, keywords.major_masks)
+        base = Corpus(
+            (base_key, None), docs, keywords, columns, hierarchy.TextStore.open(docstore_path),
+            index_path, docstore_path, version,
+            stamp_version=(mapped.read_version(docstore_path) or {}).get("version"),
+        )
+        return _with_log(base, None, log_key)
+
+    return _reload((base_key, log_key), build)
+
+
+def load_corpus() -> Corpus:
+    """The Corpus to search, reloaded only when the snapshot or its files change."""
+    index_path, docstore_path, version = active_paths()
+    log_key = _log_key(docstore_path)
+    corpus = None
+    if MMAP_INDEX:
+        corpus = _load_mapped(index_path, docstore_path, version, log_key)
+    if corpus is None:
+        corpus = _load_files(index_path, docstore_path, version, log_key)
+    return corpus
+
+
+def keyword_rank(query: "str | AnalyzedQuery", index: KeywordIndex, max_results: int = 50, mask=None):
     """
-    if not cands:
-        return []
+    Enhanced keyword relevance for requirements & numeric facts:
+    - token overlaps
+    - title boosts (2x)
+    - extra boosts for digits and requirement terms
 
-    max_key = max((c.get("keyword_score", 0.0) for c in cands), default=1.0)
-    if max_key <= 0:
-        max_key = 1.0
+    Scoring runs over the precomputed KeywordIndex and returns
+    (row ids, scores), best first.
+    """
+    return index.score(query, max_results=max_results, mask=mask)
 
-    final = []
-    for c in cands:
-        sem = float(c.get("semantic_score", 0.0))
-        key = float(c.get("keyword_score", 0.0))
-        key_norm = key / max_key
 
-        score = 0.55 * sem + 0.45 * key_norm
+def build_store(dim: int) -> FaissStore:
+    """FAISS index of the corpus being served (search only needs vectors)."""
+    return load_corpus().faiss_store(dim)
+
+# Shard workers follow the corpus: a new snapshot gets a new pool
+_shard_pool = {"key": None, "pool": None}
+_shard_lock = threading.Lock()
+
+
+def shard_pool(corpus: Corpus):
+    """ShardPool for `corpus`, or None when unsharded."""
+    if not shards.enabled():
+        return None
+    key = "remote" if shards.SHARD_URLS else corpus.key
+    with _shard_lock:
+        if key != _shard_pool["key"]:
+            old = _shard_pool["pool"]
+            pool = shards.open_pool(corpus.index_path, corpus.docstore_path, version=corpus.version)
+            _shard_pool.update(key=key, pool=pool)
+            if old is not None:
+                old.close()
+        return _shard_pool["pool"]
+
+
+_retrievers = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="retrieve")
+
+
+def semantic_search(corpus: Corpus, query: str, sem_k: int, mask, trace: Trace, vector=None):
+    """Encode + FAISS (or the language sub-index); returns (scores, ids, route)."""
+    if vector is None:
+        with trace.span("encode"):
+            vector = embedder.encode([query])[0]
+    with trace.span("build_store"):
+        store = corpus.faiss_store(len(vector))
+    router = corpus.router()
+    with trace.span("store_search"):
+        if router is None:
+            sem_scores, sem_ids = store.search_ids(vector, k=sem_k, mask=mask)
+            return sem_scores, sem_ids, None
+        # query-language sub-index first, other languages on fallback
+        sem_scores, sem_ids, route = router.search(query, vector, store, sem_k, mask=mask)
+    LANGUAGE_ROUTES.inc(lang=route["lang"], index=route["index"], fallback=str(route["fallback"]).lower())
+    return sem_scores, sem_ids, route
+
+
+def _keyword_search(query: AnalyzedQuery, keywords: KeywordIndex, mask, trace: Trace):
+    with trace.span("keyword_rank"):
+        return keyword_rank(query, keywords, mask=mask)
+
+
+def hybrid_retrieve(corpus: Corpus, query: "str | AnalyzedQuery", sem_k: int, mask, trace: Trace, deadline_ms=None, vector=None, prof=None):
+    """Run both retrievers concurrently under one deadline.
+
+    Returns (sem_scores, sem_ids, kw_ids, kw_scores, route, timed_out). A
+    retriever that misses the deadline contributes no candidates and is
+    listed in timed_out; if both miss, the result is empty. The deadline is
+    soft: it bounds how long the request waits, not the work. A retriever
+    still queued for a thread is cancelled, but one already running can't
+    be interrupted and finishes in the background. `vector` is the query
+    embedding when the caller already has it; `prof` a profiling.QueryProfile
+    that the retriever threads add to.
+    """
+    deadline_ms = SEARCH_DEADLINE_MS if deadline_ms is None else deadline_ms
+    prof = prof or profiling.NO_PROFILE
+    query = analyze(query)
+    futures = {
+        "semantic": _retrievers.submit(prof.call, semantic_search, corpus, query.text, sem_k, mask, trace, vector),
+        "keyword": _retrievers.submit(prof.call, _keyword_search, query, corpus.keywords, mask, trace),
+    }
+    done, _ = wait(futures.values(), timeout=deadline_ms / 1000.0 if deadline_ms > 0 else None)
 
-        newc = dict(c)
-        newc["final_score"] = float(score)
-        final.append(newc)
+    timed_out = [name for name, f in futures.items() if f not in done]
+    for name in timed_out:
+        # not started yet: drop it, so late work doesn't pile up in the pool
+        futures[name].cancel()
+        SEARCH_TIMEOUTS.inc(retriever=name)
+    if timed_out:
+        logger.warning(f"Search deadline ({deadline_ms} ms) missed by: {', '.join(timed_out)}")
 
-    final.sort(key=lambda x: x["final_score"], reverse=True)
+    no_ids, no_scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    sem_scores, sem_ids, route = (no_scores, no_ids, None) if "semantic" in timed_out else futures["semantic"].result()
+    kw_ids, kw_scores = (no_ids, no_scores) if "keyword" in timed_out else futures["keyword"].result()
+    return sem_scores, sem_ids, kw_ids, kw_scores, route, timed_out
 
-    # Group by document (url) and keep best per doc to avoid one doc dominating
-    by_doc: dict[str, dict] = {}
-    for item in final:
-        doc_key = str(item.get("url"))
-        prev = by_doc.get(doc_key)
-        if (prev is None) or (item.get("final_score", 0.0) > prev.get("final_score", 0.0)):
-            by_doc[doc_key] = item
 
-    grouped = list(by_doc.values())
-    grouped.sort(key=lambda x: x.get("final_score", 0.0), reverse=True)
+def second_stage(query: str, ranked, corpus: Corpus, limit: int):
+    """Cross-encoder rescoring of the fused top-N, within RERANK_BUDGET_MS.
 
-    limit = min(len(grouped), max_chunks, max(k, 1))
-    return grouped[:limit]
+    Returns (candidates, status) where status is "off", "applied",
+    "timeout" or "error" (fused order kept for both).
+    """
+    if not reranker.enabled() or len(ranked) <= 1:
+        return ranked.take(slice(0, limit)), "off"
+    ids = ranked.ids.tolist()
+    try:
+        scores = reranker.cross_encode(
+            query,
+            ids,
+            [corpus.docs[i].get("text") or "" for i in ids],
+            version=corpus.key,
+        )
+    except Exception as e:
+        logger.error(f"Cross-encoder failed: {e}")
+        return ranked.take(slice(0, limit)), "error"
+    if scores is None:
+        return ranked.take(slice(0, limit)), "timeout"
+    return reorder(ranked, scores, limit), "applied"
 
 # ----------------------------- Health -----------------------------
 
 @app.get("/rag/health")
 def rag_health():
-    count = 0
-    if os.path.exists(DOCSTORE_PATH):
-        with open(DOCSTORE_PATH, "r", encoding="utf-8") as f:
-            count = sum(1 for _ in f)
-    return {"ok": True, "documents": count}
+    """Liveness + corpus status in O(1): manifest / stamp metadata plus
+    whatever this worker already has in memory. Never reads the corpus."""
+    _, docstore_path, _ = active_paths()
+    corpus = _corpus
+    status = snapshots.describe(INDEX_PATH, DOCSTORE_PATH)
+    status["serving_model"] = EMBEDDING_MODEL
+    # manifest counts don't include the change log until it is compacted
+    status["changelog_bytes"] = changelog.pending(docstore_path)
+
+    if corpus is not None and corpus.docstore_path == docstore_path:
+        loaded = {"documents": len(corpus.docs), "keywords": len(corpus.keywords)}
+        if corpus.store is not None:
+            loaded["index_ntotal"] = int(corpus.store.ntotal)
+        counts = set(loaded.values())
+        if corpus.changes:
+            # rows count the log's dropped rows too; they are masked out of searches
+            loaded["changes"] = corpus.changes
+            loaded["dropped"] = corpus.overlay.dropped
+        status["loaded"] = loaded
+        if status["documents"] is not None and not status["changelog_bytes"]:
+            counts.add(status["documents"])
+        status["consistent"] = status["consistent"] is not False and len(counts) == 1
+    return {"ok": True, **status}
+
+
+@app.get("/rag/ready")
+def rag_ready():
+    """Readiness: 200 once this worker has the live corpus loaded and it is consistent."""
+    try:
+        corpus = load_corpus()
+        if not shards.enabled():
+            corpus.faiss_store(embedder.get_sentence_embedding_dimension())
+    except Exception as e:
+        logger.error(f"Not ready: {e}")
+        raise HTTPException(503, f"Corpus not loaded: {e}")
+    status = rag_health()
+    if status["consistent"] is False:
+        raise HTTPException(503, "Docstore and index are out of sync")
+    if status["model"] and status["model"] != EMBEDDING_MODEL:
+        raise HTTPException(503, f"Index built with {status['model']}, serving {EMBEDDING_MODEL}")
+    return {"ready": True, **status}
+
+# ----------------------------- Metrics -----------------------------
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 # ----------------------------- Ingest -----------------------------
 
@@ -244,37 +503,312 @@ def rag_ingest(req: IngestRequest):
     return stats
 
 
+# ----------------------------- Scheduled refresh -----------------------------
+
+_scheduler = scheduler.Scheduler(INDEX_PATH, DOCSTORE_PATH, EMBEDDING_MODEL)
+
+@app.on_event("startup")
+def start_scheduler():
+    if scheduler.SCHEDULER_ENABLED:
+        _scheduler.start()
+
+@app.on_event("shutdown")
+def stop_scheduler():
+    _scheduler.stop()
+
+@app.get("/rag/schedule")
+def rag_schedule():
+    """Per-source refresh intervals and observed change rates."""
+    return {"enabled": scheduler.SCHEDULER_ENABLED, **scheduler.status(DOCSTORE_PATH)}
+
+
+# ----------------------------- Cache -----------------------------
+
+@app.get("/rag/cache")
+def rag_cache():
+    """Semantic answer cache of this worker: hit rate, size and staleness."""
+    return {"semantic": semantic_cache.report()}
+
+
+@app.post("/rag/cache/clear")
+def rag_cache_clear():
+    semantic_cache.clear()
+    return {"ok": True}
+
+
+# ----------------------------- Admin -----------------------------
+
+slow_queries = profiling.SlowQueryLog(SLOW_QUERY_LOG)
+
+
+@app.get("/rag/admin/slow-queries")
+def rag_slow_queries(n: int = 20, since: int | None = None):
+    """Slowest recent queries from the slow-query log (all workers), slowest first."""
+    return {
+        "enabled": slow_queries.enabled(),
+        "threshold_ms": slow_queries.threshold_ms,
+        "profile_sample_rate": profiling.PROFILE_SAMPLE_RATE,
+        "log": slow_queries.path,
+        "queries": slow_queries.slowest(max(n, 0), since),
+    }
+
+
+# ----------------------------- Snapshots -----------------------------
+
+class RollbackRequest(BaseModel):
+    version: str | None = None
+    verify: bool = True
+
+@app.get("/rag/snapshots")
+def rag_snapshots():
+    base_dir = snapshots.data_dir(DOCSTORE_PATH)
+    return {
+        "current": snapshots.current(base_dir),
+        "keep": snapshots.SNAPSHOT_KEEP,
+        "snapshots": [
+            {k: v for k, v in m.items() if k != "files"} for m in snapshots.list_snapshots(base_dir)
+        ],
+    }
+
+@app.post("/rag/snapshots/rollback")
+def rag_snapshots_rollback(req: RollbackRequest):
+    """Point CURRENT at `version` (default: the previous snapshot); all workers switch on their next request."""
+    base_dir = snapshots.data_dir(DOCSTORE_PATH)
+    try:
+        m = snapshots.rollback(base_dir, req.version, check=req.verify)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return {"ok": True, "current": m["version"], "rows": m.get("rows")}
+
+
+@app.post("/rag/snapshots/compact")
+def rag_snapshots_compact():
+    """Fold the live snapshot's change log into a new snapshot now (normally done in the background)."""
+    m = compact(INDEX_PATH, DOCSTORE_PATH, EMBEDDING_MODEL)
+    if m is None:
+        return {"ok": True, "compacted": False}
+    return {"ok": True, "compacted": True, "current": m["version"], "rows": m.get("rows")}
+
+
 # ----------------------------- Search -----------------------------
 
 @app.get("/rag/search")
-def rag_search(query: str = Query(...), k: int = TOP_K):
+def rag_search(
+    query: str = Query(...),
+    k: int = TOP_K,
+    source_type: str | None = None,
+    major: str | None = None,
+    url_prefix: str | None = None,
+    fetched_after: int | None = None,
+    fetched_before: int | None = None,
+    debug: bool = False,
+    profile: bool = False,
+    cache: bool = True,
+):
+    """
+    Hybrid search. Optional metadata filters are applied inside both
+    retrievers, so filtered results are exact:
+    - source_type: one or more comma-separated values (manual_url, manual_pdf, ...)
+    - major: a MAJOR_ALIASES key (chunks whose title/url mention that major)
+    - url_prefix: chunk url starts with this prefix
+    - fetched_after / fetched_before: unix-time bounds on fetched_at (inclusive)
+
+    The semantic and keyword retrievers run in parallel under
+    SEARCH_DEADLINE_MS (a soft limit, see hybrid_retrieve); if one misses
+    it the response is built from the other and carries partial=true plus
+    timed_out=[...], and if both miss the results are empty.
+
+    A query whose embedding is within SEMANTIC_CACHE_THRESHOLD of a recent
+    one (same k, filters, target major, numbers and index version) gets
+    that query's results, with "cached": {"query", "similarity", "age_s"}
+    added. cache=false skips the cache (benchmarks measure the pipeline
+    itself).
+
+    debug=true adds per-stage timings (ms) and candidate counts.
+    profile=true runs the search under cProfile and adds the top functions
+    by cumulative time as "profile".
+    """
 
     if not query:
         raise HTTPException(400, "Query required")
 
-    # 1) Semantic search
-    vector = embedder.encode([query])[0]
-    store = build_store(len(vector))
+    started = time.perf_counter()
+    trace = Trace(SEARCH_STAGE_SECONDS)
+    filters = dict(
+        source_type=source_type,
+        major=major,
+        url_prefix=url_prefix,
+        fetched_after=fetched_after,
+        fetched_before=fetched_before,
+    )
+
+    prof = profiling.start(force=profile)
+    vector = None
+    corpus = None
+    cache_key = None
+    cached = None
+    if cache and semantic_cache.enabled():
+        with prof.section():
+            with trace.span("load_docstore"):
+                corpus = load_corpus()
+            with trace.span("encode"):
+                vector = embedder.encode([query])[0]
+            analyzed = analyze(query)
+            # a paraphrase asking about another major or number is a different question
+            params = (k, tuple(sorted(filters.items())), analyzed.target_major, analyzed.numeric)
+            cache_key = (corpus.key, params)
+            with trace.span("semantic_cache"):
+                cached = semantic_cache.lookup(vector, *cache_key)
+
+    if cached is not None:
+        body, info = cached
+        candidates = {}
+        resp = {"query": query, **body, "cached": info}
+    else:
+        with prof.section():
+            found = ranked_search(query, k, filters, trace, vector=vector, prof=prof, corpus=corpus)
+            corpus = found["corpus"]
+            with trace.span("materialize"):
+                final = materialize(found["ranked"], corpus.docs, corpus.texts)
+
+        candidates = {**found["candidates"], "final": len(final)}
+        for stage, n in candidates.items():
+            SEARCH_CANDIDATES.observe(n, stage=stage)
+
+        body = {
+            "results": final,
+            "semantic_count": candidates["semantic"],
+            "keyword_count": candidates["keyword"],
+            "final_chunks": len(final),
+            "reranker": found["reranker"],
+            **found["flags"],
+        }
+        # partial answers (a retriever missed the deadline) are not reused
+        if cache_key is not None and not body.get("partial"):
+            semantic_cache.put(vector, *cache_key, query, body)
+        resp = {"query": query, **body}
+    elapsed = time.perf_counter() - started
+    SEARCH_SECONDS.observe(elapsed)
+    total_ms = round(elapsed * 1000.0, 3)
+
+    top = prof.top() if profile or slow_queries.is_slow(total_ms) else []
+    slow_queries.record({
+        "query": query,
+        "k": k,
+        "filters": {name: v for name, v in filters.items() if v is not None},
+        "total_ms": total_ms,
+        "timings_ms": trace.as_ms(),
+        "semantic_count": resp.get("semantic_count"),
+        "keyword_count": resp.get("keyword_count"),
+        "final_chunks": resp.get("final_chunks"),
+        "index_version": corpus.version,
+        "cache": _cache_status(cached, cache_key),
+        "reranker": resp.get("reranker"),
+        "partial": bool(resp.get("partial")),
+        **({"profile": top} if top else {}),
+    })
+
+    if debug:
+        resp["debug"] = {
+            "timings_ms": trace.as_ms(),
+            "total_ms": total_ms,
+            "candidates": candidates,
+            "analysis": analyze(query).as_dict(),
+        }
+    if profile:
+        resp["profile"] = top
+    return resp
+
+
+def _cache_status(cached, cache_key) -> str:
+    if cache_key is None:
+        return "off"
+    return "hit" if cached is not None else "miss"
 
-    sem_k = max(k * SEMANTIC_CAND_MULTIPLIER, k, 8)
-    semantic_raw = store.search(vector, k=sem_k)
-    for r in semantic_raw:
-        r["semantic_score"] = float(r.get("score", 0.0))
 
-    # 2) Keyword search
-    docs_all = load_docstore()
-    keyword_raw = keyword_rank(query, docs_all)
+def ranked_search(query: str, k: int, filters: dict, trace: Trace, vector=None, prof=None, corpus=None) -> dict:
+    """Retrieval, fusion and the optional cross-encoder, up to the final
+    ranked candidates (no result dicts built yet).
 
-    # 3) Merge + rerank
-    merged = merge(semantic_raw, keyword_raw)
-    final = rerank(merged, k, MAX_CHUNKS)
+    Every stage reads the one Corpus (load_corpus() unless given), so row
+    ids, rows and texts always belong to the same snapshot.
 
+    Returns {"corpus", "docs", "texts", "analyzed", "ranked", "candidates",
+    "reranker", "flags"} where texts is the hierarchy TextStore (None for
+    flat chunks), analyzed the AnalyzedQuery and flags holds the optional
+    response fields (shards, language, partial, timed_out).
+    """
+    with trace.span("analyze"):
+        analyzed = analyze(query)
+    if corpus is None:
+        with trace.span("load_docstore"):
+            corpus = load_corpus()
+    columns = corpus.columns
+    try:
+        with trace.span("filters"):
+            mask = columns.mask(**filters)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    sem_k = max(k * SEMANTIC_CAND_MULTIPLIER, k, 8)
+
+    route = None
+    timed_out = []
+    sharded = shard_pool(corpus)
+    if sharded is not None:
+        # 1+2) Semantic + keyword search on every shard, merged to global top lists
+        if vector is None:
+            with trace.span("encode"):
+                vector = embedder.encode([query])[0]
+        try:
+            with trace.span("scatter_gather"):
+                sem_scores, sem_ids, kw_ids, kw_scores = sharded.search(
+                    vector, sem_k, query, kw_k=50, filters=filters, version=corpus.version
+                )
+        except shards.ShardVersionMismatch as e:
+            logger.error(str(e))
+            raise HTTPException(503, "Shards serve a different snapshot")
+        except Exception as e:
+            logger.error(f"Shard search failed: {e}")
+            raise HTTPException(503, "Shard search failed")
+    else:
+        # 1+2) Semantic and keyword search in parallel, sharing SEARCH_DEADLINE_MS
+        with trace.span("retrieve"):
+            sem_scores, sem_ids, kw_ids, kw_scores, route, timed_out = hybrid_retrieve(
+                corpus, analyzed, sem_k, mask, trace, vector=vector, prof=prof
+            )
+
+    # 3) Merge + rerank (arrays of row ids; dicts only for returned hits)
+    with trace.span("rerank"):
+        cands = merge(sem_ids, sem_scores, kw_ids, kw_scores)
+        limit = min(MAX_CHUNKS, max(k, 1))
+        pool = reranker.RERANK_TOP_N if reranker.enabled() else 0
+        # hierarchy corpora: siblings of one parent are dropped before the cut
+        parents = corpus.docs if corpus.texts is not None else None
+        ranked = rerank(cands, columns.url_codes, k, MAX_CHUNKS, pool=pool, docs=parents)
+
+    # 4) Optional cross-encoder second stage
+    with trace.span("cross_encoder"):
+        ranked, rerank_status = second_stage(query, ranked, corpus, limit)
+
+    flags = {}
+    if sharded is not None:
+        flags["shards"] = len(sharded)
+    if route is not None:
+        flags["language"] = route
+    if timed_out:
+        # results come from the retrievers that made the deadline only
+        flags["partial"] = True
+        flags["timed_out"] = timed_out
     return {
-        "query": query,
-        "results": final,
-        "semantic_count": len(semantic_raw),
-        "keyword_count": len(keyword_raw),
-        "final_chunks": len(final),
+        "corpus": corpus,
+        "docs": corpus.docs,
+        "texts": corpus.texts,
+        "analyzed": analyzed,
+        "ranked": ranked,
+        "candidates": {"semantic": len(sem_ids), "keyword": len(kw_ids), "merged": len(cands)},
+        "reranker": rerank_status,
+        "flags": flags,
     }
 
 
@@ -282,10 +816,162 @@ def rag_search(query: str = Query(...), k: int = TOP_K):
 class SearchBody(BaseModel):
     query: str
     k: int = TOP_K
+    source_type: str | None = None
+    major: str | None = None
+    url_prefix: str | None = None
+    fetched_after: int | None = None
+    fetched_before: int | None = None
+    debug: bool = False
+    profile: bool = False
+    cache: bool = True
 
 @app.post("/rag/search")
 def rag_search_post(body: SearchBody):
-    return rag_search(body.query, body.k)
+    return rag_search(
+        body.query,
+        body.k,
+        source_type=body.source_type,
+        major=body.major,
+        url_prefix=body.url_prefix,
+        fetched_after=body.fetched_after,
+        fetched_before=body.fetched_before,
+        debug=body.debug,
+        profile=body.profile,
+        cache=body.cache,
+    )
+
+
+# ----------------------------- Streaming search -----------------------------
+
+STREAM_FORMATS = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+def _stream_event(fmt: str, event: str, data: dict) -> str:
+    body = json.dumps(data, ensure_ascii=False)
+    if fmt == "sse":
+        return f"event: {event}\ndata: {body}\n\n"
+    return json.dumps({"event": event, **data}, ensure_ascii=False) + "\n"
+
+
+@app.get("/rag/search/stream")
+def rag_search_stream(
+    query: str = Query(...),
+    k: int = TOP_K,
+    source_type: str | None = None,
+    major: str | None = None,
+    url_prefix: str | None = None,
+    fetched_after: int | None = None,
+    fetched_before: int | None = None,
+    format: str = "ndjson",
+    fields: str | None = None,
+    snippet: bool = False,
+    snippet_chars: int = SNIPPET_CHARS,
+):
+    """
+    /rag/search as a stream (format=ndjson or sse): one "hit" event per
+    result, written as soon as ranking is final, then a "done" event with
+    the counts and flags of /rag/search.
+
+    - fields: comma-separated keys to keep per hit (e.g. url,title,text,final_score)
+    - snippet=true: text is cut to the snippet_chars window with the most query terms
+    """
+    if not query:
+        raise HTTPException(400, "Query required")
+    if format not in STREAM_FORMATS:
+        raise HTTPException(400, f"Unknown format '{format}' (expected one of {sorted(STREAM_FORMATS)})")
+
+    started = time.perf_counter()
+    trace = Trace(SEARCH_STAGE_SECONDS)
+    filters = dict(
+        source_type=source_type,
+        major=major,
+        url_prefix=url_prefix,
+        fetched_after=fetched_after,
+        fetched_before=fetched_before,
+    )
+    # errors (bad filter, shard failure) still surface as HTTP status codes
+    found = ranked_search(query, k, filters, trace)
+    keep = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    terms = found["analyzed"].tokens if snippet else None
+
+    def events():
+        sent = 0
+        for item in iter_hits(found["ranked"], found["docs"], found["texts"]):
+            yield _stream_event(format, "hit", {"rank": sent + 1, **shape_hit(item, keep, terms, snippet_chars)})
+            sent += 1
+        candidates = {**found["candidates"], "final": sent}
+        for stage, n in candidates.items():
+            SEARCH_CANDIDATES.observe(n, stage=stage)
+        elapsed = time.perf_counter() - started
+        SEARCH_SECONDS.observe(elapsed)
+        slow_queries.record({
+            "query": query,
+            "k": k,
+            "filters": {name: v for name, v in filters.items() if v is not None},
+            "total_ms": round(elapsed * 1000.0, 3),
+            "timings_ms": trace.as_ms(),
+            "semantic_count": candidates["semantic"],
+            "keyword_count": candidates["keyword"],
+            "final_chunks": sent,
+            "index_version": found["corpus"].version,
+            "cache": "off",
+            "reranker": found["reranker"],
+            "partial": bool(found["flags"].get("partial")),
+            "stream": True,
+        })
+        yield _stream_event(format, "done", {
+            "query": query,
+            "semantic_count": candidates["semantic"],
+            "keyword_count": candidates["keyword"],
+            "final_chunks": sent,
+            "reranker": found["reranker"],
+            **found["flags"],
+        })
+
+    return StreamingResponse(events(), media_type=STREAM_FORMATS[format])
+
+
+# ----------------------------- Shard -----------------------------
+
+class ShardSearchBody(BaseModel):
+    vector: list[float]
+    sem_k: int
+    query: str
+    kw_k: int = 50
+    filters: dict = {}
+    version: str | None = None
+
+@app.post("/rag/shard/search")
+def rag_shard_search(body: ShardSearchBody):
+    """Serve this instance's corpus as one shard (DATA_DIR=<shard dir>).
+
+    Returns the shard's semantic and keyword top lists as global row ids,
+    and "version", the snapshot the shard was cut from. A request for
+    another snapshot (body.version) gets 409 with the served version.
+    """
+    corpus = load_corpus()
+    store = corpus.faiss_store(len(body.vector))
+    try:
+        rows = shards.load_rows(corpus.docstore_path)
+    except OSError:
+        raise HTTPException(404, "This instance does not serve a shard")
+    served = corpus.stamp_version
+    if body.version is not None and served != body.version:
+        raise HTTPException(409, {"error": "snapshot mismatch", "version": served, "expected": body.version})
+    try:
+        sem_ids, sem_scores, kw_ids, kw_scores = shards.search_local(
+            store, corpus.keywords, corpus.columns, rows, body.vector, body.sem_k, body.query, body.kw_k, body.filters
+        )
+    except (TypeError, ValueError) as e:
+        raise HTTPException(400, str(e))
+    return {
+        "sem_ids": sem_ids.tolist(),
+        "sem_scores": sem_scores.tolist(),
+        "kw_ids": kw_ids.tolist(),
+        "kw_scores": kw_scores.tolist(),
+        "rows": len(rows),
+        "version": served,
+    }
 
 
 # ----------------------------- Retrieve (shortcut) -----------------------------
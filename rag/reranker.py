@@ -0,0 +1,132 @@
+# reranker.py — optional cross-encoder second stage for SheBots RAG
+#
+# Enabled by setting CROSS_ENCODER_MODEL (e.g. cross-encoder/ms-marco-MiniLM-L-6-v2).
+# The top RERANK_TOP_N fused candidates are rescored on CPU in batches.
+# Scores are cached per (index version, query, chunk id). Scoring runs on one
+# of RERANK_THREADS worker threads (default SEARCH_THREADS, like the
+# retrievers) with a per-request budget (RERANK_BUDGET_MS) that starts when
+# a worker picks the request up. A request that waits longer than the budget
+# for a free worker is dropped from the queue. When the budget runs out the
+# caller keeps the fused order, and whatever the worker finished is still
+# cached for the next identical query.
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import numpy as np
+
+from .metrics import cache_lookup
+
+logger = logging.getLogger(__name__)
+
+CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "")
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "20"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+RERANK_BUDGET_MS = int(os.getenv("RERANK_BUDGET_MS", "150"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "4096"))
+RERANK_MAX_CHARS = int(os.getenv("RERANK_MAX_CHARS", "1200"))
+RERANK_THREADS = int(os.getenv("RERANK_THREADS", os.getenv("SEARCH_THREADS", "8")))
+
+_model = None
+_model_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=RERANK_THREADS, thread_name_prefix="rerank")
+
+_cache: OrderedDict = OrderedDict()
+_cache_lock = threading.Lock()
+cache_stats = {"hits": 0, "misses": 0}
+
+
+def enabled() -> bool:
+    return bool(CROSS_ENCODER_MODEL)
+
+
+def get_cross_encoder(name=None):
+    global _model
+    with _model_lock:
+        if _model is None:
+            from sentence_transformers import CrossEncoder
+            _model = CrossEncoder(name or CROSS_ENCODER_MODEL, device="cpu")
+    return _model
+
+
+def _cache_get(key):
+    with _cache_lock:
+        score = _cache.get(key)
+        if score is not None:
+            _cache.move_to_end(key)
+    cache_stats["misses" if score is None else "hits"] += 1
+    cache_lookup("cross_encoder", score is not None)
+    return score
+
+
+def _cache_put(key, score):
+    with _cache_lock:
+        _cache[key] = score
+        _cache.move_to_end(key)
+        while len(_cache) > RERANK_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _score_missing(query, pending, budget_s, started):
+    """Worker: score (key, text) pairs batch by batch until done or out of time.
+
+    The budget starts now (queue wait doesn't count); `started` is set for
+    the caller. Returns all scores, or None if the budget ran out first.
+    Finished batches are cached either way.
+    """
+    deadline = time.monotonic() + budget_s
+    started.set()
+    model = get_cross_encoder()
+    out = []
+    for start in range(0, len(pending), RERANK_BATCH_SIZE):
+        if time.monotonic() >= deadline:
+            return None
+        batch = pending[start:start + RERANK_BATCH_SIZE]
+        scores = model.predict([(query, text) for _, text in batch], batch_size=RERANK_BATCH_SIZE)
+        for (key, _), score in zip(batch, np.asarray(scores, dtype=np.float64).tolist()):
+            _cache_put(key, score)
+            out.append(score)
+    return out
+
+
+def cross_encode(query: str, ids, texts, version=None, budget_ms=None):
+    """Cross-encoder scores for (query, chunk) pairs, or None if over budget.
+
+    `ids` are chunk ids used as cache keys together with `version` (the index
+    version the ids belong to). Errors from the model are raised.
+    """
+    budget_ms = RERANK_BUDGET_MS if budget_ms is None else budget_ms
+    budget_s = budget_ms / 1000.0
+
+    scores = np.zeros(len(ids), dtype=np.float64)
+    pending = []
+    slots = []
+    for pos, (chunk_id, text) in enumerate(zip(ids, texts)):
+        key = (version, query, chunk_id)
+        cached = _cache_get(key)
+        if cached is None:
+            pending.append((key, (text or "")[:RERANK_MAX_CHARS]))
+            slots.append(pos)
+        else:
+            scores[pos] = cached
+
+    if pending:
+        started = threading.Event()
+        future = _executor.submit(_score_missing, query, pending, budget_s, started)
+        if not started.wait(timeout=budget_s) and future.cancel():
+            logger.info(f"No cross-encoder thread free within {budget_ms} ms, keeping fused order")
+            return None
+        try:
+            fresh = future.result(timeout=budget_s)
+        except TimeoutError:
+            fresh = None
+        if fresh is None:
+            logger.info(f"Cross-encoder over budget ({budget_ms} ms), keeping fused order")
+            return None
+        scores[slots] = fresh
+
+    return scores
@@ -0,0 +1,391 @@
+# scheduler.py — background refresh with change-rate-aware recrawl
+#
+# Every source (MANUAL_URLS, crawled pages already in the corpus, manual
+# PDF / DOCX / TEXT files) gets its own check interval, stored with its
+# history in schedule.json next to the docstore:
+#   - URLs start at SCHEDULE_HOT_S when they match SCHEDULE_HOT_PATTERNS
+#     (notice boards) and at SCHEDULE_DEFAULT_S otherwise. The interval is
+#     halved when a check finds new content and grown 1.5x when it doesn't,
+#     within [SCHEDULE_MIN_S, SCHEDULE_MAX_S].
+#   - Files are re-checked every SCHEDULE_FILE_S; unchanged mtime/size
+#     costs one stat().
+# URL checks send If-None-Match / If-Modified-Since, and change is decided
+# on a hash of the cleaned text, so markup-only churn doesn't republish.
+#
+# A tick checks only the sources that are due. It then publishes one
+# snapshot that swaps the changed sources' chunks (ingest.publish_chunks).
+# Search keeps serving the previous snapshot until CURRENT flips. The
+# publish and the schedule.json update run under the data dir's publish
+# lock (snapshots.publish_lock), shared with API ingests and the file
+# watcher; schedule.lock only keeps a second scheduler from starting.
+#
+# Runs in-process (SCHEDULER_ENABLED=1, one worker per data dir holds the
+# lock) or as a sidecar: python rag/test.py schedule
+
+import os
+import json
+import time
+import logging
+import threading
+
+import requests
+
+from . import ingest
+from . import snapshots
+from . import changelog
+from .mapped import atomic_write_json
+from .metrics import Trace, INGEST_STAGE_SECONDS, INGEST_ERRORS
+from . import sources as source_registry
+from .data import MANUAL_URLS
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, run one scheduler by hand
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "0").lower() in ("1", "true", "yes")
+SCHEDULE_TICK_S = float(os.getenv("SCHEDULE_TICK_S", "30"))
+SCHEDULE_HOT_PATTERNS = [p for p in os.getenv("SCHEDULE_HOT_PATTERNS", "bbs/board.php").split(";") if p]
+SCHEDULE_HOT_S = float(os.getenv("SCHEDULE_HOT_S", "3600"))
+SCHEDULE_DEFAULT_S = float(os.getenv("SCHEDULE_DEFAULT_S", "86400"))
+SCHEDULE_FILE_S = float(os.getenv("SCHEDULE_FILE_S", "300"))
+SCHEDULE_MIN_S = float(os.getenv("SCHEDULE_MIN_S", "900"))
+SCHEDULE_MAX_S = float(os.getenv("SCHEDULE_MAX_S", str(14 * 86400)))
+
+STATE_FILE = "schedule.json"
+LOCK_FILE = "schedule.lock"
+
+
+# ----------------------------- Sources -----------------------------
+
+def _key(url: str, source_type: str) -> str:
+    return f"{source_type}:{url}"
+
+
+# _indexed() result for one docstore, moved on as its change log grows
+_indexed_cache = {"key": None, "found": None, "end": 0}
+_indexed_lock = threading.Lock()
+
+
+def _indexed(docstore_path: str) -> dict:
+    """(url, source_type) -> {"title", "content_hash"} for rows in the live corpus
+    (the snapshot's docstore plus its change log).
+
+    The docstore is parsed once per snapshot; later ticks only read the log
+    records appended since.
+    """
+    try:
+        st = os.stat(docstore_path)
+    except OSError:
+        return {}
+    key = (docstore_path, st.st_mtime_ns, st.st_size)
+
+    def add(found, d):
+        src = (d.get("url"), d.get("source_type"))
+        if src not in found:
+            found[src] = {"title": d.get("title") or "", "content_hash": d.get("content_hash")}
+
+    with _indexed_lock:
+        cache = _indexed_cache
+        # a shorter log was cut or replaced: read it again from the start
+        if cache["key"] != key or changelog.pending(docstore_path) < cache["end"]:
+            found = {}
+            with open(docstore_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        d = json.loads(line)
+                    except ValueError:
+                        continue
+                    add(found, d)
+            cache.update(key=key, found=found, end=0)
+        records, end = changelog.read(docstore_path, start=cache["end"], vectors=False)
+        for record in records:
+            for url, source_type in record.get("delete") or ():
+                cache["found"].pop((url, source_type), None)
+            for d in record.get("rows") or ():
+                add(cache["found"], d)
+        cache["end"] = end
+        return dict(cache["found"])
+
+
+def discover(indexed: dict) -> dict:
+    """All refreshable sources: key -> {"url", "source_type", "title"}."""
+    sources = {}
+    for url in MANUAL_URLS:
+        sources[_key(url, "manual_url")] = {"url": url, "source_type": "manual_url"}
+    for path, source_type in source_registry.scan().items():
+        sources[_key(path, source_type)] = {"url": path, "source_type": source_type}
+    for (url, source_type), row in indexed.items():
+        if not url:
+            continue
+        if source_type == "html":
+            # the crawl frontier: pages a crawl already put in the corpus
+            sources[_key(url, "html")] = {"url": url, "source_type": "html", "title": row["title"]}
+        elif source_type in ingest.FILE_EXTRACTORS:
+            # indexed files that have since left the registry get their rows dropped
+            sources.setdefault(_key(url, source_type), {"url": url, "source_type": source_type})
+    return sources
+
+
+def initial_interval(source: dict) -> float:
+    if source["source_type"] in ingest.FILE_EXTRACTORS:
+        return SCHEDULE_FILE_S
+    if any(p in source["url"] for p in SCHEDULE_HOT_PATTERNS):
+        return SCHEDULE_HOT_S
+    return SCHEDULE_DEFAULT_S
+
+
+def _adapt(entry: dict, changed: bool):
+    if entry["source_type"] in ingest.FILE_EXTRACTORS:
+        return
+    factor = 0.5 if changed else 1.5
+    entry["interval_s"] = min(SCHEDULE_MAX_S, max(SCHEDULE_MIN_S, entry["interval_s"] * factor))
+
+
+# ----------------------------- State -----------------------------
+
+def state_path(docstore_path: str) -> str:
+    return os.path.join(snapshots.data_dir(docstore_path), STATE_FILE)
+
+
+def load_state(docstore_path: str) -> dict:
+    try:
+        with open(state_path(docstore_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"sources": {}}
+
+
+# ----------------------------- Checks -----------------------------
+
+def _check_url(entry: dict, trace: Trace):
+    """(chunks or None when unchanged, bytes fetched)."""
+    source_type = entry["source_type"]
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    with trace.span("fetch", source_type=source_type):
+        r = requests.get(entry["url"], timeout=12, headers=headers)
+    if r.status_code == 304:
+        return None, 0
+    if r.status_code != 200:
+        raise ValueError(f"status {r.status_code}")
+    entry["etag"] = r.headers.get("ETag")
+    entry["last_modified"] = r.headers.get("Last-Modified")
+    if source_type == "html":
+        chunks = ingest.html_chunks(entry["url"], entry.get("title") or "", r.text, trace)
+    else:
+        chunks = ingest.manual_url_chunks(entry["url"], r.text, trace)
+    return chunks, len(r.content)
+
+
+def _check_file(entry: dict, trace: Trace):
+    """Only a failing stat() means deleted. A file that is there but yields
+    no text (missing PyPDF2, a scanned PDF) is an error: its indexed rows
+    stay, and stat isn't recorded so the next check retries it."""
+    path = entry["url"]
+    try:
+        st = os.stat(path)
+    except OSError:
+        # deleted: drop its rows (no-op if it was never indexed)
+        entry["stat"] = None
+        return ([] if entry.get("content_hash") else None), 0
+    stat = [st.st_mtime_ns, st.st_size]
+    if stat == entry.get("stat") and entry.get("content_hash"):
+        return None, 0
+    chunks = ingest.file_chunks(path, entry["source_type"], trace)
+    if not chunks:
+        raise ValueError("no text extracted")
+    entry["stat"] = stat
+    return chunks, st.st_size
+
+
+def check(entry: dict, trace: Trace):
+    """Fetch one source; returns its new chunks, or None if its content is unchanged."""
+    if entry["source_type"] in ingest.FILE_EXTRACTORS:
+        chunks, nbytes = _check_file(entry, trace)
+    else:
+        chunks, nbytes = _check_url(entry, trace)
+    if chunks is None or (not chunks and not entry.get("content_hash")):
+        return None
+    digest = chunks[0]["meta"]["content_hash"] if chunks else None
+    if digest is not None and digest == entry.get("content_hash"):
+        return None
+    entry["content_hash"] = digest
+    if chunks:
+        ingest.record_source(trace, entry["source_type"], nbytes, len(chunks))
+    return chunks
+
+
+# ----------------------------- Refresh -----------------------------
+
+def run_once(
+    index_path: str,
+    docstore_path: str,
+    embedding_model: str,
+    now: float | None = None,
+    force: bool = False,
+    paths: set | None = None,
+    files_only: bool = False,
+) -> dict:
+    """Check every due source and publish one snapshot with the ones that changed.
+
+    force checks everything regardless of schedule; `paths` checks just the
+    sources with those urls / file paths, due or not (the file watcher).
+    files_only skips URL sources.
+    """
+    now = time.time() if now is None else now
+    trace = Trace(INGEST_STAGE_SECONDS)
+    state = load_state(docstore_path)
+    entries = state["sources"]
+    _, live_docstore, _ = snapshots.resolve(index_path, docstore_path)
+    indexed = _indexed(live_docstore)
+
+    touched = set()
+    for key, source in discover(indexed).items():
+        entry = entries.get(key)
+        if entry is None:
+            touched.add(key)
+            entry = entries[key] = {
+                **source,
+                "interval_s": initial_interval(source),
+                "next_due": now,
+                "checks": 0,
+                "changes": 0,
+                # already indexed content counts as seen
+                "content_hash": indexed.get((source["url"], source["source_type"]), {}).get("content_hash"),
+            }
+
+    chunks, replace, errors, checked = [], set(), 0, 0
+    for key, entry in entries.items():
+        if files_only and entry["source_type"] not in ingest.FILE_EXTRACTORS:
+            continue
+        if paths is not None:
+            if entry["url"] not in paths:
+                continue
+        elif not force and entry["next_due"] > now:
+            continue
+        checked += 1
+        touched.add(key)
+        try:
+            fresh = check(entry, trace)
+        except Exception as e:
+            errors += 1
+            INGEST_ERRORS.inc(source_type=entry["source_type"])
+            logger.error(f"Refresh failed for {entry['url']}: {e}")
+            fresh = None
+        changed = fresh is not None
+        entry["checks"] += 1
+        entry["last_checked"] = int(now)
+        if changed:
+            entry["changes"] += 1
+            entry["last_changed"] = int(now)
+            chunks.extend(fresh)
+            replace.add((entry["url"], entry["source_type"]))
+        _adapt(entry, changed)
+        entry["next_due"] = now + entry["interval_s"]
+
+    snapshot = None
+    with snapshots.publish_lock(snapshots.data_dir(docstore_path)):
+        if replace:
+            logger.info(f"Refreshing {len(replace)} changed sources ({len(chunks)} chunks)")
+            _, snap, _ = ingest.publish_chunks(chunks, index_path, docstore_path, embedding_model, trace, replace=replace)
+            snapshot = snap.version
+        # re-read: the file watcher may have recorded its own checks meanwhile
+        state = load_state(docstore_path)
+        state["sources"].update({key: entries[key] for key in touched})
+        state["last_run"] = int(now)
+        atomic_write_json(state_path(docstore_path), state)
+        entries = state["sources"]
+
+    return {
+        "checked": checked,
+        "changed": len(replace),
+        "errors": errors,
+        "chunks": len(chunks),
+        "snapshot": snapshot,
+        "next_due": min((e["next_due"] for e in entries.values()), default=None),
+        "stageSeconds": {stage: round(sec, 4) for stage, sec in trace.seconds.items()},
+    }
+
+
+def status(docstore_path: str) -> dict:
+    """schedule.json with per-source change rates, soonest due first."""
+    state = load_state(docstore_path)
+    sources = []
+    for entry in state["sources"].values():
+        checks = entry.get("checks", 0)
+        sources.append({
+            "url": entry["url"],
+            "source_type": entry["source_type"],
+            "interval_s": round(entry["interval_s"]),
+            "next_due": int(entry["next_due"]),
+            "checks": checks,
+            "changes": entry.get("changes", 0),
+            "change_rate": round(entry.get("changes", 0) / checks, 3) if checks else None,
+            "last_changed": entry.get("last_changed"),
+        })
+    sources.sort(key=lambda e: e["next_due"])
+    return {"last_run": state.get("last_run"), "sources": sources}
+
+
+class Scheduler:
+    """Background thread calling run_once() whenever a source is due."""
+
+    def __init__(self, index_path: str, docstore_path: str, embedding_model: str):
+        self.index_path = index_path
+        self.docstore_path = docstore_path
+        self.embedding_model = embedding_model
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_file = None
+
+    def acquire(self) -> bool:
+        """Only one process per data dir runs the scheduler (uvicorn --workers)."""
+        if fcntl is None:
+            return True
+        path = os.path.join(snapshots.data_dir(self.docstore_path), LOCK_FILE)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock_file = open(path, "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            return False
+        return True
+
+    def start(self) -> bool:
+        if not self.acquire():
+            logger.info("Scheduler already running in another process")
+            return False
+        self._thread = threading.Thread(target=self.run_forever, name="scheduler", daemon=True)
+        self._thread.start()
+        return True
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                result = run_once(self.index_path, self.docstore_path, self.embedding_model)
+                if result["checked"]:
+                    logger.info(
+                        f"Refresh: {result['checked']} checked, {result['changed']} changed, "
+                        f"snapshot {result['snapshot']}"
+                    )
+                wait = SCHEDULE_TICK_S
+                if result["next_due"] is not None:
+                    wait = min(wait, max(1.0, result["next_due"] - time.time()))
+            except Exception as e:
+                logger.error(f"Scheduled refresh failed: {e}")
+                wait = SCHEDULE_TICK_S
+            self._stop.wait(wait)
+
+    def stop(self):
+        self._stop.set()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
@@ -0,0 +1,190 @@
+# semantic_cache.py — answer cache keyed by query-embedding similarity
+#
+# Paraphrased questions ("졸업 요건 학점" / "졸업하려면 몇 학점") embed close
+# together, so a search whose query vector is within SEMANTIC_CACHE_THRESHOLD
+# cosine similarity of a recent one, with the same k and filters, reuses that
+# search's final results instead of running the hybrid pipeline again.
+#
+# Recent query vectors live in a small exact (flat inner-product) FAISS
+# index, one per worker, capped at SEMANTIC_CACHE_SIZE entries (least
+# recently used evicted first). Entries belong to the index version they
+# were computed on: when the corpus changes the whole cache is dropped, and
+# entries older than SEMANTIC_CACHE_TTL_S are not served. report() gives
+# the hit rate and how stale the served answers were.
+#
+# SEMANTIC_CACHE_SIZE=0 turns the cache off.
+
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import faiss
+
+from .metrics import cache_lookup, SEMANTIC_CACHE_HIT_AGE
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "512"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+# 0 = entries only expire when the index version changes
+SEMANTIC_CACHE_TTL_S = float(os.getenv("SEMANTIC_CACHE_TTL_S", "3600"))
+# nearest cached queries checked per lookup (others may differ in k / filters)
+SEMANTIC_CACHE_PROBES = 8
+
+
+def _normalized(vector) -> np.ndarray:
+    vec = np.asarray(vector, dtype=np.float32).reshape(1, -1).copy()
+    faiss.normalize_L2(vec)
+    return vec
+
+
+class SemanticCache:
+    """Query vectors -> final results, for one index version at a time."""
+
+    def __init__(self, size: int, threshold: float, ttl_s: float):
+        self.size = size
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.index = None
+        self.entries: OrderedDict = OrderedDict()
+        self.version = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            "lookups": 0, "hits": 0, "misses": 0,
+            "expired": 0, "evicted": 0, "invalidated": 0,
+            "hit_age_total_s": 0.0, "hit_age_max_s": 0.0,
+        }
+
+    def _drop(self, ids):
+        ids = list(ids)
+        if not ids:
+            return
+        self.index.remove_ids(np.asarray(ids, dtype=np.int64))
+        for i in ids:
+            self.entries.pop(i, None)
+
+    def _use_version(self, version, dim: int):
+        """Start over for a new index version (or a new embedding size)."""
+        if version == self.version and self.index is not None and self.index.d == dim:
+            return
+        if self.entries:
+            self.stats["invalidated"] += len(self.entries)
+            logger.info(f"Semantic cache: index version changed, dropping {len(self.entries)} entries")
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self.entries.clear()
+        self.version = version
+
+    def lookup(self, vector, version, params):
+        """(cached value, info) for a similar earlier query, or None.
+
+        info = {"query", "similarity", "age_s"} of the entry served.
+        """
+        vec = _normalized(vector)
+        now = time.time()
+        with self._lock:
+            self.stats["lookups"] += 1
+            self._use_version(version, vec.shape[1])
+            found = None
+            if self.index.ntotal:
+                scores, ids = self.index.search(vec, min(SEMANTIC_CACHE_PROBES, self.index.ntotal))
+                expired = []
+                for score, i in zip(scores[0].tolist(), ids[0].tolist()):
+                    if i < 0 or score < self.threshold:
+                        break
+                    entry = self.entries[i]
+                    if entry["params"] != params:
+                        continue
+                    if self.ttl_s > 0 and now - entry["created"] > self.ttl_s:
+                        expired.append(i)
+                        continue
+                    found = (i, entry, score)
+                    break
+                self.stats["expired"] += len(expired)
+                self._drop(expired)
+
+            if found is None:
+                self.stats["misses"] += 1
+                cache_lookup("semantic_answer", False)
+                return None
+
+            i, entry, score = found
+            self.entries.move_to_end(i)
+            entry["hits"] += 1
+            age = now - entry["created"]
+            self.stats["hits"] += 1
+            self.stats["hit_age_total_s"] += age
+            self.stats["hit_age_max_s"] = max(self.stats["hit_age_max_s"], age)
+        cache_lookup("semantic_answer", True)
+        SEMANTIC_CACHE_HIT_AGE.observe(age)
+        return entry["value"], {"query": entry["query"], "similarity": round(score, 4), "age_s": round(age, 3)}
+
+    def put(self, vector, version, params, query: str, value):
+        vec = _normalized(vector)
+        with self._lock:
+            self._use_version(version, vec.shape[1])
+            i = self._next_id
+            self._next_id += 1
+            self.index.add_with_ids(vec, np.asarray([i], dtype=np.int64))
+            self.entries[i] = {
+                "query": query, "params": params, "value": value,
+                "created": time.time(), "hits": 0,
+            }
+            evict = list(self.entries)[:max(0, len(self.entries) - self.size)]
+            self.stats["evicted"] += len(evict)
+            self._drop(evict)
+
+    def clear(self):
+        with self._lock:
+            self.index = None
+            self.entries.clear()
+            self.version = None
+
+    def report(self) -> dict:
+        """Hit rate, size and staleness (age of the answers served)."""
+        now = time.time()
+        with self._lock:
+            stats = dict(self.stats)
+            ages = [now - e["created"] for e in self.entries.values()]
+            top = sorted(self.entries.values(), key=lambda e: -e["hits"])[:5]
+            popular = [{"query": e["query"], "hits": e["hits"]} for e in top if e["hits"]]
+        hits = stats.pop("hit_age_total_s")
+        return {
+            "enabled": self.size > 0,
+            "entries": len(ages),
+            "capacity": self.size,
+            "threshold": self.threshold,
+            "ttl_s": self.ttl_s,
+            **stats,
+            "hit_rate": round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else 0.0,
+            "hit_age_mean_s": round(hits / stats["hits"], 3) if stats["hits"] else 0.0,
+            "hit_age_max_s": round(stats["hit_age_max_s"], 3),
+            "oldest_entry_s": round(max(ages), 3) if ages else 0.0,
+            "popular": popular,
+        }
+
+
+_cache = SemanticCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL_S)
+
+
+def enabled() -> bool:
+    return SEMANTIC_CACHE_SIZE > 0
+
+
+def lookup(vector, version, params):
+    return _cache.lookup(vector, version, params)
+
+
+def put(vector, version, params, query: str, value):
+    _cache.put(vector, version, params, query, value)
+
+
+def clear():
+    _cache.clear()
+
+
+def report() -> dict:
+    return _cache.report()
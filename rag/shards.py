@@ -0,0 +1,264 @@
+# shards.py — partitioned index with scatter-gather search
+#
+# A snapshot can be split into SEARCH_SHARDS shards (by hash of chunk_id, or
+# by source_type with SHARD_KEY=source). Each shard is a self-contained
+# corpus directory (faiss_index, docstore.jsonl, keyword index, mmap
+# sidecars) plus rows.npy mapping its local rows to global docstore rows:
+#   snapshots/<version>/shards/<key>-<n>/<i>/
+#
+# Search sends the query vector, keyword query and filters to every shard.
+# Each shard returns its semantic top sem_k and keyword top kw_k as global
+# row ids. Keyword scores depend only on the row and the query, and the
+# shards hold exact copies of the vectors, so the merged per-shard top lists
+# equal the unsharded top lists and the existing fusion runs unchanged.
+#
+# Shards run as local worker processes (LocalShard) or as remote rag_main
+# instances started with DATA_DIR=<shard dir> (HttpShard, SHARD_URLS).
+#
+# Every request carries the front end's snapshot version and every answer
+# the version the shard was cut from (its VERSION stamp). A shard on another
+# snapshot would return row ids of a different docstore, so it answers 409
+# instead; HttpShard retries SHARD_VERSION_RETRIES times (a shard may be
+# switching over) and then fails the search with ShardVersionMismatch.
+
+import os
+import zlib
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import faiss
+import numpy as np
+import requests
+
+from .store import FaissStore
+from .keyword_index import KeywordIndex, keyword_index_path
+from . import mapped
+
+logger = logging.getLogger(__name__)
+
+SEARCH_SHARDS = int(os.getenv("SEARCH_SHARDS", "0"))
+SHARD_KEY = os.getenv("SHARD_KEY", "hash")
+SHARD_URLS = [u for u in os.getenv("SHARD_URLS", "").split(";") if u]
+SHARD_TIMEOUT_S = float(os.getenv("SHARD_TIMEOUT_S", "10"))
+SHARD_VERSION_RETRIES = int(os.getenv("SHARD_VERSION_RETRIES", "2"))
+SHARD_VERSION_RETRY_S = float(os.getenv("SHARD_VERSION_RETRY_S", "0.5"))
+
+SHARDS_DIR = "shards"
+ROWS_FILE = "rows.npy"
+
+
+class ShardVersionMismatch(RuntimeError):
+    """A shard serves a different snapshot than the one being searched."""
+
+
+def check_version(name: str, served, expected):
+    if expected is not None and served != expected:
+        raise ShardVersionMismatch(f"Shard {name} serves snapshot {served}, expected {expected}")
+
+
+def enabled() -> bool:
+    return bool(SHARD_URLS) or SEARCH_SHARDS > 1
+
+
+def shard_of(doc: dict, row: int, n: int, key: str = SHARD_KEY) -> int:
+    if key == "source":
+        value = doc.get("source_type") or ""
+    else:
+        value = doc.get("chunk_id") or str(row)
+    return zlib.crc32(value.encode("utf-8")) % n
+
+
+def shards_dir(docstore_path: str, n: int, key: str = SHARD_KEY) -> str:
+    return os.path.join(os.path.dirname(docstore_path) or ".", SHARDS_DIR, f"{key}-{n}")
+
+
+def build_shards(index_path: str, docstore_path: str, n: int, key: str = SHARD_KEY, version=None) -> list:
+    """Split a corpus into n shard directories under shards/<key>-<n>/; returns their paths."""
+    store = FaissStore(0, index_path, docstore_path)
+    store.load_or_create()
+    docs = store.docstore
+    if store.index.ntotal != len(docs):
+        raise ValueError(f"Index has {store.index.ntotal} vectors but docstore has {len(docs)} rows")
+    vectors = store.vectors()
+    keywords = KeywordIndex(keyword_index_path(docstore_path))
+    keywords.load()
+    keywords.sync(docs)
+
+    assign = np.fromiter((shard_of(d, i, n, key) for i, d in enumerate(docs)), dtype=np.int64, count=len(docs))
+    paths = []
+    for shard in range(n):
+        rows = np.flatnonzero(assign == shard)
+        out = os.path.join(shards_dir(docstore_path, n, key), str(shard))
+        os.makedirs(out, exist_ok=True)
+
+        sub = FaissStore(store.index.d, os.path.join(out, "faiss_index"), os.path.join(out, "docstore.jsonl"))
+        # same (trained) index type, emptied, so IVF / HNSW shards keep the quantizer
+        sub.index = faiss.clone_index(store.index)
+        sub.index.reset()
+        if len(rows):
+            sub.index.add(vectors[rows])
+        sub.docstore = [docs[r] for r in rows]
+        sub.persist()
+
+        sub_kw = KeywordIndex(keyword_index_path(sub.docstore_path))
+        sub_kw.entries = [keywords.entries[r] for r in rows]
+        sub_kw._invalidate()
+        sub_kw.persist()
+
+        mapped.atomic_write_npy(os.path.join(out, ROWS_FILE), rows)
+        mapped.publish(sub.docstore_path, sub.docstore, sub_kw, version=version, ntotal=int(sub.index.ntotal))
+        paths.append(out)
+        logger.info(f"Shard {shard}/{n}: {len(rows)} rows")
+    return paths
+
+
+def load_rows(docstore_path: str) -> np.ndarray:
+    return np.load(os.path.join(os.path.dirname(docstore_path) or ".", ROWS_FILE), mmap_mode="r")
+
+
+def search_local(store, keywords, columns, rows, vector, sem_k, query, kw_k, filters):
+    """One shard's semantic + keyword top lists, as global row ids."""
+    mask = columns.mask(**filters)
+    sem_scores, sem_ids = store.search_ids(vector, k=sem_k, mask=mask)
+    kw_ids, kw_scores = keywords.score(query, max_results=kw_k, mask=mask)
+    return rows[sem_ids], sem_scores, rows[kw_ids], kw_scores
+
+
+def _top(ids, scores, k):
+    # best first, ties by row id (same order as the unsharded keyword path)
+    order = np.lexsort((ids, -scores))[:k]
+    return ids[order], scores[order]
+
+
+def gather(parts, sem_k, kw_k):
+    """Merge per-shard results into global (sem_scores, sem_ids, kw_ids, kw_scores)."""
+    sem_ids = np.concatenate([np.asarray(p[0], dtype=np.int64) for p in parts])
+    sem_scores = np.concatenate([np.asarray(p[1], dtype=np.float32) for p in parts])
+    kw_ids = np.concatenate([np.asarray(p[2], dtype=np.int64) for p in parts])
+    kw_scores = np.concatenate([np.asarray(p[3], dtype=np.float64) for p in parts])
+    sem_ids, sem_scores = _top(sem_ids, sem_scores, sem_k)
+    kw_ids, kw_scores = _top(kw_ids, kw_scores, kw_k)
+    return sem_scores, sem_ids, kw_ids, kw_scores
+
+
+# ----------------------------- Local worker processes -----------------------------
+
+_worker = {}
+
+
+def _init_worker(shard_dir: str):
+    """Runs once in each shard process: map the shard corpus."""
+    docstore_path = os.path.join(shard_dir, "docstore.jsonl")
+    loaded = mapped.load(docstore_path, os.path.join(shard_dir, "faiss_index"), 0)
+    if loaded is None:
+        raise RuntimeError(f"Shard {shard_dir} has not been published")
+    store, _, keywords, columns, stamp = loaded
+    _worker.update(
+        store=store, keywords=keywords, columns=columns, rows=load_rows(docstore_path), stamp=stamp, dir=shard_dir
+    )
+
+
+def _worker_search(vector, sem_k, query, kw_k, filters, version):
+    w = _worker
+    check_version(w["dir"], w["stamp"]["version"], version)
+    sem_ids, sem_scores, kw_ids, kw_scores = search_local(
+        w["store"], w["keywords"], w["columns"], w["rows"], vector, sem_k, query, kw_k, filters
+    )
+    return np.asarray(sem_ids), sem_scores, np.asarray(kw_ids), kw_scores
+
+
+class LocalShard:
+    """One shard served by a dedicated worker process."""
+
+    _context = multiprocessing.get_context("spawn")
+
+    def __init__(self, shard_dir: str):
+        self.name = shard_dir
+        self._pool = ProcessPoolExecutor(
+            max_workers=1, mp_context=self._context, initializer=_init_worker, initargs=(shard_dir,)
+        )
+
+    def submit(self, vector, sem_k, query, kw_k, filters, version=None):
+        return self._pool.submit(
+            _worker_search, np.asarray(vector, dtype=np.float32), sem_k, query, kw_k, filters, version
+        )
+
+    def close(self):
+        # queued searches still finish; the process exits afterwards
+        self._pool.shutdown(wait=False)
+
+
+class HttpShard:
+    """A shard served by another rag_main instance (POST /rag/shard/search)."""
+
+    _executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="shard-http")
+
+    def __init__(self, base_url: str):
+        self.name = base_url.rstrip("/")
+        self._session = requests.Session()
+
+    def _call(self, vector, sem_k, query, kw_k, filters, version):
+        payload = {
+            "vector": [float(x) for x in vector], "sem_k": sem_k, "query": query, "kw_k": kw_k,
+            "filters": filters, "version": version,
+        }
+        for attempt in range(SHARD_VERSION_RETRIES + 1):
+            if attempt:
+                time.sleep(SHARD_VERSION_RETRY_S)
+            r = self._session.post(f"{self.name}/rag/shard/search", json=payload, timeout=SHARD_TIMEOUT_S)
+            if r.status_code == 409:
+                detail = r.json().get("detail")
+                served = detail.get("version") if isinstance(detail, dict) else None
+                continue
+            r.raise_for_status()
+            body = r.json()
+            served = body.get("version")
+            if version is None or served == version:
+                return body["sem_ids"], body["sem_scores"], body["kw_ids"], body["kw_scores"]
+        check_version(self.name, served, version)
+
+    def submit(self, vector, sem_k, query, kw_k, filters, version=None):
+        return self._executor.submit(self._call, vector, sem_k, query, kw_k, filters, version)
+
+    def close(self):
+        self._session.close()
+
+
+class ShardPool:
+    def __init__(self, shards: list):
+        self.shards = shards
+
+    def __len__(self):
+        return len(self.shards)
+
+    def search(self, vector, sem_k, query, kw_k=50, filters=None, version=None):
+        """Scatter to every shard, gather the global top lists.
+
+        Returns (sem_scores, sem_ids, kw_ids, kw_scores) like the unsharded
+        store.search_ids + keyword_rank pair. With `version` (the snapshot
+        the caller materializes rows from), a shard cut from another
+        snapshot raises ShardVersionMismatch.
+        """
+        filters = {k: v for k, v in (filters or {}).items() if v is not None}
+        futures = [s.submit(vector, sem_k, query, kw_k, filters, version) for s in self.shards]
+        parts = [f.result(timeout=SHARD_TIMEOUT_S) for f in futures]
+        return gather(parts, sem_k, kw_k)
+
+    def close(self):
+        for s in self.shards:
+            s.close()
+
+
+def open_pool(index_path: str, docstore_path: str, version=None) -> ShardPool:
+    """Remote shards from SHARD_URLS, else SEARCH_SHARDS local processes
+    over shards/ next to the docstore (built on first use if missing)."""
+    if SHARD_URLS:
+        return ShardPool([HttpShard(u) for u in SHARD_URLS])
+    root = shards_dir(docstore_path, SEARCH_SHARDS)
+    dirs = [os.path.join(root, str(i)) for i in range(SEARCH_SHARDS)]
+    if not all(os.path.exists(mapped.version_path(os.path.join(d, "docstore.jsonl"))) for d in dirs):
+        logger.info(f"Building {SEARCH_SHARDS} shards in {root}")
+        build_shards(index_path, docstore_path, SEARCH_SHARDS, version=version)
+    return ShardPool([LocalShard(d) for d in dirs])
@@ -0,0 +1,361 @@
+# snapshots.py — versioned, immutable index snapshots with atomic publish
+#
+# Layout, next to the configured docstore:
+#   snapshots/<version>/faiss_index
+#                       docstore.jsonl
+#                       keyword_index.jsonl, keywords/, columns/, ... (mapped.py)
+#                       manifest.json   checksums, embedding model, row counts
+#   CURRENT             name of the live snapshot
+#
+# Ingest builds a complete snapshot in snapshots/.staging-<version>, renames
+# it into place and then swaps CURRENT with os.replace, so readers see either
+# the old or the new snapshot, never a half-written one. Snapshots are never
+# modified after publish, except for the change log appended next to their
+# docstore (changelog.py), which the manifest doesn't checksum. Rolling back
+# is just pointing CURRENT elsewhere.
+# The newest SNAPSHOT_KEEP snapshots are kept.
+#
+# Every change to what is published (change log appends, snapshot commits,
+# compaction, rollback) runs under publish_lock(): an flock on publish.lock
+# in the data dir, so API workers, the scheduler sidecar and `test.py watch`
+# take turns, and each change starts from the snapshot before it.
+#
+# Before the first snapshot exists, paths resolve to the configured
+# INDEX_PATH / DOCSTORE_PATH files.
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+from .mapped import atomic_write_json, read_version
+from .changelog import LOG_FILE, VECTORS_FILE
+
+try:
+    import fcntl
+except ImportError:  # Windows: publishes are only serialized within one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "5"))
+
+SNAPSHOTS_DIR = "snapshots"
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "faiss_index"
+DOCSTORE_FILE = "docstore.jsonl"
+PUBLISH_LOCK_FILE = "publish.lock"
+COMPACT_LOCK_FILE = "compact.lock"
+
+
+class Snapshot:
+    """A snapshot directory being built (staging) or already published."""
+
+    def __init__(self, root: str, version: str, path: str):
+        self.root = root
+        self.version = version
+        self.path = path
+
+    @property
+    def index_path(self):
+        return os.path.join(self.path, INDEX_FILE)
+
+    @property
+    def docstore_path(self):
+        return os.path.join(self.path, DOCSTORE_FILE)
+
+
+def data_dir(docstore_path: str) -> str:
+    return os.path.dirname(docstore_path) or "."
+
+
+@contextmanager
+def _flock(path: str, blocking: bool = True):
+    """Exclusive flock on path for the block; yields whether it was taken."""
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            taken = True
+        except BlockingIOError:
+            taken = False
+        try:
+            yield taken
+        finally:
+            if taken:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# flock is per open file, so a thread already holding it must not take it again
+_publish_lock = threading.RLock()
+_publishing = threading.local()
+
+
+@contextmanager
+def publish_lock(base_dir: str):
+    """One publisher per data dir at a time, across threads and processes.
+
+    Re-entrant within a thread, so a caller can hold it around a publish
+    that takes it again.
+    """
+    with _publish_lock:
+        if getattr(_publishing, "depth", 0):
+            _publishing.depth += 1
+            try:
+                yield
+            finally:
+                _publishing.depth -= 1
+            return
+        with _flock(os.path.join(base_dir, PUBLISH_LOCK_FILE)):
+            _publishing.depth = 1
+            try:
+                yield
+            finally:
+                _publishing.depth = 0
+
+
+def compaction_lock(base_dir: str):
+    """Yields False when another process is already compacting this data dir."""
+    return _flock(os.path.join(base_dir, COMPACT_LOCK_FILE), blocking=False)
+
+
+def _root(base_dir: str) -> str:
+    return os.path.join(base_dir, SNAPSHOTS_DIR)
+
+
+def current(base_dir: str) -> str | None:
+    """Version named by CURRENT, or None before the first publish."""
+    try:
+        with open(os.path.join(base_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+    return version or None
+
+
+def _write_current(base_dir: str, version: str):
+    tmp = os.path.join(base_dir, CURRENT_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(base_dir, CURRENT_FILE))
+
+
+def resolve(index_path: str, docstore_path: str):
+    """(index_path, docstore_path, version) to read from.
+
+    The live snapshot when one is published, otherwise the configured files
+    (version None).
+    """
+    base_dir = data_dir(docstore_path)
+    version = current(base_dir)
+    if version is None:
+        return index_path, docstore_path, None
+    snap_dir = os.path.join(_root(base_dir), version)
+    return os.path.join(snap_dir, INDEX_FILE), os.path.join(snap_dir, DOCSTORE_FILE), version
+
+
+def begin(docstore_path: str) -> Snapshot:
+    """Create an empty staging directory for the next snapshot."""
+    base_dir = data_dir(docstore_path)
+    version = time.strftime("%Y%m%dT%H%M%S") + f"-{time.time_ns() % 1_000_000_000:09d}"
+    path = os.path.join(_root(base_dir), f".staging-{version}")
+    os.makedirs(path)
+    return Snapshot(base_dir, version, path)
+
+
+def abort(snap: Snapshot):
+    shutil.rmtree(snap.path, ignore_errors=True)
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _files(snap_dir: str):
+    for dirpath, _, names in os.walk(snap_dir):
+        for name in names:
+            full = os.path.join(dirpath, name)
+            rel = os.path.relpath(full, snap_dir)
+            if rel not in (MANIFEST_FILE, LOG_FILE, VECTORS_FILE) and not name.endswith(".tmp"):
+                yield rel.replace(os.sep, "/"), full
+
+
+def commit(snap: Snapshot, **meta) -> dict:
+    """Write the manifest, move the snapshot into place and make it CURRENT.
+
+    Extra keyword arguments (embedding_model, rows, ...) are recorded in the
+    manifest as-is.
+    """
+    manifest = {
+        "version": snap.version,
+        "created_at": int(time.time()),
+        "parent": current(snap.root),
+        **meta,
+        "files": {
+            rel: {"bytes": os.path.getsize(full), "sha256": _sha256(full)}
+            for rel, full in sorted(_files(snap.path))
+        },
+    }
+    atomic_write_json(os.path.join(snap.path, MANIFEST_FILE), manifest)
+
+    final = os.path.join(snap.root, SNAPSHOTS_DIR, snap.version)
+    os.replace(snap.path, final)
+    snap.path = final
+    _write_current(snap.root, snap.version)
+    logger.info(f"Published snapshot {snap.version}")
+    prune(snap.root)
+    return manifest
+
+
+def manifest(base_dir: str, version: str) -> dict | None:
+    try:
+        with open(os.path.join(_root(base_dir), version, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Published snapshots never change, so their manifests can be cached
+_manifests: dict = {}
+
+
+def describe(index_path: str, docstore_path: str) -> dict:
+    """Corpus status without reading the corpus: doc count, index ntotal,
+    version, model, last ingest time and a rows == ntotal consistency flag.
+
+    Takes the configured paths. Comes from the live snapshot's manifest, else
+    the mapped VERSION stamp, else only file times (counts unknown).
+    """
+    base_dir = data_dir(docstore_path)
+    index_path, docstore_path, version = resolve(index_path, docstore_path)
+    if version is not None:
+        key = (base_dir, version)
+        m = _manifests.get(key)
+        if m is None:
+            m = manifest(base_dir, version)
+            if m is not None:
+                if len(_manifests) >= 64:
+                    _manifests.clear()
+                _manifests[key] = m
+        if m is not None:
+            rows, ntotal = m.get("rows"), m.get("ntotal")
+            return {
+                "source": "manifest",
+                "version": version,
+                "documents": rows,
+                "index_ntotal": ntotal,
+                "model": m.get("embedding_model"),
+                "last_ingest": m.get("created_at"),
+                "consistent": rows is not None and rows == ntotal,
+            }
+
+    stamp = read_version(docstore_path)
+    if stamp is not None:
+        rows, ntotal = stamp.get("rows"), stamp.get("ntotal")
+        return {
+            "source": "stamp",
+            "version": stamp.get("version"),
+            "documents": rows,
+            "index_ntotal": ntotal,
+            "model": stamp.get("model"),
+            "last_ingest": stamp.get("created_at"),
+            "consistent": None if ntotal is None else rows == ntotal,
+        }
+
+    times = [os.path.getmtime(p) for p in (index_path, docstore_path) if os.path.exists(p)]
+    return {
+        "source": "files",
+        "version": None,
+        "documents": None,
+        "index_ntotal": None,
+        "model": None,
+        "last_ingest": int(max(times)) if times else None,
+        "consistent": None,
+    }
+
+
+def list_snapshots(base_dir: str) -> list:
+    """Manifests of published snapshots, newest first."""
+    root = _root(base_dir)
+    if not os.path.isdir(root):
+        return []
+    found = []
+    for name in os.listdir(root):
+        if name.startswith("."):
+            continue
+        m = manifest(base_dir, name)
+        if m is not None:
+            found.append(m)
+    found.sort(key=lambda m: (m.get("created_at", 0), m["version"]), reverse=True)
+    return found
+
+
+def verify(base_dir: str, version: str) -> list:
+    """Files whose size or checksum no longer matches the manifest (empty if intact)."""
+    m = manifest(base_dir, version)
+    if m is None:
+        return [MANIFEST_FILE]
+    snap_dir = os.path.join(_root(base_dir), version)
+    bad = []
+    for rel, info in m["files"].items():
+        full = os.path.join(snap_dir, rel)
+        if not os.path.exists(full) or os.path.getsize(full) != info["bytes"] or _sha256(full) != info["sha256"]:
+            bad.append(rel)
+    return bad
+
+
+def activate(base_dir: str, version: str, check: bool = True) -> dict:
+    """Point CURRENT at an existing snapshot; serving workers pick it up on their next request."""
+    m = manifest(base_dir, version)
+    if m is None:
+        raise ValueError(f"Unknown snapshot '{version}'")
+    if check:
+        bad = verify(base_dir, version)
+        if bad:
+            raise ValueError(f"Snapshot '{version}' is corrupt: {', '.join(bad)}")
+    with publish_lock(base_dir):
+        _write_current(base_dir, version)
+    logger.info(f"Activated snapshot {version}")
+    return m
+
+
+def rollback(base_dir: str, version: str | None = None, check: bool = True) -> dict:
+    """Activate `version`, or the snapshot published before the current one."""
+    if version is None:
+        versions = [m["version"] for m in list_snapshots(base_dir)]
+        live = current(base_dir)
+        pos = versions.index(live) + 1 if live in versions else 0
+        if pos >= len(versions):
+            raise ValueError("No earlier snapshot to roll back to")
+        version = versions[pos]
+    return activate(base_dir, version, check=check)
+
+
+def prune(base_dir: str, keep: int | None = None):
+    """Delete all but the newest `keep` snapshots (never the live one) and stale staging dirs."""
+    keep = SNAPSHOT_KEEP if keep is None else keep
+    live = current(base_dir)
+    for m in list_snapshots(base_dir)[max(keep, 1):]:
+        if m["version"] != live:
+            shutil.rmtree(os.path.join(_root(base_dir), m["version"]), ignore_errors=True)
+            logger.info(f"Pruned snapshot {m['version']}")
+    root = _root(base_dir)
+    cutoff = time.time() - 24 * 3600
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.startswith(".staging-") and os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
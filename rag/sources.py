@@ -0,0 +1,124 @@
+# sources.py — directory-driven registry of manual source files
+#
+# Instead of relying only on the hand-kept lists in data.py, every file
+# under SOURCE_DIRS (default ./manual_data) with a known extension is a
+# source:
+#   .pdf -> manual_pdf, .docx -> manual_docx, .txt / .md -> manual_text
+# Files still listed in data.py are included when they exist; listed files
+# that are missing are reported once instead of failing on every ingest.
+#
+# watch() polls the registry and re-ingests just the files that were added,
+# modified or deleted, through the scheduler's per-source replace path. It
+# runs in its own process, so each re-ingest holds the data dir's publish
+# lock (snapshots.publish_lock) from reading the live snapshot to writing
+# schedule.json, taking turns with API ingests and the scheduler.
+
+import os
+import time
+import logging
+
+from .data import PDF_FILES, DOCX_FILES, TEXT_FILES
+
+logger = logging.getLogger(__name__)
+
+SOURCE_DIRS = [d for d in os.getenv("SOURCE_DIRS", "./manual_data").split(";") if d]
+WATCH_INTERVAL_S = float(os.getenv("WATCH_INTERVAL_S", "2"))
+
+EXTENSIONS = {
+    ".pdf": "manual_pdf",
+    ".docx": "manual_docx",
+    ".txt": "manual_text",
+    ".md": "manual_text",
+}
+
+_reported_missing: set = set()
+
+
+def _norm(path: str) -> str:
+    # data.py entries look like ./manual_data/x.txt; keep that form for scanned files too
+    return path if os.path.isabs(path) or path.startswith(".") else os.path.join(".", path)
+
+
+def scan(dirs: list | None = None) -> dict:
+    """path -> source_type for every recognised file under `dirs` plus existing data.py entries."""
+    found = {}
+    for root in SOURCE_DIRS if dirs is None else dirs:
+        for dirpath, dirnames, names in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            for name in sorted(names):
+                source_type = EXTENSIONS.get(os.path.splitext(name)[1].lower())
+                if source_type and not name.startswith((".", "~$")):
+                    found[_norm(os.path.join(dirpath, name))] = source_type
+
+    listed = [("manual_pdf", PDF_FILES), ("manual_docx", DOCX_FILES), ("manual_text", TEXT_FILES)]
+    for source_type, paths in listed:
+        for path in paths:
+            if os.path.exists(path):
+                found.setdefault(path, source_type)
+            elif path not in _reported_missing:
+                _reported_missing.add(path)
+                logger.warning(f"Source listed in data.py does not exist: {path}")
+    return found
+
+
+def by_type(registry: dict | None = None) -> dict:
+    """source_type -> [paths], in ingest's per-type shape."""
+    registry = scan() if registry is None else registry
+    out = {"manual_pdf": [], "manual_docx": [], "manual_text": []}
+    for path, source_type in registry.items():
+        out[source_type].append(path)
+    return out
+
+
+def _stats(registry: dict) -> dict:
+    stats = {}
+    for path in registry:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        stats[path] = (st.st_mtime_ns, st.st_size)
+    return stats
+
+
+def watch(index_path: str, docstore_path: str, embedding_model: str, interval_s: float | None = None, stop=None):
+    """Poll SOURCE_DIRS and re-ingest files that were added, changed or deleted.
+
+    A change is acted on once the file's size/mtime is the same on two
+    polls in a row, so half-copied files aren't ingested. `stop` is an
+    optional threading.Event.
+    """
+    from . import scheduler
+    from . import snapshots
+
+    def reingest(**kwargs):
+        with snapshots.publish_lock(snapshots.data_dir(docstore_path)):
+            return scheduler.run_once(index_path, docstore_path, embedding_model, files_only=True, **kwargs)
+
+    interval_s = WATCH_INTERVAL_S if interval_s is None else interval_s
+    # catch up on anything that changed while nobody was watching
+    result = reingest(force=True)
+    registry = scan()
+    logger.info(f"Watching {', '.join(SOURCE_DIRS)}: {len(registry)} files, {result['changed']} changed since last run")
+    seen = _stats(registry)
+    previous = dict(seen)
+
+    while stop is None or not stop.is_set():
+        time.sleep(interval_s)
+        current = _stats(scan())
+        changed = {p for p in set(current) | set(seen) if current.get(p) != seen.get(p)}
+        # settled: same reading as the previous poll
+        ready = {p for p in changed if current.get(p) == previous.get(p)}
+        previous = current
+        if not ready:
+            continue
+        result = reingest(paths=ready)
+        logger.info(
+            f"Re-ingested {result['changed']} of {len(ready)} changed files "
+            f"({result['chunks']} chunks, snapshot {result['snapshot']})"
+        )
+        for p in ready:
+            if p in current:
+                seen[p] = current[p]
+            else:
+                seen.pop(p, None)
@@ -20,22 +20,28 @@ def split_text(text: str, chunk_size=None, overlap=None):
 
     if chunk_size <= 0:
         return [text]
-    if overlap < 0:
-        overlap = 0
 
-    chunks = []
+    return [text[start:end] for start, end in split_spans(text, chunk_size, overlap)]
+
+
+def split_spans(text: str, chunk_size: int, overlap: int = 0):
+    """(start, end) character offsets of the chunks split_text() would return."""
+    if chunk_size <= 0:
+        return [(0, len(text))]
+    overlap = max(overlap, 0)
+
+    spans = []
     start = 0
     length = len(text)
     while start < length:
-        end = start + chunk_size
-        chunk = text[start:end]
+        end = min(start + chunk_size, length)
         # extend end to nearest whitespace to avoid cutting inside a word
         if end < length:
             while end < length and not text[end].isspace() and (end - start) < (chunk_size + 40):
                 end += 1
-            chunk = text[start:end]
-        chunks.append(chunk)
+        spans.append((start, end))
         if end >= length:
             break
-        start = max(0, end - overlap)
-    return chunks
+        # always move forward, even if overlap >= chunk_size
+        start = end - overlap if end - overlap > start else end
+    return spans
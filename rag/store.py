@@ -1,59 +1,156 @@
 import faiss
 import numpy as np
 import os, json
+import logging
 from typing import List
 
+logger = logging.getLogger(__name__)
+
 class Doc:
     def __init__(self, text, meta):
         self.text = text
         self.meta = meta
 
 
+# Any faiss.index_factory string (inner-product metric), e.g. "Flat", "IVF1024,Flat", "HNSW32"
+INDEX_FACTORY = os.getenv('FAISS_INDEX_FACTORY', 'Flat')
+NPROBE = int(os.getenv('FAISS_NPROBE', '16'))
+EF_SEARCH = int(os.getenv('FAISS_EF_SEARCH', '64'))
+
+# Flat-code mmap needs faiss >= 1.11; older builds can only map IVF lists
+_MMAP_FLAG = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+_MMAP_FLAT = hasattr(faiss, 'IO_FLAG_MMAP_IFC')
+_warned_mmap = False
+
+
+def _warn_private_copy():
+    global _warned_mmap
+    if not _warned_mmap:
+        _warned_mmap = True
+        logger.warning(
+            f"faiss {faiss.__version__} cannot memory-map non-IVF indexes (needs >= 1.11); "
+            "each worker loads a private copy of the index"
+        )
+
+
 class FaissStore:
-    def __init__(self, dim, index_path, docstore_path):
+    def __init__(self, dim, index_path, docstore_path, index_factory=None):
         self.dim = dim
         self.index_path = index_path
         self.docstore_path = docstore_path
+        self.index_factory = index_factory or INDEX_FACTORY
         self.index = None
         self.docstore = []
 
-    def load_or_create(self):
+    def _new_index(self):
+        if self.index_factory == 'Flat':
+            return faiss.IndexFlatIP(self.dim)
+        return faiss.index_factory(self.dim, self.index_factory, faiss.METRIC_INNER_PRODUCT)
+
+    def _configure(self):
+        """Apply query-time knobs for approximate index types."""
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            ivf.nprobe = NPROBE
+        if hasattr(self.index, 'hnsw'):
+            self.index.hnsw.efSearch = EF_SEARCH
+
+    def load_or_create(self, with_docstore=True, mmap=False):
+        """Load the index (and docstore) from disk, or start empty.
+
+        mmap=True maps the stored vectors read-only (IO_FLAG_MMAP_IFC) so
+        several worker processes share them through the page cache; such an
+        index cannot be upserted into.
+        """
         if os.path.exists(self.index_path):
-            self.index = faiss.read_index(self.index_path)
+            flags = _MMAP_FLAG | faiss.IO_FLAG_READ_ONLY if mmap else 0
+            self.index = faiss.read_index(self.index_path, flags)
+            if mmap and not _MMAP_FLAT and faiss.try_extract_index_ivf(self.index) is None:
+                _warn_private_copy()
         else:
-            self.index = faiss.IndexFlatIP(self.dim)
-        if os.path.exists(self.docstore_path):
+            self.index = self._new_index()
+        self._configure()
+        if with_docstore and os.path.exists(self.docstore_path):
             with open(self.docstore_path,'r',encoding='utf-8') as f:
                 for line in f:
                     self.docstore.append(json.loads(line))
 
     def persist(self):
         os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
-        faiss.write_index(self.index, self.index_path)
-        with open(self.docstore_path,'w',encoding='utf-8') as f:
+        # write-then-rename: serving workers may have the old files mapped
+        faiss.write_index(self.index, self.index_path + '.tmp')
+        os.replace(self.index_path + '.tmp', self.index_path)
+        with open(self.docstore_path + '.tmp','w',encoding='utf-8') as f:
             for d in self.docstore:
                 f.write(json.dumps(d, ensure_ascii=False)+'\n')
+        os.replace(self.docstore_path + '.tmp', self.docstore_path)
 
     def upsert(self, embeddings: List[List[float]], docs: List[Doc]):
         vecs = np.array(embeddings).astype('float32')
-        if self.index.ntotal == 0:
-            # convert to inner product by normalizing
-            faiss.normalize_L2(vecs)
-            self.index.add(vecs)
-        else:
-            faiss.normalize_L2(vecs)
-            self.index.add(vecs)
+        # convert to inner product by normalizing
+        faiss.normalize_L2(vecs)
+        if not self.index.is_trained:
+            # IVF / PQ indexes learn their quantizers from the first batch
+            self.index.train(vecs)
+        self.index.add(vecs)
         for d in docs:
             self.docstore.append({'text': d.text, **d.meta})
 
-    def search(self, query_emb, k=5):
-        import numpy as np
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    def vectors(self):
+        """All stored (normalized) vectors, in row order."""
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            ivf.make_direct_map()
+        return self.index.reconstruct_n(0, self.index.ntotal)
+
+    def keep_rows(self, rows):
+        """Drop every row not in `rows` (ascending), keeping vectors and docstore aligned.
+
+        The index is rebuilt from the stored vectors (same trained type), so
+        nothing is re-embedded and row ids stay contiguous.
+        """
+        vectors = self.vectors()
+        index = faiss.clone_index(self.index)
+        index.reset()
+        if len(rows):
+            index.add(vectors[np.asarray(rows, dtype='int64')])
+        self.index = index
+        self._configure()
+        self.docstore = [self.docstore[r] for r in rows]
+
+    def search_ids(self, query_emb, k=5, mask=None):
+        """Top-k (scores, row ids) by inner product as arrays.
+
+        `mask` (bool per row) restricts the search inside FAISS via an ID
+        selector instead of filtering afterwards.
+        """
         vec = np.array([query_emb]).astype('float32')
         faiss.normalize_L2(vec)
-        D, I = self.index.search(vec, k)
+        if mask is None:
+            D, I = self.index.search(vec, k)
+        else:
+            from .filters import faiss_selector_params
+            ntotal = self.index.ntotal
+            if len(mask) < ntotal:
+                # rows the mask doesn't know about are excluded (selector has no bounds check)
+                mask = np.concatenate([mask, np.zeros(ntotal - len(mask), dtype=bool)])
+            k = min(k, int(np.count_nonzero(mask[:ntotal])))
+            if k <= 0:
+                return np.zeros(0, dtype='float32'), np.zeros(0, dtype='int64')
+            params, _bitmap = faiss_selector_params(mask, self.index)
+            D, I = self.index.search(vec, k, params=params)
+        keep = I[0] >= 0
+        return D[0][keep], I[0][keep]
+
+    def search(self, query_emb, k=5, mask=None):
+        D, I = self.search_ids(query_emb, k, mask)
         results = []
-        for score, idx in zip(D[0].tolist(), I[0].tolist()):
-            if idx < 0 or idx >= len(self.docstore):
+        for score, idx in zip(D.tolist(), I.tolist()):
+            if idx >= len(self.docstore):
                 continue
             doc = self.docstore[idx]
             results.append({'text': doc.get('text'), 'score': float(score), 'url': doc.get('url'), 'title': doc.get('title')})
@@ -10,9 +10,25 @@ pkg_root = Path(__file__).resolve().parents[1]
 if str(pkg_root) not in sys.path:
     sys.path.insert(0, str(pkg_root))
 
-from rag.ingest import ingest
+from rag.ingest import ingest, compact
 from rag.store import FaissStore
+from rag import snapshots
+from rag import shards
+from rag import scheduler
+from rag import sources
+from rag import columnar
+from rag import profiling
+from rag import changelog
 from rag.embeddings import get_embedding_model
+from rag.bench import (
+    bench_clean,
+    bench_search,
+    bench_ingest,
+    write_report,
+    DEFAULT_PAGES_DIR,
+    DEFAULT_INGEST_FIXTURES,
+)
+from rag.loadtest import run_loadtest, load_query_log, in_process_app
 
 DEFAULT_URL = "https://cse.knu.ac.kr/index.php"
 DEFAULT_QUERY = "현장실습"
@@ -23,6 +39,7 @@ DEFAULT_INDEX_PATH = os.getenv('INDEX_PATH', "./data/test/faiss_index")
 DEFAULT_DOCSTORE_PATH = os.getenv('DOCSTORE_PATH', "./data/test/docstore.jsonl")
 DEFAULT_DELAY_MS = int(os.getenv('CRAWL_DELAY_MS', '1000'))
 DEFAULT_EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+DEFAULT_SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', "./data/test/slow_queries.jsonl")
 
 
 def derive_allowlist(url: str) -> str:
@@ -31,8 +48,8 @@ def derive_allowlist(url: str) -> str:
 
 
 def load_store(index_path: str, docstore_path: str, dim: int) -> FaissStore:
-    store = FaissStore(dim, index_path, docstore_path)
-    store.load_or_create()
+    index_path, docstore_path, _ = snapshots.resolve(index_path, docstore_path)
+    store, _, _, _ = changelog.load(index_path, docstore_path, dim)
     return store
 
 
@@ -53,19 +70,40 @@ def cmd_ingest(args):
     print(json.dumps(stats, ensure_ascii=False, indent=2))
 
 
-def _count_docstore(docstore_path: str) -> int:
-    if not os.path.exists(docstore_path):
-        return 0
-    total = 0
-    with open(docstore_path, 'r', encoding='utf-8') as f:
-        for _ in f:
-            total += 1
-    return total
+def cmd_health(args):
+    status = snapshots.describe(args.index_path, args.docstore_path)
+    print(json.dumps({"ok": True, **status}, ensure_ascii=False, indent=2))
 
 
-def cmd_health(args):
-    total = _count_docstore(args.docstore_path)
-    print(json.dumps({"ok": True, "documents": total}, ensure_ascii=False, indent=2))
+def cmd_snapshots(args):
+    base_dir = snapshots.data_dir(args.docstore_path)
+    resp = {
+        "current": snapshots.current(base_dir),
+        "snapshots": [{k: v for k, v in m.items() if k != "files"} for m in snapshots.list_snapshots(base_dir)],
+    }
+    if args.verify:
+        resp["corrupt"] = {}
+        for m in resp["snapshots"]:
+            bad = snapshots.verify(base_dir, m["version"])
+            if bad:
+                resp["corrupt"][m["version"]] = bad
+    print(json.dumps(resp, ensure_ascii=False, indent=2))
+
+
+def cmd_shard(args):
+    compact(args.index_path, args.docstore_path)
+    index_path, docstore_path, version = snapshots.resolve(args.index_path, args.docstore_path)
+    paths = shards.build_shards(index_path, docstore_path, args.shards, key=args.key, version=version)
+    print(json.dumps({"snapshot": version, "shards": paths}, ensure_ascii=False, indent=2))
+
+
+def cmd_rollback(args):
+    base_dir = snapshots.data_dir(args.docstore_path)
+    try:
+        m = snapshots.rollback(base_dir, args.version, check=not args.no_verify)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(json.dumps({"ok": True, "current": m["version"], "rows": m.get("rows")}, ensure_ascii=False, indent=2))
 
 
 def _search_common(query: str, k: int, index_path: str, docstore_path: str, model_name: str):
@@ -104,6 +142,139 @@ def cmd_retrieve(args):
     print(json.dumps(resp, ensure_ascii=False, indent=2))
 
 
+def cmd_bench_clean(args):
+    stats = bench_clean(args.pages_dir, repeat=args.repeat, site=args.site)
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+
+
+def _int_list(value: str):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def cmd_bench_search(args):
+    queries = None
+    if args.queries_file:
+        with open(args.queries_file, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    report = bench_search(
+        sizes=_int_list(args.sizes),
+        n_queries=args.queries,
+        k=args.k,
+        threads=_int_list(args.threads),
+        dim=args.dim,
+        index_factory=args.index_factory,
+        seed=args.seed,
+        queries=queries,
+        work_dir=args.work_dir,
+        semantic_cache=args.semantic_cache,
+    )
+    if args.out:
+        write_report(report, args.out)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+def cmd_bench_ingest(args):
+    dirs = args.fixtures.split(";") if args.fixtures else DEFAULT_INGEST_FIXTURES
+    report = bench_ingest(
+        fixture_dirs=dirs,
+        model=args.model,
+        repeat=args.repeat,
+        trace_memory=args.trace_memory,
+        work_dir=args.work_dir,
+    )
+    if args.out:
+        write_report(report, args.out)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+def cmd_loadtest(args):
+    app, queries = None, None
+    if not args.base_url:
+        app, queries = in_process_app(synthetic=args.synthetic, dim=args.dim, work_dir=args.work_dir)
+    if args.queries:
+        queries = load_query_log(args.queries)
+    report = run_loadtest(
+        levels=_int_list(args.levels),
+        queries=queries,
+        base_url=args.base_url,
+        app=app,
+        duration_s=args.duration,
+        requests_per_level=args.requests,
+        ingest_interval_s=args.ingest_interval if args.mixed else None,
+        semantic_cache=args.semantic_cache,
+    )
+    if args.out:
+        write_report(report, args.out)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+def cmd_schedule(args):
+    if args.status:
+        print(json.dumps(scheduler.status(args.docstore_path), ensure_ascii=False, indent=2))
+        return
+    if args.once:
+        result = scheduler.run_once(args.index_path, args.docstore_path, args.model, force=args.force)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+    # sidecar: refresh until interrupted
+    sched = scheduler.Scheduler(args.index_path, args.docstore_path, args.model)
+    if not sched.acquire():
+        print("Scheduler already running for this data dir.")
+        return
+    try:
+        sched.run_forever()
+    except KeyboardInterrupt:
+        sched.stop()
+
+
+def cmd_sources(args):
+    registry = sources.scan(args.dir or None)
+    print(json.dumps({"dirs": args.dir or sources.SOURCE_DIRS, "files": registry}, ensure_ascii=False, indent=2))
+
+
+def cmd_watch(args):
+    try:
+        sources.watch(args.index_path, args.docstore_path, args.model, interval_s=args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def cmd_export(args):
+    info = columnar.export_store(args.out, args.index_path, args.docstore_path, batch_rows=args.batch)
+    print(json.dumps(info, ensure_ascii=False, indent=2))
+
+
+def cmd_import(args):
+    m = columnar.import_store(
+        args.src,
+        args.index_path,
+        args.docstore_path,
+        index_factory=args.index_factory,
+        embedding_model=args.model,
+        batch_rows=args.batch,
+    )
+    print(json.dumps({k: v for k, v in m.items() if k != "files"}, ensure_ascii=False, indent=2))
+
+
+def cmd_compact(args):
+    _, docstore_path, version = snapshots.resolve(args.index_path, args.docstore_path)
+    before = changelog.status(docstore_path) if version else None
+    m = compact(args.index_path, args.docstore_path)
+    resp = {"compacted": m is not None, "snapshot": version, "changelog": before}
+    if m is not None:
+        resp["current"] = m["version"]
+        resp["rows"] = m.get("rows")
+    print(json.dumps(resp, ensure_ascii=False, indent=2))
+
+
+def cmd_slow_queries(args):
+    log = profiling.SlowQueryLog(args.log)
+    queries = log.slowest(args.n)
+    if not args.profile:
+        queries = [{k: v for k, v in q.items() if k != "profile"} for q in queries]
+    print(json.dumps({"log": log.path, "queries": queries}, ensure_ascii=False, indent=2))
+
+
 def build_parser():
     p = argparse.ArgumentParser(description="Local RAG test tool (mirrors API outputs).")
     sub = p.add_subparsers(dest="command", required=True)
@@ -120,10 +291,86 @@ def build_parser():
     sp_ingest.set_defaults(func=cmd_ingest)
 
     # health
-    sp_health = sub.add_parser("health", help="Show docstore count (like /rag/health).")
+    sp_health = sub.add_parser("health", help="Show corpus status from the snapshot manifest (like /rag/health).")
+    sp_health.add_argument("--index-path", default=DEFAULT_INDEX_PATH)
     sp_health.add_argument("--docstore-path", default=DEFAULT_DOCSTORE_PATH)
     sp_health.set_defaults(func=cmd_health)
 
+    # snapshots
+    sp_snapshots = sub.add_parser("snapshots", help="List published index snapshots.")
+    sp_snapshots.add_argument("--docstore-path", default=DEFAULT_DOCSTORE_PATH)
+    sp_snapshots.add_argument("--verify", action="store_true", help="Also re-check manifest checksums.")
+    sp_snapshots.set_defaults(func=cmd_snapshots)
+
+    # rollback
+    sp_rollback = sub.add_parser("rollback", help="Make an earlier snapshot CURRENT (running servers switch on their next request).")
+    sp_rollback.add_argument("--docstore-path", default=DEFAULT_DOCSTORE_PATH)
+    sp_rollback.add_argument("--version", default=None, help="Snapshot to activate (default: the one before CURRENT).")
+    sp_rollback.add_argument("--no-verify", action="store_true", help="Skip the checksum check.")
+    sp_rollback.set_defaults(func=cmd_rollback)
+
+    # shard
+    sp_shard = sub.add_parser("shard", help="Split the current snapshot into shard dirs (for SEARCH_SHARDS / SHARD_URLS).")
+    sp_shard.add_argument("--index-path", default=DEFAULT_INDEX_PATH)
+    sp_shard.add_argument("--docstore-path", default=DEFAULT_DOCSTORE_PATH)
+    sp_shard.add_argument("--shards", type=int, default=max(shards.SEARCH_SHARDS, 2))
+    sp_shard.add_argument("--key", choices=["hash", "source"], default=shards.SHARD_KEY)
+    sp_shard.set_defaults(func=cmd_shard)
+
+    # schedule
+    sp_schedule = sub.add_parser("schedule", help="Refresh changed sources on their own intervals (sidecar scheduler).")
+    sp_schedule.add_argument("--index-path", default=DEFAULT_INDEX_PATH)
+    sp_schedule.add_argument("--docstore-path", default=DEFAULT_DOCSTORE_PATH)
+    sp_schedule.add_argument("--model", default=DEFAULT_EMBEDDING_MODEL)
+    sp_schedule.add_argument("--once", action="store_true", help="Run one tick and exit.")
+    sp_schedule.add_argument("--force", action="store_true", help="With --once: check every source, due or not.")
+    sp_schedule.add_argument("--status", action="store_true", help="Print intervals and change rates.")
+    sp_schedule.set_defaults(func=cmd_schedule)
+
+    # sources
+    sp_sources = sub.add_parser("sources", help="List the manual files the source registry finds.")
+    sp_sources.add_argument("--dir", action="append", default=None, help="Scan this directory instead of SOURCE_DIRS (repeatable).")
+    sp_sources.set_defaults(func=cmd_sources)
+
+    # watch
+    sp_watch = sub.add_parser("watch", help="Re-ingest manual files as they are added, changed or deleted.")
+    sp_watch.add_argument("--index-path", default=DEFAULT_INDEX_PATH)
+    sp_watch.add_argument("--docstore-path", default=DEFAULT_DOCSTORE_PATH)
+    sp_watch.add_argument("--model", default=DEFAULT_EMBEDDING_MODEL)
+    sp_watch.add_argument("--interval", type=float, default=sources.WATCH_INTERVAL_S, help="Seconds between polls.")
+    sp_watch.set_defaults(func=cmd_watch)
+
+    # export
+    sp_export = sub.add_parser("export", help="Export the current snapshot as vectors.npy + per-field column files.")
+    sp_export.add_argument("--out", required=True, help="Directory to write the export to.")
+    sp_export.add_argument("--index-path", default=DEFAULT_INDEX_PATH)
+    sp_export.add_argument("--docstore-path", default=DEFAULT_DOCSTORE_PATH)
+    sp_export.add_argument("--batch", type=int, default=None, help="Rows per streamed batch (default COLUMNAR_BATCH_ROWS).")
+    sp_export.set_defaults(func=cmd_export)
+
+    # import
+    sp_import = sub.add_parser("import", help="Publish an export as a new snapshot, re-indexed without re-embedding.")
+    sp_import.add_argument("--src", required=True, help="Directory written by export.")
+    sp_import.add_argument("--index-path", default=DEFAULT_INDEX_PATH)
+    sp_import.add_argument("--docstore-path", default=DEFAULT_DOCSTORE_PATH)
+    sp_import.add_argument("--index-factory", default=None, help="FAISS index_factory string (default FAISS_INDEX_FACTORY).")
+    sp_import.add_argument("--model", default=None, help="Embedding model to record (default: the one in the export).")
+    sp_import.add_argument("--batch", type=int, default=None, help="Rows per streamed batch (default COLUMNAR_BATCH_ROWS).")
+    sp_import.set_defaults(func=cmd_import)
+
+    # compact
+    sp_compact = sub.add_parser("compact", help="Fold the live snapshot's change log into a new snapshot.")
+    sp_compact.add_argument("--index-path", default=DEFAULT_INDEX_PATH)
+    sp_compact.add_argument("--docstore-path", default=DEFAULT_DOCSTORE_PATH)
+    sp_compact.set_defaults(func=cmd_compact)
+
+    # slow-queries
+    sp_slow = sub.add_parser("slow-queries", help="Slowest recent queries from the slow-query log (like /rag/admin/slow-queries).")
+    sp_slow.add_argument("--log", default=DEFAULT_SLOW_QUERY_LOG)
+    sp_slow.add_argument("-n", type=int, default=20)
+    sp_slow.add_argument("--profile", action="store_true", help="Include sampled cProfile tops.")
+    sp_slow.set_defaults(func=cmd_slow_queries)
+
     # search
     sp_search = sub.add_parser("search", help="Semantic search (like /rag/search).")
     sp_search.add_argument("--query", required=True)
@@ -142,6 +389,54 @@ def build_parser():
     sp_retrieve.add_argument("--model", default=DEFAULT_EMBEDDING_MODEL)
     sp_retrieve.set_defaults(func=cmd_retrieve)
 
+    # bench-clean
+    sp_bench_clean = sub.add_parser("bench-clean", help="Cleaner throughput (pages/sec) over saved pages.")
+    sp_bench_clean.add_argument("--pages-dir", default=str(DEFAULT_PAGES_DIR))
+    sp_bench_clean.add_argument("--repeat", type=int, default=20)
+    sp_bench_clean.add_argument("--site", default="cse.knu.ac.kr")
+    sp_bench_clean.set_defaults(func=cmd_bench_clean)
+
+    # bench-search
+    sp_bench_search = sub.add_parser("bench-search", help="Offline retrieval benchmark on synthetic corpora.")
+    sp_bench_search.add_argument("--sizes", default="10000", help="Comma-separated corpus sizes (chunks).")
+    sp_bench_search.add_argument("--queries", type=int, default=200)
+    sp_bench_search.add_argument("--queries-file", default=None, help="Replay these queries (one per line) instead.")
+    sp_bench_search.add_argument("-k", type=int, default=DEFAULT_K)
+    sp_bench_search.add_argument("--threads", default="1,4", help="Comma-separated thread counts for QPS.")
+    sp_bench_search.add_argument("--dim", type=int, default=384)
+    sp_bench_search.add_argument("--index-factory", default="Flat")
+    sp_bench_search.add_argument("--seed", type=int, default=13)
+    sp_bench_search.add_argument("--work-dir", default=None)
+    sp_bench_search.add_argument("--semantic-cache", action="store_true", help="Keep the semantic answer cache on (default: bypassed).")
+    sp_bench_search.add_argument("--out", default=None, help="Write the JSON report here.")
+    sp_bench_search.set_defaults(func=cmd_bench_search)
+
+    # bench-ingest
+    sp_bench_ingest = sub.add_parser("bench-ingest", help="Offline ingest benchmark over saved fixtures.")
+    sp_bench_ingest.add_argument("--fixtures", default=None, help="';'-separated fixture dirs (default: rag/fixtures;manual_data).")
+    sp_bench_ingest.add_argument("--model", default="hash:384", help="Embedding model (hash:<dim> runs offline).")
+    sp_bench_ingest.add_argument("--repeat", type=int, default=1)
+    sp_bench_ingest.add_argument("--trace-memory", action="store_true", help="Also report Python peak allocations (slower).")
+    sp_bench_ingest.add_argument("--work-dir", default=None)
+    sp_bench_ingest.add_argument("--out", default=None, help="Write the JSON report here.")
+    sp_bench_ingest.set_defaults(func=cmd_bench_ingest)
+
+    # loadtest
+    sp_loadtest = sub.add_parser("loadtest", help="Concurrency sweep against the HTTP service.")
+    sp_loadtest.add_argument("--base-url", default=None, help="Running server (default: in-process app).")
+    sp_loadtest.add_argument("--levels", default="1,2,4,8,16", help="Comma-separated concurrency levels.")
+    sp_loadtest.add_argument("--duration", type=float, default=10.0, help="Seconds per level.")
+    sp_loadtest.add_argument("--requests", type=int, default=None, help="Cap on requests per level.")
+    sp_loadtest.add_argument("--queries", default=None, help="Query log: one query per line, or JSONL of /rag/search params.")
+    sp_loadtest.add_argument("--mixed", action="store_true", help="Run POST /rag/ingest in the background.")
+    sp_loadtest.add_argument("--ingest-interval", type=float, default=5.0, help="Seconds between ingest runs with --mixed.")
+    sp_loadtest.add_argument("--synthetic", type=int, default=0, help="In-process only: serve an N-chunk synthetic corpus with the hash embedder.")
+    sp_loadtest.add_argument("--dim", type=int, default=384)
+    sp_loadtest.add_argument("--work-dir", default=None)
+    sp_loadtest.add_argument("--semantic-cache", action="store_true", help="Let searches use the semantic answer cache (default: cache=false).")
+    sp_loadtest.add_argument("--out", default=None, help="Write the JSON report here.")
+    sp_loadtest.set_defaults(func=cmd_loadtest)
+
     return p
 
 
@@ -157,4 +452,20 @@ if __name__ == "__main__":
 # python RagService\src\rag\test.py ingest
 # python RagService\src\rag\test.py search --query "현장실습" -k 5
 # python RagService\src\rag\test.py retrieve --query "현장실습" -k 5
-# python RagService\src\rag\test.py health
\ No newline at end of file
+# python RagService\src\rag\test.py health
+# python RagService\src\rag\test.py snapshots --verify
+# python RagService\src\rag\test.py rollback
+# python RagService\src\rag\test.py shard --shards 4
+# python RagService\src\rag\test.py schedule
+# python RagService\src\rag\test.py schedule --once --force
+# python RagService\src\rag\test.py sources
+# python RagService\src\rag\test.py watch --interval 2
+# python RagService\src\rag\test.py export --out export/
+# python RagService\src\rag\test.py import --src export/ --index-factory "IVF256,Flat"
+# python RagService\src\rag\test.py compact
+# python RagService\src\rag\test.py slow-queries -n 10
+# python RagService\src\rag\test.py bench-clean --repeat 50
+# python RagService\src\rag\test.py bench-search --sizes 10000,100000 --threads 1,4,8 --out bench/search.json
+# python RagService\src\rag\test.py bench-ingest --repeat 3 --out bench/ingest.json
+# python RagService\src\rag\test.py loadtest --synthetic 20000 --levels 1,4,16 --duration 5
+# python RagService\src\rag\test.py loadtest --base-url http://localhost:8000 --queries queries.jsonl --mixed --out bench/load.json